@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Cold start benchmark of the lambda handlers.
+
+Each run is a new python process : the handler module is imported, then
+invoked once. AWS calls are answered by the synthetic account of
+bench/fake_aws.py, no AWS account is needed. The update lambda is invoked
+with the force refresh request of one user : it creates its IAM and SES
+clients, loads the email template and sends the email.
+
+usage: python bench/bench_cold_start.py [runs]
+"""
+
+import os
+import sys
+import json
+import tempfile
+import statistics
+import subprocess
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+SRC = os.path.join(BENCH, '..', 'src')
+
+CHILD = '''
+import os, sys, json, time
+sys.path.insert(0, {src!r})
+sys.path.insert(0, {bench!r})
+start = time.perf_counter()
+import {module} as handler
+import_time = time.perf_counter() - start
+
+start = time.perf_counter()
+import boto3
+from fake_aws import FakeAws
+fake = FakeAws({users})
+boto3.setup_default_session()
+fake.install(boto3.DEFAULT_SESSION)
+event = {event}
+setup_time = time.perf_counter() - start
+
+class Context:
+    invoked_function_arn = 'arn:aws:lambda:eu-west-1:123456789012:function:bench'
+    def get_remaining_time_in_millis(self):
+        return 300000
+
+start = time.perf_counter()
+handler.main(event, Context())
+invoke_time = time.perf_counter() - start
+assert fake.emails == {emails}, 'the update lambda has not sent the new credentials'
+print(json.dumps({{'import': import_time, 'setup': setup_time, 'invoke': invoke_time}}))
+'''
+
+# force refresh request of the first user with a verified email ( login profile and access keys replaced, one email sent )
+UPDATE_EVENT = '''{'Records': [{'messageId': '1', 'body': json.dumps({'force': True, 'user_name': next(
+    x.name for x in fake._users.values() if x.tags.get('IamRotateCredentials:Email', '').endswith('@example.com'))})}]}'''
+
+# module, users of synthetic account, event ( python expression ), emails sent
+HANDLERS = [
+    ('lambdaFindUsersToRefreshHandler', 0, '{}', 0),
+    ('lambdaUpdateIamCredentialsForUserHandler', 10, UPDATE_EVENT, 1)
+]
+
+def run_child(module, users, event, emails):
+    env = dict(os.environ)
+    env.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+    env.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    env.setdefault('AWS_SQS_REQUEST_URL', 'https://sqs.eu-west-1.amazonaws.com/123456789012/bench')
+    env.setdefault('AWS_SNS_RESULT_ARN', 'arn:aws:sns:eu-west-1:123456789012:bench')
+    env.setdefault('AWS_SES_EMAIL_FROM', 'bench@example.com')
+    with tempfile.TemporaryDirectory() as directory:
+        # no state of the previous runs ( credential report, processed requests )
+        env['AWS_STATE_STORE'] = f'file://{directory}'
+        code = CHILD.format(src=SRC, bench=BENCH, module=module, users=users, event=event, emails=emails)
+        output = subprocess.check_output([sys.executable, '-c', code], env=env, cwd=SRC)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def main(runs):
+    for module, users, event, emails in HANDLERS:
+        results = [run_child(module, users, event, emails) for _ in range(runs)]
+        print(f'{module} ( median of {runs} runs )')
+        for key, label in [('import', 'import handler'), ('setup', 'import boto3 ( bench setup )'), ('invoke', 'first invoke')]:
+            print(f'  {label:30}: {statistics.median(x[key] for x in results) * 1000:8.1f} ms')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the credential report parser.
+
+usage: python bench/bench_credential_report.py [users ...]
+"""
+
+import os
+import sys
+import time
+import gc
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'src'))
+
+from credential_report import CredentialReport
+import synthetic
+
+LEGACY_LOOKUPS = 200
+
+def legacy_parse(content):
+    """parser used before the indexed credential report ( one dict appended once per column )"""
+    credential_report = []
+    lines = content.splitlines()
+    keys = lines[0].decode("utf-8").split(',')
+    for i in range(1, len(lines)):
+        item = {}
+        data = lines[i].decode("utf-8").split(',')
+        for j in range(0, len(keys)):
+            item[keys[j]] = data[j]
+            credential_report.append(item)
+    return credential_report
+
+def legacy_lookup(credential_report, user_name):
+    return next((item for item in credential_report if item['user'] == user_name), None)
+
+def measure(fn, *args):
+    """measure time and peak memory ( in two runs, tracemalloc slows down the parsing )"""
+    gc.collect()
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    tracemalloc.start()
+    result = fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def run(users):
+    content = synthetic.credential_report(users)
+    names = [synthetic.user_name(i) for i in range(users)]
+
+    report, parse_time, parse_peak = measure(CredentialReport.parse, content)
+    start = time.perf_counter()
+    for name in names:
+        report.get(name)
+    lookup_time = time.perf_counter() - start
+
+    legacy, legacy_time, legacy_peak = measure(legacy_parse, content)
+    sample = names[-LEGACY_LOOKUPS:]
+    start = time.perf_counter()
+    for name in sample:
+        legacy_lookup(legacy, name)
+    legacy_lookup_time = (time.perf_counter() - start) / len(sample) * users
+
+    print(f'{users} users ( report size {len(content) / 1024 / 1024:.1f} MiB )')
+    print(f'  indexed : parse {parse_time:.3f}s, peak {parse_peak / 1024 / 1024:.1f} MiB, {users} lookups {lookup_time:.3f}s')
+    print(f'  legacy  : parse {legacy_time:.3f}s, peak {legacy_peak / 1024 / 1024:.1f} MiB, {users} lookups {legacy_lookup_time:.1f}s ( extrapolated from {len(sample)} )')
+
+if __name__ == '__main__':
+    sizes = [int(x) for x in sys.argv[1:]] or [10000, 50000]
+    for size in sizes:
+        run(size)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+End to end benchmark of the lambda handlers on a synthetic account.
+
+Each account size is run in a new python process :
+  1. scan : the scan lambda is invoked until the scan is complete ( the
+     scan resumes from its checkpoint when the lambda timeout is near ),
+     with --shards, the workers dispatched by the scan lambda are run one
+     after the other ( the slowest shard is the duration of the scan ),
+  2. update : the update lambda is invoked with the requests published by
+     the scan, by batch of sqs_batch_size messages,
+  3. rescan : the scan lambda is invoked again ( incremental scan ).
+
+AWS is replaced by bench/fake_aws.py, use --latency to add the round trip
+time of AWS calls. The client side rate limits apply ( IAM calls of the scan,
+SES send rate of the fake account ), use --unlimited to measure only the
+cost of the handlers.
+
+usage: python bench/bench_handlers.py [--latency ms] [--timeout s] [--batch-size n] [--shards n] [--unlimited] [users ...]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+SRC = os.path.join(BENCH, '..', 'src')
+
+def run_child(users, latency, timeout, batch_size, shards, unlimited):
+    env = dict(os.environ)
+    env['AWS_SCAN_SHARDS'] = str(shards)
+    env.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+    env.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    env.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    env.setdefault('AWS_SQS_REQUEST_URL', 'https://sqs.eu-west-1.amazonaws.com/123456789012/bench')
+    env.setdefault('AWS_SNS_RESULT_ARN', 'arn:aws:sns:eu-west-1:123456789012:bench')
+    env.setdefault('AWS_SES_EMAIL_FROM', 'bench@example.com')
+    env.setdefault('AWS_REQUEST_SIGNING_KEY', 'bench')
+    with tempfile.TemporaryDirectory() as directory:
+        env['AWS_STATE_STORE'] = f'file://{directory}'
+        output = subprocess.check_output(
+            [sys.executable, __file__, '--child', '--latency', str(latency), '--timeout', str(timeout),
+             '--batch-size', str(batch_size)] + (['--unlimited'] if unlimited else []) + [str(users)],
+            env=env, cwd=SRC)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+def child(users, latency, timeout, batch_size, unlimited):
+    import time
+    import logging
+    import resource
+    sys.path.insert(0, SRC)
+    sys.path.insert(0, BENCH)
+    import boto3
+    from fake_aws import FakeAws
+
+    logging.disable(logging.CRITICAL)
+    fake = FakeAws(users, latency=latency / 1000.0)
+    boto3.setup_default_session()
+    fake.install(boto3.DEFAULT_SESSION)
+
+    import lambdaFindUsersToRefreshHandler as scanner
+    import lambdaUpdateIamCredentialsForUserHandler as updater
+    from state_store import create_state_store
+
+    if unlimited:
+        scanner.iam_rate_limiter.max_rate = scanner.iam_rate_limiter.rate = float('inf')
+        updater.ses_sender._max_send_rate = float('inf')
+
+    class Context(object):
+        invoked_function_arn = 'arn:aws:lambda:eu-west-1:123456789012:function:bench'
+
+        def __init__(self):
+            self.deadline = time.monotonic() + timeout
+
+        def get_remaining_time_in_millis(self):
+            return int((self.deadline - time.monotonic()) * 1000)
+
+    state_store = create_state_store(os.environ['AWS_STATE_STORE'], scanner.common.client)
+    results = []
+
+    def phase(name, run):
+        calls = dict(fake.calls_by_service())
+        start = time.perf_counter()
+        invocations, slowest = run()
+        wall = time.perf_counter() - start
+        after = fake.calls_by_service()
+        results.append({
+            'phase': name,
+            'invocations': invocations,
+            'wall': wall,
+            'slowest': slowest,
+            'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'calls': {k: v - calls.get(k, 0) for k, v in sorted(after.items()) if v - calls.get(k, 0)}
+        })
+
+    def scan():
+        fake.invocations = []
+        scanner.main({}, Context())
+        if not fake.invocations:
+            return scan_shard({}), None
+        # dispatched to shards
+        invocations, slowest = 1, 0
+        for event in fake.invocations:
+            start = time.perf_counter()
+            invocations += scan_shard(event)
+            slowest = max(slowest, time.perf_counter() - start)
+        return invocations, slowest
+
+    def scan_shard(event):
+        checkpoint_key = scanner.state_key(scanner.CHECKPOINT_KEY, scanner.get_shard(event), event.get('account'))
+        invocations = 0
+        while True:
+            invocations += 1
+            if event or invocations > 1:
+                scanner.main(event, Context())
+            if not state_store.load(checkpoint_key) or invocations >= 100:
+                return invocations
+
+    def update():
+        messages = fake.messages
+        fake.messages = []
+        invocations = 0
+        for i in range(0, len(messages), batch_size):
+            records = [{'messageId': str(i + j), 'body': x} for j, x in enumerate(messages[i:i + batch_size])]
+            updater.main({'Records': records}, Context())
+            invocations += 1
+        return invocations, None
+
+    phase('scan', scan)
+    requests = len(fake.messages)
+    phase('update', update)
+    phase('rescan', scan)
+    print(json.dumps({'users': users, 'requests': requests, 'emails': fake.emails, 'phases': results}))
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end benchmark of the lambda handlers')
+    parser.add_argument('users', nargs='*', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--latency', type=float, default=0.0, help='round trip time of AWS calls in ms')
+    parser.add_argument('--timeout', type=float, default=300.0, help='lambda timeout in seconds')
+    parser.add_argument('--batch-size', type=int, default=10, help='number of requests by invocation of update lambda')
+    parser.add_argument('--shards', type=int, default=1, help='number of shards of scan')
+    parser.add_argument('--unlimited', action='store_true', help='disable the client side rate limits')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.users[0], args.latency, args.timeout, args.batch_size, args.unlimited)
+        return
+    print(f'latency {args.latency} ms, lambda timeout {args.timeout} s, sqs batch size {args.batch_size}, '
+          f"{args.shards} shards{', no rate limit' if args.unlimited else ''}")
+    for users in args.users:
+        result = run_child(users, args.latency, args.timeout, args.batch_size, args.shards, args.unlimited)
+        print(f"{users} users ( {result['requests']} requests, {result['emails']} emails )")
+        for x in result['phases']:
+            calls = ', '.join(f'{k}={v}' for k, v in x['calls'].items())
+            slowest = f"  slowest shard {x['slowest']:8.2f} s" if x['slowest'] is not None else ''
+            print(f"  {x['phase']:7}: {x['wall']:8.2f} s  {x['invocations']:5} invocations{slowest}"
+                  f"  peak rss {x['maxrss'] / 1024:7.1f} MB  calls: {calls}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the offline rotation planner on a synthetic account.
+
+usage: python bench/bench_planner.py [users ...]
+"""
+
+import gc
+import os
+import sys
+import time
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCH, '..', 'src'))
+
+from credential_report import CredentialReport
+from fake_aws import FakeAws
+from fake_aws import VERIFIED_DOMAIN
+import rotation_planner
+
+def main(sizes):
+    for users in sizes:
+        fake = FakeAws(users)
+        content = fake._iam_get_credential_report()['Content']
+        tags = {x.name: dict(x.tags) for x in fake._users.values()}
+        # the planner only holds the report and the tags, not the synthetic account
+        del fake
+        gc.collect()
+        start = time.perf_counter()
+        credential_report = CredentialReport.parse(content)
+        parse_time = time.perf_counter() - start
+        start = time.perf_counter()
+        planned = rotation_planner.plan(credential_report, tags, verified_identities={VERIFIED_DOMAIN})
+        plan_time = time.perf_counter() - start
+        requests = planned.requests()
+        print(f'{users:7} users: parse {parse_time * 1000:8.1f} ms, plan {plan_time * 1000:8.1f} ms, {requests} requests')
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [1000, 10000, 100000])
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the evaluation of the rotation policy on a synthetic account.
+
+Compares the evaluation of users one by one ( reference implementation below,
+as the scan did before the policy engine ) with the compiled threshold table
+evaluated over the columns of credential report. Both must find the same
+users to refresh and the same next due dates.
+
+With --rules, a part of users get an IAM path and groups matched by rules
+( the per-user evaluation then ignores the rules, only the timing is shown ).
+
+usage: python bench/bench_policy.py [--rules] [users ...]
+"""
+
+import os
+import sys
+import time
+import datetime
+import argparse
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCH, '..', 'src'))
+
+from credential_report import CredentialReport
+from fake_aws import FakeAws
+from rotation_policy import PolicyRule
+from rotation_policy import RotationPolicy
+from rotation_policy import evaluate
+from rotation_rules import CLI_TIME_LIMIT_TAG
+from rotation_rules import FORCE_REFRESH_TAG
+from rotation_rules import LOGIN_PROFILE_TIME_LIMIT_TAG
+from rotation_rules import is_obsolete
+from rotation_rules import password_last_changed
+from rotation_rules import time_limit
+
+RULES = [
+    PolicyRule(path='/admin/', cli_time_limit=30, login_profile_time_limit=30),
+    PolicyRule(group='contractors', cli_time_limit=60),
+    PolicyRule(group='auditors', login_profile_time_limit=45)
+]
+
+def placements_of(user_names):
+    """( IAM path, group names ) of one user of 10 ( admins ) and of one user of 7 ( contractors, auditors )"""
+    placements = {}
+    for i, user_name in enumerate(user_names):
+        path = '/admin/ops/' if i % 10 == 0 else '/'
+        groups = ('contractors', 'auditors') if i % 7 == 0 else ()
+        placements[user_name] = (path, groups)
+    return placements
+
+def is_obsolete_password(credential_report_info, login_profile_time_limit, today=None):
+    """test if the console password of credential report row is obsolete"""
+    if not credential_report_info.password_enabled:
+        return False
+    last_changed = password_last_changed(credential_report_info)
+    return bool(last_changed) and is_obsolete(last_changed, login_profile_time_limit, today)
+
+def find_obsolete_access_keys(credential_report_info, cli_time_limit, today=None):
+    """find the numbers ( 1, 2 ) of the obsolete active access keys of credential report row"""
+    result = []
+    if credential_report_info.access_key_1_active and credential_report_info.access_key_1_last_rotated \
+            and is_obsolete(credential_report_info.access_key_1_last_rotated, cli_time_limit, today):
+        result.append(1)
+    if credential_report_info.access_key_2_active and credential_report_info.access_key_2_last_rotated \
+            and is_obsolete(credential_report_info.access_key_2_last_rotated, cli_time_limit, today):
+        result.append(2)
+    return result
+
+def evaluate_one_by_one(credential_report, tags, today):
+    """users to refresh and next due dates, user by user"""
+    due = []
+    next_due_dates = {}
+    for entry in credential_report:
+        user_tags = tags.get(entry.user_name) or {}
+        login_profile_time_limit = time_limit(user_tags.get(LOGIN_PROFILE_TIME_LIMIT_TAG), None)
+        cli_time_limit = time_limit(user_tags.get(CLI_TIME_LIMIT_TAG), None)
+        if user_tags.get(FORCE_REFRESH_TAG) or is_obsolete_password(entry, login_profile_time_limit, today) \
+                or find_obsolete_access_keys(entry, cli_time_limit, today):
+            due.append(entry.user_name)
+        dates = []
+        if entry.password_enabled and password_last_changed(entry):
+            dates.append(password_last_changed(entry) + datetime.timedelta(days=login_profile_time_limit + 1))
+        for active, last_rotated in [(entry.access_key_1_active, entry.access_key_1_last_rotated),
+                                     (entry.access_key_2_active, entry.access_key_2_last_rotated)]:
+            if active and last_rotated:
+                dates.append(last_rotated + datetime.timedelta(days=cli_time_limit + 1))
+        next_due_dates[entry.user_name] = min(dates) if dates else None
+    return due, next_due_dates
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark of the evaluation of the rotation policy')
+    parser.add_argument('users', nargs='*', type=int, default=[1000, 10000, 100000])
+    parser.add_argument('--rules', action='store_true', help='add IAM path and group rules')
+    args = parser.parse_args(argv)
+    today = datetime.date.today()
+    for users in args.users:
+        fake = FakeAws(users)
+        credential_report = CredentialReport.parse(fake._iam_get_credential_report()['Content'])
+        tags = {x.name: dict(x.tags) for x in fake._users.values()}
+
+        start = time.perf_counter()
+        due, next_due_dates = evaluate_one_by_one(credential_report, tags, today)
+        one_by_one_time = time.perf_counter() - start
+
+        rules = RULES if args.rules else []
+        placements = placements_of(tags) if args.rules else None
+        start = time.perf_counter()
+        columns = credential_report.columns()
+        columns_time = time.perf_counter() - start
+        start = time.perf_counter()
+        table = RotationPolicy(rules=rules).compile(columns.user_names, tags, placements)
+        compile_time = time.perf_counter() - start
+        start = time.perf_counter()
+        evaluation = evaluate(table, credential_report, today)
+        policy_due = evaluation.due_users()
+        evaluate_time = time.perf_counter() - start
+
+        status = ''
+        if not args.rules:
+            same = policy_due == due and all(evaluation.next_due_date(k) == v for k, v in next_due_dates.items())
+            status = ', same result' if same else ', DIFFERENT RESULT'
+        print(f'{users:7} users: one by one {one_by_one_time * 1000:8.1f} ms, columns {columns_time * 1000:7.1f} ms, '
+              f'compile {compile_time * 1000:7.1f} ms, evaluate {evaluate_time * 1000:7.1f} ms, '
+              f'{len(policy_due)} users to refresh{status}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+In-process fake of the AWS account used by the lambda handlers.
+
+The boto3 clients are real : the calls are answered by botocore hooks
+( before-call ) from the state of a synthetic account, so the client side
+code ( paginators, modeled exceptions, rate limiters ) is exercised and no
+AWS account is needed.
+"""
+
+import json
+import uuid
+import time
+import random
+import hashlib
+import datetime
+import threading
+import collections
+
+from botocore import xform_name
+from botocore.awsrequest import AWSResponse
+
+import synthetic
+
+VERIFIED_DOMAIN = 'example.com'
+UNVERIFIED_DOMAIN = 'unverified.example.org'
+PAGE_SIZE = 100
+
+class FakeUser(object):
+    """iam user of synthetic account"""
+
+    def __init__(self, name, created, tags, login_profile, password_last_changed, access_keys):
+        self.name = name
+        self.created = created
+        self.tags = tags
+        self.login_profile = login_profile
+        self.password_last_changed = password_last_changed
+        self.access_keys = access_keys
+        self.path = '/'
+        self.groups = []
+
+class FakeAws(object):
+    """synthetic aws account ( iam, ses, sqs, sns, sts, lambda ) answering the boto3 calls"""
+
+    def __init__(self, users, seed=42, account_id='123456789012', latency=0.0):
+        self.account_id = account_id
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.messages = []
+        self.invocations = []
+        self.emails = 0
+        self._users = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._now = datetime.datetime.now(datetime.timezone.utc)
+        rnd = random.Random(seed)
+        for i in range(users):
+            user = self._create_user(rnd, synthetic.user_name(i))
+            self._users[user.name] = user
+
+    def _create_user(self, rnd, name):
+        """user with varied tags, login profile and access keys ages"""
+        created = self._now - datetime.timedelta(days=rnd.randint(30, 1500))
+        age = (self._now - created).days
+        tags = collections.OrderedDict()
+        draw = rnd.random()
+        if draw < 0.90:
+            tags['IamRotateCredentials:Email'] = f'{name}@{VERIFIED_DOMAIN}'
+        elif draw < 0.95:
+            tags['IamRotateCredentials:Email'] = f'{name}@{UNVERIFIED_DOMAIN}'
+        if rnd.random() < 0.10:
+            tags['IamRotateCredentials:CliTimeLimit'] = str(rnd.choice([30, 60, 180]))
+        if rnd.random() < 0.10:
+            tags['IamRotateCredentials:LoginProfileTimeLimit'] = str(rnd.choice([30, 60, 180]))
+        if rnd.random() < 0.05:
+            tags['IamRotateCredentials:LoginProfilePasswordResetRequired'] = 'false'
+        if rnd.random() < 0.01:
+            tags['IamRotateCredentials:ForceRefresh'] = 'true'
+        if rnd.random() < 0.30:
+            tags['Team'] = rnd.choice(['dev', 'ops', 'data'])
+        login_profile = rnd.random() < 0.6
+        password_last_changed = None
+        if login_profile and rnd.random() < 0.9:
+            password_last_changed = self._now - datetime.timedelta(days=rnd.randint(0, age))
+        access_keys = []
+        for _ in range(rnd.choice([0, 1, 1, 1, 2])):
+            access_keys.append({
+                'AccessKeyId': self._access_key_id(rnd),
+                'Status': 'Active' if rnd.random() < 0.9 else 'Inactive',
+                'CreateDate': self._now - datetime.timedelta(days=rnd.randint(0, age))
+            })
+        return FakeUser(name, created, tags, login_profile, password_last_changed, access_keys)
+
+    @staticmethod
+    def _access_key_id(rnd=None):
+        value = rnd.getrandbits(64) if rnd else uuid.uuid4().int
+        return 'AKIA' + hashlib.sha1(str(value).encode('utf-8')).hexdigest()[:16].upper()
+
+    def install(self, session):
+        """answer the calls of all clients created later by session ( boto3 or botocore session )"""
+        events = session.events if hasattr(session, 'events') else session.get_component('event_emitter')
+        events.register('before-parameter-build', self._before_parameter_build)
+        events.register('before-call', self._before_call)
+
+    def _before_parameter_build(self, params, context, **kwargs):
+        # the before-call hook only receives the serialized request
+        context['fake_aws_params'] = dict(params)
+
+    def _before_call(self, model, context, request_signer=None, **kwargs):
+        service_name = model.service_model.service_name
+        with self._lock:
+            self.calls[(service_name, model.name)] += 1
+        if request_signer is not None:
+            # client side hooks ( rate limiters ) are attached on before-send
+            request_signer._event_emitter.emit(
+                f'before-send.{model.service_model.service_id.hyphenize()}.{model.name}', request=None)
+        if self.latency:
+            time.sleep(self.latency)
+        method = getattr(self, f'_{service_name}_{xform_name(model.name)}', None)
+        if not method:
+            raise NotImplementedError(f'{service_name}:{model.name} is not implemented by fake aws')
+        params = context.get('fake_aws_params', {})
+        try:
+            with self._lock:
+                parsed = method(**params)
+            status = 200
+        except FakeAwsError as e:
+            parsed = {'Error': {'Code': e.code, 'Message': e.message}}
+            status = e.status
+        parsed.setdefault('ResponseMetadata', {'HTTPStatusCode': status, 'HTTPHeaders': {}, 'RetryAttempts': 0})
+        return AWSResponse(None, status, {}, None), parsed
+
+    def calls_by_service(self):
+        result = collections.Counter()
+        for (service_name, _), count in self.calls.items():
+            result[service_name] += count
+        return result
+
+    def _user(self, user_name):
+        user = self._users.get(user_name)
+        if not user:
+            raise FakeAwsError('NoSuchEntity', f'The user with name {user_name} cannot be found.', 404)
+        return user
+
+    def _page(self, items, Marker=None, MaxItems=None):
+        start = int(Marker or 0)
+        end = min(start + (MaxItems or PAGE_SIZE), len(items))
+        result = {'IsTruncated': end < len(items)}
+        if end < len(items):
+            result['Marker'] = str(end)
+        return items[start:end], result
+
+    def _iam_user(self, user):
+        return {
+            'Path': user.path,
+            'UserName': user.name,
+            'UserId': 'AIDA' + hashlib.sha1(user.name.encode('utf-8')).hexdigest()[:16].upper(),
+            'Arn': f'arn:aws:iam::{self.account_id}:user/{user.name}',
+            'CreateDate': user.created
+        }
+
+    # iam
+
+    def _iam_generate_credential_report(self):
+        return {'State': 'COMPLETE'}
+
+    def _iam_get_credential_report(self):
+        lines = [','.join(synthetic.CREDENTIAL_REPORT_COLUMNS)]
+        for user in self._users.values():
+            lines.append(','.join(self._credential_report_row(user)))
+        return {'Content': '\n'.join(lines).encode('utf-8'), 'ReportFormat': 'text/csv', 'GeneratedTime': self._now}
+
+    def _credential_report_row(self, user):
+        def timestamp(date):
+            return date.strftime('%Y-%m-%dT%H:%M:%S+00:00') if date else 'N/A'
+        keys = user.access_keys + [None, None]
+        row = [
+            user.name, f'arn:aws:iam::{self.account_id}:user/{user.name}', timestamp(user.created),
+            'true' if user.login_profile else 'false',
+            'N/A', timestamp(user.password_last_changed) if user.login_profile else 'N/A', 'N/A', 'false'
+        ]
+        for key in keys[:2]:
+            row += [
+                'true' if key and key['Status'] == 'Active' else 'false',
+                timestamp(key['CreateDate']) if key else 'N/A',
+                'N/A', 'N/A', 'N/A'
+            ]
+        return row + ['false', 'N/A', 'false', 'N/A']
+
+    def _iam_list_users(self, Marker=None, MaxItems=None, **kwargs):
+        users, result = self._page(list(self._users.values()), Marker, MaxItems)
+        result['Users'] = [self._iam_user(x) for x in users]
+        return result
+
+    def _iam_get_user(self, UserName=None):
+        return {'User': self._iam_user(self._user(UserName))}
+
+    def _iam_get_account_authorization_details(self, Filter=None, Marker=None, MaxItems=None):
+        users, result = self._page(list(self._users.values()), Marker, MaxItems)
+        result['UserDetailList'] = [
+            dict(self._iam_user(x), Tags=[{'Key': k, 'Value': v} for k, v in x.tags.items()],
+                 UserPolicyList=[], GroupList=list(x.groups), AttachedManagedPolicies=[])
+            for x in users]
+        result['GroupDetailList'] = []
+        result['RoleDetailList'] = []
+        result['Policies'] = []
+        return result
+
+    def _iam_list_user_tags(self, UserName, Marker=None, MaxItems=None):
+        user = self._user(UserName)
+        tags, result = self._page([{'Key': k, 'Value': v} for k, v in user.tags.items()], Marker, MaxItems)
+        result['Tags'] = tags
+        return result
+
+    def _iam_list_groups_for_user(self, UserName, Marker=None, MaxItems=None):
+        user = self._user(UserName)
+        groups, result = self._page([{'Path': '/', 'GroupName': x} for x in user.groups], Marker, MaxItems)
+        result['Groups'] = groups
+        return result
+
+    def _iam_create_user(self, UserName, Tags=None, **kwargs):
+        if UserName in self._users:
+            raise FakeAwsError('EntityAlreadyExists', f'User with name {UserName} already exists.', 409)
+        user = FakeUser(UserName, datetime.datetime.now(datetime.timezone.utc),
+                        collections.OrderedDict((x['Key'], x['Value']) for x in Tags or []), False, None, [])
+        user.path = kwargs.get('Path') or '/'
+        self._users[UserName] = user
+        return {'User': self._iam_user(user)}
+
+    def _iam_tag_user(self, UserName, Tags):
+        user = self._user(UserName)
+        for tag in Tags:
+            user.tags[tag['Key']] = tag['Value']
+        return {}
+
+    def _iam_untag_user(self, UserName, TagKeys):
+        user = self._user(UserName)
+        for key in TagKeys:
+            user.tags.pop(key, None)
+        return {}
+
+    def _iam_list_access_keys(self, UserName, Marker=None, MaxItems=None):
+        user = self._user(UserName)
+        keys, result = self._page(user.access_keys, Marker, MaxItems)
+        result['AccessKeyMetadata'] = [dict(x, UserName=UserName) for x in keys]
+        return result
+
+    def _iam_delete_access_key(self, UserName, AccessKeyId):
+        user = self._user(UserName)
+        keys = [x for x in user.access_keys if x['AccessKeyId'] != AccessKeyId]
+        if len(keys) == len(user.access_keys):
+            raise FakeAwsError('NoSuchEntity', f'The Access Key with id {AccessKeyId} cannot be found.', 404)
+        user.access_keys = keys
+        return {}
+
+    def _iam_update_access_key(self, UserName, AccessKeyId, Status):
+        user = self._user(UserName)
+        for key in user.access_keys:
+            if key['AccessKeyId'] == AccessKeyId:
+                key['Status'] = Status
+                return {}
+        raise FakeAwsError('NoSuchEntity', f'The Access Key with id {AccessKeyId} cannot be found.', 404)
+
+    def _iam_create_access_key(self, UserName):
+        user = self._user(UserName)
+        if len(user.access_keys) >= 2:
+            raise FakeAwsError('LimitExceeded', 'Cannot exceed quota for AccessKeysPerUser: 2', 409)
+        key = {'AccessKeyId': self._access_key_id(), 'Status': 'Active', 'CreateDate': datetime.datetime.now(datetime.timezone.utc)}
+        user.access_keys.append(key)
+        return {'AccessKey': dict(key, UserName=UserName, SecretAccessKey=uuid.uuid4().hex)}
+
+    def _iam_get_login_profile(self, UserName):
+        user = self._user(UserName)
+        if not user.login_profile:
+            raise FakeAwsError('NoSuchEntity', f'Login Profile for User {UserName} cannot be found.', 404)
+        return {'LoginProfile': {'UserName': UserName, 'CreateDate': user.created, 'PasswordResetRequired': False}}
+
+    def _iam_create_login_profile(self, UserName, Password=None, PasswordResetRequired=None):
+        user = self._user(UserName)
+        if user.login_profile:
+            raise FakeAwsError('EntityAlreadyExists', f'Login Profile for user {UserName} already exists.', 409)
+        user.login_profile = True
+        user.password_last_changed = datetime.datetime.now(datetime.timezone.utc)
+        return {'LoginProfile': {'UserName': UserName, 'CreateDate': user.password_last_changed,
+                                 'PasswordResetRequired': bool(PasswordResetRequired)}}
+
+    def _iam_update_login_profile(self, UserName, Password=None, PasswordResetRequired=None):
+        user = self._user(UserName)
+        if not user.login_profile:
+            raise FakeAwsError('NoSuchEntity', f'Login Profile for User {UserName} cannot be found.', 404)
+        user.password_last_changed = datetime.datetime.now(datetime.timezone.utc)
+        return {}
+
+    # ses
+
+    def _ses_list_identities(self, **kwargs):
+        return {'Identities': [VERIFIED_DOMAIN]}
+
+    def _ses_get_identity_verification_attributes(self, Identities):
+        return {'VerificationAttributes': {
+            x: {'VerificationStatus': 'Success'} for x in Identities if x == VERIFIED_DOMAIN}}
+
+    def _ses_get_send_quota(self):
+        return {'Max24HourSend': 50000.0, 'MaxSendRate': 14.0, 'SentLast24Hours': float(self.emails)}
+
+    def _ses_send_email(self, Source, Destination, Message, **kwargs):
+        self.emails += 1
+        return {'MessageId': uuid.uuid4().hex}
+
+    # sqs
+
+    def _sqs_send_message(self, QueueUrl, MessageBody, **kwargs):
+        self.messages.append(MessageBody)
+        return {'MessageId': uuid.uuid4().hex, 'MD5OfMessageBody': hashlib.md5(MessageBody.encode('utf-8')).hexdigest()}
+
+    def _sqs_send_message_batch(self, QueueUrl, Entries):
+        successful = []
+        for entry in Entries:
+            self.messages.append(entry['MessageBody'])
+            successful.append({
+                'Id': entry['Id'],
+                'MessageId': uuid.uuid4().hex,
+                'MD5OfMessageBody': hashlib.md5(entry['MessageBody'].encode('utf-8')).hexdigest()
+            })
+        return {'Successful': successful, 'Failed': []}
+
+    # sns
+
+    def _sns_publish(self, **kwargs):
+        return {'MessageId': uuid.uuid4().hex}
+
+    # lambda
+
+    def _lambda_invoke(self, FunctionName, InvocationType=None, Payload=None, **kwargs):
+        # asynchronous invocations are run by the caller of fake
+        self.invocations.append(json.loads(Payload or b'{}'))
+        return {'StatusCode': 202}
+
+    # sts
+
+    def _sts_get_caller_identity(self):
+        return {'UserId': 'AIDABENCH', 'Account': self.account_id, 'Arn': f'arn:aws:iam::{self.account_id}:user/bench'}
+
+    def _sts_assume_role(self, RoleArn, RoleSessionName, DurationSeconds=3600, **kwargs):
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=DurationSeconds)
+        return {'Credentials': {'AccessKeyId': 'ASIABENCH', 'SecretAccessKey': 'bench', 'SessionToken': 'bench',
+                                'Expiration': expiration}}
+
+class FakeAwsError(Exception):
+    """error returned by fake aws ( raised as modeled exception by the client )"""
+
+    def __init__(self, code, message, status=400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
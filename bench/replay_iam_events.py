@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Replay recorded CloudTrail IAM events on the IAM event lambda.
+
+For each event ( EventBridge event of test/events by default ), the recorded
+call is applied to the synthetic account of bench/fake_aws.py ( except the
+failed calls ), then the event is sent to the handler. The requests sent to
+SQS and the AWS calls of the handler are printed for each event.
+
+The events of test/events name the users of the synthetic account
+( user-000001, ... ), they are replayed in order on the same account.
+
+usage: python bench/replay_iam_events.py [--users n] [events ...]
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import tempfile
+
+BENCH = os.path.dirname(os.path.realpath(__file__))
+SRC = os.path.join(BENCH, '..', 'src')
+EVENTS = os.path.join(BENCH, '..', 'test', 'events')
+
+def recorded_parameters(value):
+    """boto3 parameters of the request parameters of CloudTrail ( userName -> UserName )"""
+    if isinstance(value, dict):
+        return {k[:1].upper() + k[1:]: recorded_parameters(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [recorded_parameters(x) for x in value]
+    return value
+
+def apply_event(iam_client, detail):
+    """apply the recorded call to the synthetic account"""
+    from botocore import xform_name
+    if detail.get('errorCode'):
+        return
+    params = recorded_parameters(detail.get('requestParameters') or {})
+    if detail['eventName'] in ['CreateLoginProfile', 'UpdateLoginProfile']:
+        # the password is not recorded by CloudTrail
+        params.setdefault('Password', 'replayed-password')
+    getattr(iam_client, xform_name(detail['eventName']))(**params)
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded CloudTrail IAM events on the IAM event lambda')
+    parser.add_argument('events', nargs='*', help='EventBridge events ( json files, default test/events/*.json )')
+    parser.add_argument('--users', type=int, default=100, help='number of users of synthetic account')
+    args = parser.parse_args()
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_SQS_REQUEST_URL', 'https://sqs.eu-west-1.amazonaws.com/123456789012/bench')
+    os.environ.setdefault('AWS_SNS_RESULT_ARN', 'arn:aws:sns:eu-west-1:123456789012:bench')
+    os.environ.setdefault('AWS_REQUEST_SIGNING_KEY', 'bench')
+    # role of the update lambda in the recorded events of its rotations
+    os.environ.setdefault('AWS_UPDATE_LAMBDA_ROLE_ARN', 'arn:aws:iam::123456789012:role/iam-rotate-credentials-update-iam-credentials-for-user-role')
+    sys.path.insert(0, SRC)
+    sys.path.insert(0, BENCH)
+    import logging
+    import boto3
+    from fake_aws import FakeAws
+
+    logging.disable(logging.CRITICAL)
+    fake = FakeAws(args.users)
+    boto3.setup_default_session()
+    fake.install(boto3.DEFAULT_SESSION)
+    iam_client = boto3.client('iam')
+
+    # the credential report of synthetic account is not cached in /tmp
+    state_directory = tempfile.TemporaryDirectory()
+    os.environ['AWS_STATE_STORE'] = f'file://{state_directory.name}'
+    import lambdaEvaluateUserOnIamEventHandler as handler
+
+    class Context(object):
+        invoked_function_arn = f'arn:aws:lambda:eu-west-1:{fake.account_id}:function:replay'
+
+        def get_remaining_time_in_millis(self):
+            return 300000
+
+    for path in args.events or sorted(glob.glob(os.path.join(EVENTS, '*.json'))):
+        with open(path) as f:
+            event = json.load(f)
+        detail = event['detail']
+        apply_event(iam_client, detail)
+        fake.messages = []
+        calls = dict(fake.calls)
+        handler.main(event, Context())
+        calls = {f'{k[0]}:{k[1]}': v - calls.get(k, 0) for k, v in sorted(fake.calls.items()) if v - calls.get(k, 0)}
+        print(f"{os.path.basename(path)}: {detail['eventName']} {handler.event_user_name(detail)}")
+        for message in fake.messages:
+            request = json.loads(message)
+            print(f"  request: user {request['user_name']}, force {request['force']}, "
+                  f"login profile {request['login_profile']}, access keys {request['access_key_ids']}")
+        if not fake.messages:
+            print('  no request')
+        print(f"  calls: {', '.join(f'{k}={v}' for k, v in calls.items())}")
+
+if __name__ == '__main__':
+    main()
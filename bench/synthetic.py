@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import random
+import datetime
+
+CREDENTIAL_REPORT_COLUMNS = [
+    'user', 'arn', 'user_creation_time', 'password_enabled', 'password_last_used', 'password_last_changed',
+    'password_next_rotation', 'mfa_active', 'access_key_1_active', 'access_key_1_last_rotated',
+    'access_key_1_last_used_date', 'access_key_1_last_used_region', 'access_key_1_last_used_service',
+    'access_key_2_active', 'access_key_2_last_rotated', 'access_key_2_last_used_date',
+    'access_key_2_last_used_region', 'access_key_2_last_used_service', 'cert_1_active', 'cert_1_last_rotated',
+    'cert_2_active', 'cert_2_last_rotated'
+]
+
+def user_name(index):
+    return f'user-{index:06d}'
+
+def _timestamp(today, days_ago):
+    date = today - datetime.timedelta(days=days_ago)
+    return f'{date.isoformat()}T10:12:33+00:00'
+
+def credential_report_rows(users, seed=42, account_id='123456789012'):
+    """generate the rows of a synthetic credential report"""
+    rnd = random.Random(seed)
+    today = datetime.date.today()
+    for i in range(users):
+        name = user_name(i)
+        created = rnd.randint(0, 1000)
+        password_enabled = rnd.random() < 0.6
+        key_1 = rnd.random() < 0.8
+        key_2 = rnd.random() < 0.2
+        yield [
+            name,
+            f'arn:aws:iam::{account_id}:user/{name}',
+            _timestamp(today, created),
+            'true' if password_enabled else 'false',
+            _timestamp(today, rnd.randint(0, created)) if password_enabled else 'N/A',
+            _timestamp(today, rnd.randint(0, created)) if password_enabled and rnd.random() < 0.9 else 'N/A',
+            'N/A',
+            'true' if rnd.random() < 0.5 else 'false',
+            'true' if key_1 else 'false',
+            _timestamp(today, rnd.randint(0, created)) if key_1 else 'N/A',
+            _timestamp(today, rnd.randint(0, 10)) if key_1 else 'N/A',
+            'eu-west-1' if key_1 else 'N/A',
+            'iam' if key_1 else 'N/A',
+            'true' if key_2 else 'false',
+            _timestamp(today, rnd.randint(0, created)) if key_2 else 'N/A',
+            'N/A', 'N/A', 'N/A',
+            'false', 'N/A', 'false', 'N/A'
+        ]
+
+def credential_report(users, seed=42, account_id='123456789012'):
+    """generate the csv content ( bytes ) of a synthetic credential report"""
+    lines = [','.join(CREDENTIAL_REPORT_COLUMNS)]
+    for row in credential_report_rows(users, seed=seed, account_id=account_id):
+        lines.append(','.join(row))
+    return '\n'.join(lines).encode('utf-8')
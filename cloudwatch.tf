@@ -9,6 +9,12 @@ resource "aws_cloudwatch_log_group" "update_iam_credentials_for_user" {
   retention_in_days = var.cloudwatch_log_retention
 }
 
+resource "aws_cloudwatch_log_group" "evaluate_user_on_iam_event" {
+  count             = var.iam_events ? 1 : 0
+  name              = "/aws/lambda/${local.lambda_evaluate_user_on_iam_event_name}"
+  retention_in_days = var.cloudwatch_log_retention
+}
+
 resource "aws_cloudwatch_event_rule" "every_x_minutes" {
   name                = "${local.lambda_find_users_to_refresh_name}-schedule"
   description         = "Research the uses for which it is necessary to refresh their credentials Fires every ${var.scan_alarm_clock} minutes"
@@ -19,4 +25,31 @@ resource "aws_cloudwatch_event_target" "check_every_x_minutes" {
   rule      = aws_cloudwatch_event_rule.every_x_minutes.name
   target_id = local.lambda_find_users_to_refresh_name
   arn       = aws_lambda_function.find_users_to_refresh.arn
-}
\ No newline at end of file
+}
+resource "aws_cloudwatch_event_rule" "iam_events" {
+  count       = var.iam_events ? 1 : 0
+  name        = "${local.lambda_evaluate_user_on_iam_event_name}-rule"
+  description = "CloudTrail IAM events which can change the credentials or the rotation tags of an user"
+  event_pattern = jsonencode({
+    source      = ["aws.iam"]
+    detail-type = ["AWS API Call via CloudTrail"]
+    detail = {
+      eventSource = ["iam.amazonaws.com"]
+      eventName   = ["CreateUser", "TagUser", "UntagUser", "CreateAccessKey", "UpdateAccessKey", "CreateLoginProfile", "UpdateLoginProfile"]
+    }
+  })
+}
+
+resource "aws_cloudwatch_event_target" "iam_events" {
+  count     = var.iam_events ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.iam_events[0].name
+  target_id = local.lambda_evaluate_user_on_iam_event_name
+  arn       = aws_lambda_function.evaluate_user_on_iam_event[0].arn
+}
+
+# the target accounts forward their IAM events to the default event bus of this account
+resource "aws_cloudwatch_event_permission" "target_accounts" {
+  for_each     = var.iam_events ? toset([for x in var.target_accounts : element(split(":", x.role_arn), 4)]) : toset([])
+  principal    = each.value
+  statement_id = "${local.service_name}-${each.value}"
+}
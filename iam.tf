@@ -31,10 +31,12 @@ data "aws_iam_policy_document" "find_users_to_refresh" {
 
     actions = [
       "iam:GenerateCredentialReport",
+      "iam:GetAccountAuthorizationDetails",
       "iam:GetCredentialReport",
       "iam:GetLoginProfile",
       "iam:GetUser",
       "iam:ListAccessKeys",
+      "iam:ListGroupsForUser",
       "iam:ListUsers",
       "iam:ListUserTags",
       "iam:UnTagUser"
@@ -51,6 +53,52 @@ data "aws_iam_policy_document" "find_users_to_refresh" {
     ]
   }
 
+  statement {
+    sid       = "AllowShardsDispatch"
+    effect    = "Allow"
+    resources = [local.lambda_find_users_to_refresh_arn]
+
+    actions = [
+      "lambda:InvokeFunction"
+    ]
+  }
+
+  dynamic "statement" {
+    for_each = length(var.target_accounts) > 0 ? [1] : []
+
+    content {
+      sid       = "AllowTargetAccountsAccess"
+      effect    = "Allow"
+      resources = [for account in var.target_accounts : account.role_arn]
+
+      actions = [
+        "sts:AssumeRole"
+      ]
+    }
+  }
+
+  statement {
+    sid       = "AllowStateBucketList"
+    effect    = "Allow"
+    resources = [aws_s3_bucket.state.arn]
+
+    actions = [
+      "s3:ListBucket"
+    ]
+  }
+
+  statement {
+    sid       = "AllowStateBucketAccess"
+    effect    = "Allow"
+    resources = ["${aws_s3_bucket.state.arn}/*"]
+
+    actions = [
+      "s3:GetObject",
+      "s3:PutObject",
+      "s3:DeleteObject"
+    ]
+  }
+
   statement {
     sid       = "AllowCloudwatck"
     effect    = "Allow"
@@ -76,10 +124,42 @@ data "aws_iam_policy_document" "update_iam_credentials_for_user" {
       "ses:SendEmail",
       "ses:SendRawEmail",
       "ses:SendTemplatedEmail",
+      "ses:GetSendQuota",
       "ses:GetIdentityVerificationAttributes"
     ]
   }
 
+  statement {
+    sid       = "AllowTemplatesBucketList"
+    effect    = "Allow"
+    resources = [aws_s3_bucket.state.arn]
+
+    actions = [
+      "s3:ListBucket"
+    ]
+  }
+
+  statement {
+    sid       = "AllowTemplatesAccess"
+    effect    = "Allow"
+    resources = ["${aws_s3_bucket.state.arn}/templates/*"]
+
+    actions = [
+      "s3:GetObject"
+    ]
+  }
+
+  statement {
+    sid       = "AllowStateAccess"
+    effect    = "Allow"
+    resources = ["${aws_s3_bucket.state.arn}/notifications/*", "${aws_s3_bucket.state.arn}/requests/*"]
+
+    actions = [
+      "s3:GetObject",
+      "s3:PutObject"
+    ]
+  }
+
   statement {
     sid       = "AllowIAMAccess"
     effect    = "Allow"
@@ -97,6 +177,20 @@ data "aws_iam_policy_document" "update_iam_credentials_for_user" {
     ]
   }
 
+  dynamic "statement" {
+    for_each = length(var.target_accounts) > 0 ? [1] : []
+
+    content {
+      sid       = "AllowTargetAccountsAccess"
+      effect    = "Allow"
+      resources = [for account in var.target_accounts : account.role_arn]
+
+      actions = [
+        "sts:AssumeRole"
+      ]
+    }
+  }
+
   statement {
     sid       = "AllowSNSPermissions"
     effect    = "Allow"
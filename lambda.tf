@@ -1,3 +1,8 @@
+resource "random_password" "request_signing_key" {
+  length  = 64
+  special = false
+}
+
 resource "aws_lambda_function" "find_users_to_refresh" {
   function_name = local.lambda_find_users_to_refresh_name
   memory_size   = 128
@@ -9,12 +14,38 @@ resource "aws_lambda_function" "find_users_to_refresh" {
   role          = aws_iam_role.find_users_to_refresh.arn
   #kms_key_arn   = aws_kms_key.iam_rotate_credentials.arn
 
+  # accounts and shards dispatched beyond this limit are retried by AWS Lambda
+  reserved_concurrent_executions = var.scan_max_concurrency
+
   environment {
     variables = {
-      AWS_SNS_RESULT_ARN           = aws_sns_topic.iam_rotate_credentials_result.arn
-      AWS_CLI_TIME_LIMIT           = var.aws_cli_time_limit
-      AWS_LOGIN_PROFILE_TIME_LIMIT = var.aws_login_profile_time_limit
-      AWS_SQS_REQUEST_URL          = local.sqs_url
+      AWS_SNS_RESULT_ARN                        = aws_sns_topic.iam_rotate_credentials_result.arn
+      AWS_CLI_TIME_LIMIT                        = var.aws_cli_time_limit
+      AWS_LOGIN_PROFILE_TIME_LIMIT              = var.aws_login_profile_time_limit
+      AWS_ROTATION_POLICY_RULES                 = jsonencode(var.rotation_policy_rules)
+      AWS_SQS_REQUEST_URL                       = local.sqs_url
+      AWS_EVALUATION_MODE                       = var.evaluation_mode
+      AWS_SES_VERIFICATION_TTL                  = var.ses_verification_ttl
+      AWS_SCAN_CONCURRENCY                      = var.scan_concurrency
+      AWS_SCAN_SHARDS                           = var.scan_shards
+      AWS_TARGET_ACCOUNTS                       = jsonencode(var.target_accounts)
+      AWS_CREDENTIAL_REPORT_MAX_AGE             = var.credential_report_max_age
+      AWS_CREDENTIAL_REPORT_SHARED_CACHE        = var.credential_report_shared_cache
+      AWS_STATE_STORE                           = "s3://${aws_s3_bucket.state.id}/"
+      AWS_INCREMENTAL_SCAN                      = var.incremental_scan
+      AWS_REQUEST_SIGNING_KEY                   = random_password.request_signing_key.result
+      AWS_REQUEST_DEDUPLICATION_TTL             = var.request_deduplication_ttl
+      AWS_LOGIN_PROFILE_PASSWORD_RESET_REQUIRED = var.aws_login_profile_password_reset_required
+      AWS_METRICS_NAMESPACE                     = var.metrics_namespace
+      AWS_CLIENT_RETRY_MODE                     = var.client_retry_mode
+      AWS_CLIENT_MAX_ATTEMPTS                   = var.client_max_attempts
+      AWS_CLIENT_CONNECT_TIMEOUT                = var.client_connect_timeout
+      AWS_CLIENT_READ_TIMEOUT                   = var.client_read_timeout
+      AWS_CLIENT_MAX_POOL_CONNECTIONS           = var.client_max_pool_connections
+      AWS_LOG_FORMAT                            = var.log_format
+      AWS_LOG_LEVEL                             = var.log_level
+      AWS_LOG_SAMPLING                          = var.log_sampling
+      AWS_NOTIFICATION_SUPPRESSION_WINDOW       = var.notification_suppression_window
     }
   }
 
@@ -44,6 +75,24 @@ resource "aws_lambda_function" "update_iam_credentials_for_user" {
       AWS_SNS_RESULT_ARN                        = aws_sns_topic.iam_rotate_credentials_result.arn
       CREDENTIALS_SENDED_BY                     = var.credentials_sended_by
       AWS_ACCOUNT_NAME                          = var.aws_account_name
+      AWS_SES_VERIFICATION_TTL                  = var.ses_verification_ttl
+      AWS_RECORD_CONCURRENCY                    = var.record_concurrency
+      AWS_REQUEST_SIGNING_KEY                   = random_password.request_signing_key.result
+      AWS_REQUEST_DEDUPLICATION_TTL             = var.request_deduplication_ttl
+      AWS_REQUEST_CONTEXT_TTL                   = var.request_context_ttl
+      AWS_STATE_STORE                           = "s3://${aws_s3_bucket.state.id}/"
+      AWS_SES_TEMPLATES                         = join(",", keys(var.email_templates))
+      AWS_METRICS_NAMESPACE                     = var.metrics_namespace
+      AWS_CLIENT_RETRY_MODE                     = var.client_retry_mode
+      AWS_CLIENT_MAX_ATTEMPTS                   = var.client_max_attempts
+      AWS_CLIENT_CONNECT_TIMEOUT                = var.client_connect_timeout
+      AWS_CLIENT_READ_TIMEOUT                   = var.client_read_timeout
+      AWS_CLIENT_MAX_POOL_CONNECTIONS           = var.client_max_pool_connections
+      AWS_LOG_FORMAT                            = var.log_format
+      AWS_LOG_LEVEL                             = var.log_level
+      AWS_LOG_SAMPLING                          = var.log_sampling
+      AWS_NOTIFICATION_SUPPRESSION_WINDOW       = var.notification_suppression_window
+      AWS_TARGET_ACCOUNTS                       = jsonencode(var.target_accounts)
     }
   }
 
@@ -55,6 +104,65 @@ resource "aws_lambda_function" "update_iam_credentials_for_user" {
   ]
 }
 
+# evaluates the users like the scan, with the role of the scan lambda
+resource "aws_lambda_function" "evaluate_user_on_iam_event" {
+  count         = var.iam_events ? 1 : 0
+  function_name = local.lambda_evaluate_user_on_iam_event_name
+  memory_size   = 128
+  description   = "Research if it is necessary to refresh the credentials of the user of an IAM event"
+  timeout       = var.function_timeout
+  runtime       = "python3.7"
+  filename      = "${path.module}/iam-rotate-credentials.zip"
+  handler       = "lambdaEvaluateUserOnIamEventHandler.main"
+  role          = aws_iam_role.find_users_to_refresh.arn
+
+  environment {
+    variables = {
+      AWS_SNS_RESULT_ARN                        = aws_sns_topic.iam_rotate_credentials_result.arn
+      AWS_CLI_TIME_LIMIT                        = var.aws_cli_time_limit
+      AWS_LOGIN_PROFILE_TIME_LIMIT              = var.aws_login_profile_time_limit
+      AWS_ROTATION_POLICY_RULES                 = jsonencode(var.rotation_policy_rules)
+      AWS_SQS_REQUEST_URL                       = local.sqs_url
+      AWS_EVALUATION_MODE                       = var.evaluation_mode
+      AWS_SES_VERIFICATION_TTL                  = var.ses_verification_ttl
+      AWS_TARGET_ACCOUNTS                       = jsonencode(var.target_accounts)
+      AWS_CREDENTIAL_REPORT_MAX_AGE             = var.credential_report_max_age
+      AWS_CREDENTIAL_REPORT_SHARED_CACHE        = var.credential_report_shared_cache
+      AWS_STATE_STORE                           = "s3://${aws_s3_bucket.state.id}/"
+      AWS_REQUEST_SIGNING_KEY                   = random_password.request_signing_key.result
+      AWS_REQUEST_DEDUPLICATION_TTL             = var.request_deduplication_ttl
+      AWS_LOGIN_PROFILE_PASSWORD_RESET_REQUIRED = var.aws_login_profile_password_reset_required
+      AWS_METRICS_NAMESPACE                     = var.metrics_namespace
+      AWS_CLIENT_RETRY_MODE                     = var.client_retry_mode
+      AWS_CLIENT_MAX_ATTEMPTS                   = var.client_max_attempts
+      AWS_CLIENT_CONNECT_TIMEOUT                = var.client_connect_timeout
+      AWS_CLIENT_READ_TIMEOUT                   = var.client_read_timeout
+      AWS_CLIENT_MAX_POOL_CONNECTIONS           = var.client_max_pool_connections
+      AWS_LOG_FORMAT                            = var.log_format
+      AWS_LOG_LEVEL                             = var.log_level
+      AWS_LOG_SAMPLING                          = var.log_sampling
+      AWS_NOTIFICATION_SUPPRESSION_WINDOW       = var.notification_suppression_window
+      AWS_UPDATE_LAMBDA_ROLE_ARN                = aws_iam_role.update_iam_credentials_for_user.arn
+    }
+  }
+
+  tags = merge(local.tags, map("Lambda", local.lambda_evaluate_user_on_iam_event_name))
+
+  depends_on = [
+    aws_iam_role_policy_attachment.find_users_to_refresh,
+    aws_cloudwatch_log_group.evaluate_user_on_iam_event
+  ]
+}
+
+resource "aws_lambda_permission" "allow_iam_events_to_call_lambda" {
+  count         = var.iam_events ? 1 : 0
+  statement_id  = "AllowExecutionFromIamEvents"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.evaluate_user_on_iam_event[0].function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.iam_events[0].arn
+}
+
 resource "aws_lambda_permission" "allow_cloudwatch_to_call_lambda" {
   statement_id  = "AllowExecutionFromCloudWatch"
   action        = "lambda:InvokeFunction"
@@ -64,9 +172,12 @@ resource "aws_lambda_permission" "allow_cloudwatch_to_call_lambda" {
 }
 
 resource "aws_lambda_event_source_mapping" "iam_rotate_credentials_request" {
-  event_source_arn = aws_sqs_queue.update_iam_credentials_for_user.arn
-  function_name    = aws_lambda_function.update_iam_credentials_for_user.arn
-  enabled          = true
+  event_source_arn                   = aws_sqs_queue.update_iam_credentials_for_user.arn
+  function_name                      = aws_lambda_function.update_iam_credentials_for_user.arn
+  enabled                            = true
+  batch_size                         = var.sqs_batch_size
+  maximum_batching_window_in_seconds = var.sqs_batching_window
+  function_response_types            = ["ReportBatchItemFailures"]
   depends_on = [
     aws_sqs_queue.update_iam_credentials_for_user,
     aws_lambda_function.update_iam_credentials_for_user
@@ -1,7 +1,8 @@
 
 terraform {
   required_providers {
-    aws = ">= 2.40.0"
+    aws    = ">= 3.61.0"
+    random = ">= 2.2.0"
   }
 }
 
@@ -17,7 +18,9 @@ locals {
   tags                                        = merge(var.tags, map("Service", local.service_name))
   lambda_find_users_to_refresh_name           = "${local.service_name}-find-users-to-refresh"
   lambda_update_iam_credentials_for_user_name = "${local.service_name}-update-iam-credentials-for-user"
+  lambda_evaluate_user_on_iam_event_name      = "${local.service_name}-evaluate-user-on-iam-event"
   lambda_prefix_arn                           = "arn:aws:lambda:${var.aws_region}:${data.aws_caller_identity.current.account_id}:function:"
   lambda_find_users_to_refresh_arn            = "${local.lambda_prefix_arn}${local.lambda_find_users_to_refresh_name}"
   lambda_update_iam_credentials_for_user_arn  = "${local.lambda_prefix_arn}${local.lambda_update_iam_credentials_for_user_name}"
+  state_bucket_name                           = "${local.service_name}-state-${data.aws_caller_identity.current.account_id}-${var.aws_region}"
 }
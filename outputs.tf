@@ -8,6 +8,16 @@ output "lambda_find_users_to_refresh_arn" {
   value       = aws_lambda_function.find_users_to_refresh.arn
 }
 
+output "lambda_find_users_to_refresh_role_arn" {
+  description = "The ARN of role of Find users to update IAM credentials lambda ( trusted by the roles of target accounts )"
+  value       = aws_iam_role.find_users_to_refresh.arn
+}
+
+output "lambda_update_iam_credentials_for_user_role_arn" {
+  description = "The ARN of role of Update IAM credentials lambda ( trusted by the roles of target accounts )"
+  value       = aws_iam_role.update_iam_credentials_for_user.arn
+}
+
 output "sns_iam_rotate_credentials_result_arn" {
   description = "The SNS result ARN of topic for result IAM rotate Credential lambdas execution"
   value       = aws_sns_topic.iam_rotate_credentials_result.arn
@@ -33,3 +43,8 @@ output "sqs_update_iam_credentials_for_user_dead_letter_id" {
   value       = aws_sqs_queue.update_iam_credentials_for_user_dead_letter.id
 }
 
+
+output "state_bucket_id" {
+  description = "The name of S3 bucket used to store the state of scans"
+  value       = aws_s3_bucket.state.id
+}
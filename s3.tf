@@ -0,0 +1,41 @@
+resource "aws_s3_bucket" "state" {
+  bucket = local.state_bucket_name
+  acl    = "private"
+
+  server_side_encryption_configuration {
+    rule {
+      apply_server_side_encryption_by_default {
+        sse_algorithm = "AES256"
+      }
+    }
+  }
+
+  # status of the requested credentials, kept request_deduplication_ttl seconds
+  lifecycle_rule {
+    id      = "requests"
+    enabled = true
+    prefix  = "requests/"
+
+    expiration {
+      days = ceil(var.request_deduplication_ttl / 86400) + 1
+    }
+  }
+
+  tags = local.tags
+}
+
+resource "aws_s3_bucket_public_access_block" "state" {
+  bucket                  = aws_s3_bucket.state.id
+  block_public_acls       = true
+  block_public_policy     = true
+  ignore_public_acls      = true
+  restrict_public_buckets = true
+}
+
+resource "aws_s3_bucket_object" "email_templates" {
+  for_each = var.email_templates
+
+  bucket  = aws_s3_bucket.state.id
+  key     = "templates/${each.key}.json"
+  content = jsonencode({ content = each.value })
+}
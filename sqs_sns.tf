@@ -10,7 +10,7 @@ resource "aws_sqs_queue" "update_iam_credentials_for_user" {
   max_message_size           = 2048
   message_retention_seconds  = 86400
   policy                     = data.aws_iam_policy_document.sqs_policy.json
-  redrive_policy             = "{\"deadLetterTargetArn\":\"${aws_sqs_queue.update_iam_credentials_for_user_dead_letter.arn}\",\"maxReceiveCount\":1}"
+  redrive_policy             = "{\"deadLetterTargetArn\":\"${aws_sqs_queue.update_iam_credentials_for_user_dead_letter.arn}\",\"maxReceiveCount\":${var.sqs_max_receive_count}}"
   tags                       = local.tags
   depends_on = [
     aws_sqs_queue.update_iam_credentials_for_user_dead_letter
@@ -3,9 +3,46 @@
 
 import re
 import os
+import json
+import time
 import logging
-import boto3
-import datetime
+import hmac
+import hashlib
+import threading
+
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'TooManyRequestsException']
+
+EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9_.+-]+@([a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)$")
+
+USER_CONTEXT_VERSION = 1
+
+# categories of the notifications published on the SNS result topic
+INVALID_EMAIL_CATEGORY = 'Users with an invalid email'
+UNVERIFIED_EMAIL_CATEGORY = 'Users with an email not validated by AWS SES'
+FAILED_SCAN_CATEGORY = 'Failed scans'
+FAILED_ROTATION_CATEGORY = 'Failed credentials rotations'
+NOT_SENT_CATEGORY = 'New credentials not sent, use IamRotateCredentials:ForceRefresh tag to generate new credentials'
+NOTIFICATION_HISTORY_KEY = 'notifications'
+# session name of the roles assumed in target accounts by the update lambda, its calls are recognized in the IAM events
+ROTATION_SESSION_NAME = 'iam-rotate-credentials-update'
+DEFAULT_NOTIFICATION_SUPPRESSION_WINDOW = 86400
+
+# botocore configuration of the AWS clients ( AWS_CLIENT_* variables )
+DEFAULT_CLIENT_RETRY_MODE = 'adaptive'
+DEFAULT_CLIENT_MAX_ATTEMPTS = 5
+DEFAULT_CLIENT_CONNECT_TIMEOUT = 5
+DEFAULT_CLIENT_READ_TIMEOUT = 60
+DEFAULT_CLIENT_MAX_POOL_CONNECTIONS = 10
+
+# reasons of exclusion of users, counted in the summary of run ( and categories of log sampling )
+NOT_DUE_EXCLUSION = 'not_due'
+NO_EMAIL_EXCLUSION = 'no_email'
+EMAIL_NOT_VALIDATED_EXCLUSION = 'email_not_validated'
+NOT_OBSOLETE_EXCLUSION = 'not_obsolete'
+ALREADY_REQUESTED_EXCLUSION = 'already_requested'
+ALREADY_PROCESSED_EXCLUSION = 'already_processed'
+USER_DELETED_EXCLUSION = 'user_deleted'
+PASSWORD_CHANGED_EXCLUSION = 'password_changed_by_event'
 
 class RefreshCredentialRequest(object):
     def __init__(self, **kwargs):
@@ -14,15 +51,462 @@ class RefreshCredentialRequest(object):
         self.access_key_ids = []
         self.cli_access = False
         self.login_profile = False
+        # target account of user, None for the account of deployment
+        self.account_id = None
+        # keys of the credentials of request, not requested again while they are in flight or done ( see request_tracker )
+        self.idempotency_keys = []
+        # user data resolved by the scanner, signed with AWS_REQUEST_SIGNING_KEY
+        self.user_context = None
         self.__dict__.update(kwargs)
         if not self.user_name:
             raise ValueError("user_name is required")
 
+    def attach_user_context(self, signing_key, email, password_reset_required, login_profile_exists):
+        """add the user data already resolved ( login_profile_exists is None if unknown )"""
+        user_context = {
+            'version': USER_CONTEXT_VERSION,
+            'email': email,
+            'validated_at': int(time.time()),
+            'password_reset_required': password_reset_required,
+            'login_profile_exists': login_profile_exists
+        }
+        user_context['signature'] = self._sign_user_context(signing_key, user_context)
+        self.user_context = user_context
+
+    def trusted_user_context(self, signing_key, max_age):
+        """user context if its signature is valid and it is not older than max_age seconds, else None"""
+        user_context = self.user_context
+        if not signing_key or not isinstance(user_context, dict):
+            return None
+        if user_context.get('version') != USER_CONTEXT_VERSION:
+            return None
+        signature = self._sign_user_context(signing_key, user_context)
+        if not hmac.compare_digest(signature, str(user_context.get('signature'))):
+            return None
+        if time.time() - user_context['validated_at'] > max_age:
+            return None
+        return user_context
+
+    def _sign_user_context(self, signing_key, user_context):
+        # the user name and the target account are signed to bind the context to this user
+        data = {k: v for k, v in user_context.items() if k != 'signature'}
+        signed = [self.user_name, data]
+        if self.account_id:
+            signed.append(self.account_id)
+        message = json.dumps(signed, sort_keys=True).encode('utf-8')
+        return hmac.new(signing_key.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+class AdaptiveRateLimiter(object):
+    """client side rate limiter of AWS calls, slows down on throttling errors and ramps back up on success"""
+
+    def __init__(self, max_rate, min_rate=1.0, increase=0.5, decrease=0.5):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.rate = max_rate
+        self.throttled = 0
+        self._next_time = 0
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        """limit all http requests sent by client ( retries included )"""
+        client.meta.events.register('before-send', self._before_send)
+        client.meta.events.register('needs-retry', self._needs_retry)
+
+    def acquire(self):
+        """wait for the next slot"""
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + 1.0 / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_throttle(self):
+        with self._lock:
+            self.throttled += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def _before_send(self, **kwargs):
+        self.acquire()
+
+    def _needs_retry(self, response=None, **kwargs):
+        # the retry decision is left to botocore
+        if response is None:
+            return None
+        code = response[1].get('Error', {}).get('Code')
+        if code in THROTTLING_ERROR_CODES:
+            self.on_throttle()
+        elif not code:
+            self.on_success()
+        return None
+
+class LazyClient(object):
+    """boto3 client ( or resource ) created on first use"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                client = self._client
+        return getattr(client, name)
+
+class RequestPublisher(object):
+    """publish the refresh credential requests to SQS queue by batch of 10 messages"""
+
+    MAX_BATCH_SIZE = 10
+
+    def __init__(self, sqs_client, queue_url, max_attempts=3, retry_delay=0.5, on_sending=None, on_not_sent=None):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        # called with each request before it is sent ( the consumer may receive it before the response of SQS )
+        self.on_sending = on_sending
+        # called with each request not sent when the batch fails
+        self.on_not_sent = on_not_sent
+        self.published = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def publish(self, request):
+        """add request to buffer, buffer is sent when it is full"""
+        requests = None
+        with self._lock:
+            self._buffer.append(request)
+            if len(self._buffer) >= self.MAX_BATCH_SIZE:
+                requests = self._buffer
+                self._buffer = []
+        if requests:
+            self._send_batch(requests)
+
+    def flush(self):
+        """send all requests of buffer"""
+        with self._lock:
+            requests = self._buffer
+            self._buffer = []
+        for i in range(0, len(requests), self.MAX_BATCH_SIZE):
+            self._send_batch(requests[i:i + self.MAX_BATCH_SIZE])
+
+    def _send_batch(self, requests):
+        entries = {str(i): x for i, x in enumerate(requests)}
+        if self.on_sending:
+            for request in requests:
+                self.on_sending(request)
+        try:
+            self._send_entries(entries)
+        except Exception:
+            if self.on_not_sent:
+                for request in entries.values():
+                    self.on_not_sent(request)
+            raise
+
+    def _send_entries(self, entries):
+        """send entries ( id -> request ), the entries sent are removed"""
+        attempt = 0
+        while entries:
+            attempt += 1
+            response = self.sqs_client.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': k, 'MessageBody': json.dumps(v.__dict__)} for k, v in entries.items()]
+            )
+            for item in response.get('Successful', []):
+                request = entries.pop(item['Id'])
+                with self._lock:
+                    self.published += 1
+                logging.getLogger().debug("Sends a credentials renewal request for the user %s", request.user_name)
+            failed = response.get('Failed', [])
+            if not failed:
+                return
+            # retry only the failed entries ( sender fault are not retryable )
+            reasons = ', '.join(f"{entries[x['Id']].user_name}: {x.get('Message', x.get('Code'))}" for x in failed)
+            if attempt >= self.max_attempts or any(x.get('SenderFault') for x in failed):
+                raise RuntimeError(f"Fail to send credentials renewal requests ( {reasons} )")
+            logging.getLogger().warning("Retry credentials renewal requests ( %s )", reasons)
+            time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+class UserTagCache(object):
+    """tags of iam users, with their IAM path and groups, loaded once per run"""
+
+    def __init__(self):
+        self._tags = {}
+        # user name -> ( path, group names )
+        self._placements = {}
+        self.loaded = False
+
+    def clear(self):
+        self._tags = {}
+        self._placements = {}
+        self.loaded = False
+
+    def load(self, iam_client):
+        """load the tags of all users of account in bulk"""
+        tags = {}
+        placements = {}
+        paginator = iam_client.get_paginator('get_account_authorization_details')
+        for response in paginator.paginate(Filter=['User']):
+            for item in response.get('UserDetailList', []):
+                tags[item['UserName']] = {x['Key']: x['Value'] for x in item.get('Tags', [])}
+                placements[item['UserName']] = (item.get('Path'), tuple(item.get('GroupList', [])))
+        self._tags = tags
+        self._placements = placements
+        self.loaded = True
+        return len(tags)
+
+    def get(self, iam_client, user_name):
+        """find the tags of user ( list_user_tags is called only if user is not in cache )"""
+        tags = self._tags.get(user_name)
+        if tags is None:
+            tags = self._list_user_tags(iam_client, user_name)
+            self._tags[user_name] = tags
+        return tags
+
+    def placement(self, iam_client, user_name):
+        """( IAM path, group names ) of user ( get_user and list_groups_for_user are called only if user is not in cache )"""
+        placement = self._placements.get(user_name)
+        if placement is None:
+            path = iam_client.get_user(UserName=user_name)['User'].get('Path')
+            groups = []
+            paginator = iam_client.get_paginator('list_groups_for_user')
+            for response in paginator.paginate(UserName=user_name):
+                groups += [x['GroupName'] for x in response.get('Groups', [])]
+            placement = self._placements[user_name] = (path, tuple(groups))
+        return placement
+
+    def all_tags(self):
+        """tags of all users in cache, by user name"""
+        return self._tags
+
+    def all_placements(self):
+        """( IAM path, group names ) of all users in cache, by user name"""
+        return self._placements
+
+    def user_names(self):
+        return list(self._tags.keys())
+
+    def find_values(self, tag_key, user_filter=None):
+        """find the values of a tag for all users in cache ( or for the users accepted by user_filter )"""
+        return [tags[tag_key] for user_name, tags in self._tags.items()
+                if tag_key in tags and (user_filter is None or user_filter(user_name))]
+
+    def remove(self, user_name, tag_key):
+        tags = self._tags.get(user_name)
+        if tags:
+            tags.pop(tag_key, None)
+
+    def _list_user_tags(self, iam_client, user_name):
+        tags = {}
+        paginator = iam_client.get_paginator('list_user_tags')
+        for response in paginator.paginate(UserName=user_name):
+            for item in response.get('Tags', []):
+                tags[item['Key']] = item['Value']
+        return tags
+
+class IdentityVerificationCache(object):
+    """verification status of AWS SES identities ( emails and domains ), kept across warm invocations"""
+
+    MAX_IDENTITIES_PER_CALL = 100
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._status = {}
+
+    def resolve(self, ses_client, identities):
+        """resolve in batch the status of identities not in cache or expired"""
+        now = time.time()
+        missing = sorted(set(x for x in identities if not self._is_fresh(x, now)))
+        for i in range(0, len(missing), self.MAX_IDENTITIES_PER_CALL):
+            batch = missing[i:i + self.MAX_IDENTITIES_PER_CALL]
+            response = ses_client.get_identity_verification_attributes(Identities=batch)
+            attributes = response['VerificationAttributes']
+            for identity in batch:
+                # None if the identity is not registered in AWS SES
+                status = attributes.get(identity, {}).get('VerificationStatus')
+                self._status[identity] = (status, now)
+        return len(missing)
+
+    def get(self, ses_client, identity):
+        """find the verification status of identity"""
+        if not self._is_fresh(identity, time.time()):
+            self.resolve(ses_client, [identity])
+        return self._status[identity][0]
+
+    def _is_fresh(self, identity, now):
+        item = self._status.get(identity)
+        return item is not None and now - item[1] < self.ttl
+
+class NotificationDigest(object):
+    """warnings and errors of one invocation, published together by category"""
+
+    # SNS messages are limited to 256 KB
+    MAX_MESSAGE_SIZE = 250000
+    VERBOSITIES = ['ERROR', 'WARN', 'INFO']
+
+    def __init__(self):
+        # ( verbosity, category ) -> messages
+        self._messages = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(x) for x in self._messages.values())
+
+    def add(self, category, message, verbosity='WARN'):
+        with self._lock:
+            self._messages.setdefault((verbosity, category), []).append(message)
+
+    def flush(self, publish, history=None, window=0, now=None):
+        """publish the messages by verbosity in chunks under the SNS size limit, returns the number of chunks published
+
+        history: publication time by fingerprint of the categories of the previous runs ( updated ), a category
+        with the same messages than a publication of the last window seconds is not published again.
+        """
+        with self._lock:
+            messages, self._messages = self._messages, {}
+        now = now or time.time()
+        if history is not None:
+            for fingerprint in [k for k, v in history.items() if now - v >= window]:
+                del history[fingerprint]
+        published = 0
+        for verbosity in sorted(set(x[0] for x in messages), key=self._verbosity_order):
+            lines = []
+            for category in sorted(x[1] for x in messages if x[0] == verbosity):
+                category_messages = sorted(set(messages[(verbosity, category)]))
+                if history is not None:
+                    fingerprint = hashlib.sha1(json.dumps([verbosity, category, category_messages]).encode('utf-8')).hexdigest()
+                    if fingerprint in history:
+                        continue
+                    history[fingerprint] = now
+                lines.append(f'{category} ( {len(category_messages)} ) :')
+                lines.extend(f'- {x}' for x in category_messages)
+            for chunk in self._chunks(lines):
+                publish(chunk, verbosity=verbosity)
+                published += 1
+        return published
+
+    def _chunks(self, lines):
+        chunk, size = [], 0
+        for line in lines:
+            line = line[:self.MAX_MESSAGE_SIZE // 4]
+            # utf-8 encodes a character in 4 bytes at most
+            line_size = len(line.encode('utf-8')) + 1
+            if chunk and size + line_size > self.MAX_MESSAGE_SIZE:
+                yield '\n'.join(chunk)
+                chunk, size = [], 0
+            chunk.append(line)
+            size += line_size
+        if chunk:
+            yield '\n'.join(chunk)
+
+    def _verbosity_order(self, verbosity):
+        return self.VERBOSITIES.index(verbosity) if verbosity in self.VERBOSITIES else len(self.VERBOSITIES)
+
+class TargetAccount(object):
+    """account where the users are managed with an assumed role"""
+
+    def __init__(self, role_arn, name=None):
+        self.role_arn = role_arn
+        self.account_id = role_arn.split(':')[4]
+        self.name = name
+
+def load_target_accounts(value):
+    """target accounts by id from [{"role_arn": "<arn>", "name": "<account name>"}] ( AWS_TARGET_ACCOUNTS )"""
+    result = {}
+    for item in json.loads(value) if value else []:
+        account = TargetAccount(item['role_arn'], item.get('name'))
+        result[account.account_id] = account
+    return result
+
+class AssumedRoleSessionPool(object):
+    """boto3 sessions of the roles assumed in target accounts, kept across warm invocations
+
+    The role is assumed on first use, the credentials are assumed again by botocore before their expiry
+    so the clients created from a session are never recreated.
+    """
+
+    def __init__(self, sts_client, session_name='iam-rotate-credentials', duration=3600):
+        self.sts_client = sts_client
+        self.session_name = session_name
+        self.duration = duration
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, role_arn):
+        with self._lock:
+            session = self._sessions.get(role_arn)
+            if session is None:
+                session = self._sessions[role_arn] = self._create_session(role_arn)
+            return session
+
+    def _create_session(self, role_arn):
+        import boto3
+        import botocore.session
+        from botocore.credentials import CredentialProvider, CredentialResolver, DeferredRefreshableCredentials
+
+        class AssumeRoleProvider(CredentialProvider):
+            """credentials of role assumed by the sts client of pool ( the only provider of session )"""
+            METHOD = 'sts-assume-role'
+
+            def load(self):
+                return DeferredRefreshableCredentials(refresh_using=assume_role, method=self.METHOD)
+
+        def assume_role():
+            credentials = self.sts_client.assume_role(
+                RoleArn=role_arn, RoleSessionName=self.session_name, DurationSeconds=self.duration)['Credentials']
+            return {
+                'access_key': credentials['AccessKeyId'],
+                'secret_key': credentials['SecretAccessKey'],
+                'token': credentials['SessionToken'],
+                'expiry_time': credentials['Expiration'].isoformat()
+            }
+        botocore_session = botocore.session.Session()
+        botocore_session.register_component('credential_provider', CredentialResolver([AssumeRoleProvider()]))
+        return boto3.Session(botocore_session=botocore_session)
+
 class Common(object):
 
     def __init__(self):
-        self._logger = logger = logging.getLogger()
-        self._logger.setLevel(logging.INFO)
+        self._logger = logging.getLogger()
+        from structured_log import configure_logging, DEFAULT_LOG_FORMAT, DEFAULT_LOG_LEVEL, DEFAULT_LOG_SAMPLING
+        self._log_sampler = configure_logging(
+            self._logger, os.environ.get('AWS_LOG_FORMAT', DEFAULT_LOG_FORMAT), os.environ.get('AWS_LOG_LEVEL', DEFAULT_LOG_LEVEL),
+            os.environ.get('AWS_LOG_SAMPLING', DEFAULT_LOG_SAMPLING))
+        # users excluded by reason in this run
+        self._exclusions = {}
+        self._exclusions_lock = threading.Lock()
+        self.tag_cache = UserTagCache()
+        self._account_id = None
+        # imported here, metrics module uses the constants of this module
+        from metrics import Metrics, DEFAULT_NAMESPACE
+        self.metrics = Metrics(os.environ.get('AWS_METRICS_NAMESPACE', DEFAULT_NAMESPACE))
+        self._client_defaults = {
+            'retries': {
+                'mode': os.environ.get('AWS_CLIENT_RETRY_MODE') or DEFAULT_CLIENT_RETRY_MODE,
+                'max_attempts': self.to_int(os.environ.get('AWS_CLIENT_MAX_ATTEMPTS'), DEFAULT_CLIENT_MAX_ATTEMPTS)
+            },
+            'connect_timeout': self.to_int(os.environ.get('AWS_CLIENT_CONNECT_TIMEOUT'), DEFAULT_CLIENT_CONNECT_TIMEOUT),
+            'read_timeout': self.to_int(os.environ.get('AWS_CLIENT_READ_TIMEOUT'), DEFAULT_CLIENT_READ_TIMEOUT),
+            'max_pool_connections': self.to_int(os.environ.get('AWS_CLIENT_MAX_POOL_CONNECTIONS'), DEFAULT_CLIENT_MAX_POOL_CONNECTIONS)
+        }
+        self._clients = {}
+        self._clients_lock = threading.Lock()
+        self._sns_client = self.client('sns')
+        self.notifications = NotificationDigest()
+        self.target_accounts = load_target_accounts(os.environ.get('AWS_TARGET_ACCOUNTS'))
+        self.session_pool = AssumedRoleSessionPool(self.client('sts'))
+        self.identity_cache = IdentityVerificationCache(
+            self.to_int(os.environ.get('AWS_SES_VERIFICATION_TTL'), 3600))
 
     @property
     def logger(self):
@@ -33,50 +517,161 @@ class Common(object):
         """get logger"""
         return self._logger
 
+    def client(self, service_name, config=None, on_create=None, region=None, account_id=None):
+        """client shared by all call sites, created once by service, region, config and on_create ( config: arguments of botocore
+        Config added to the AWS_CLIENT_* defaults, on_create: called with the new client, account_id: target account )"""
+        config = self.client_config(config)
+        key = (account_id, service_name, region, json.dumps(config, sort_keys=True), on_create)
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None:
+                session = None
+                if account_id is not None:
+                    if account_id not in self.target_accounts:
+                        raise ValueError(f"Account {account_id} is not a target account")
+                    role_arn = self.target_accounts[account_id].role_arn
+                    session = lambda: self.session_pool.get(role_arn)
+                client = self._clients[key] = self.lazy_client(service_name, config, on_create, session, region)
+            return client
+
+    def client_config(self, config=None):
+        """arguments of botocore Config : AWS_CLIENT_* defaults overridden by config ( the pool is not smaller than the default pool )"""
+        result = dict(self._client_defaults, retries=dict(self._client_defaults['retries']))
+        for name, value in (config or {}).items():
+            if name == 'retries':
+                result['retries'].update(value)
+            elif name == 'max_pool_connections':
+                result[name] = max(result[name], value)
+            else:
+                result[name] = value
+        return result
+
+    def lazy_client(self, service_name, config=None, on_create=None, session=None, region=None):
+        """client created on first use and instrumented ( config: arguments of botocore Config, on_create: called with the new client,
+        session: returns the boto3 session of client, default session if None ), use client() to share it"""
+        def factory():
+            # boto3 is imported only when the first AWS call is done
+            import boto3
+            from botocore.config import Config
+            client = (session() if session else boto3).client(service_name, region_name=region,
+                                                              config=Config(**config) if config else None)
+            self.metrics.attach(client)
+            if on_create:
+                on_create(client)
+            return client
+        return LazyClient(factory)
+
+    def account_client(self, account_id, service_name, config=None, on_create=None):
+        """client of target account ( client of deployment account if account_id is None )"""
+        return self.client(service_name, config, on_create, account_id=account_id)
+
+    def log_exclusion(self, user_name, reason, message, *args):
+        """log the exclusion of user ( sampled by reason, message is formatted only if logged ) and count it in the summary of run"""
+        with self._exclusions_lock:
+            self._exclusions[reason] = self._exclusions.get(reason, 0) + 1
+        self.logger.info(message, *args, extra={'category': reason, 'fields': {'user': user_name}})
+
+    def log_user(self, user_name, category, message, *args):
+        """log a routine line of user ( sampled by category, message is formatted only if logged )"""
+        self.logger.info(message, *args, extra={'category': category, 'fields': {'user': user_name}})
+
+    def log_summary(self, **fields):
+        """log the summary of run ( users excluded by reason, lines dropped by the sampling ) and reset it"""
+        with self._exclusions_lock:
+            exclusions, self._exclusions = self._exclusions, {}
+        summary = dict(fields, exclusions=exclusions, sampled_out=self._log_sampler.reset())
+        self.logger.info("Summary of run, %s users excluded", sum(exclusions.values()),
+                         extra={'category': 'summary', 'fields': summary})
+
+    def get_account_name(self, account_id=None):
+        """name of target account, AWS_ACCOUNT_NAME for the account of deployment"""
+        if account_id is not None and account_id in self.target_accounts:
+            return self.target_accounts[account_id].name
+        return os.environ.get('AWS_ACCOUNT_NAME')
+
     def send_message(self, message, verbosity = 'INFO'):
         """send message to sns topic"""
-        sns_client = boto3.client('sns')
         aws_sns_result_arn = os.environ.get('AWS_SNS_RESULT_ARN')
-        return sns_client.publish(TopicArn=aws_sns_result_arn, Message=f'[{verbosity}]:{message}')
+        return self._sns_client.publish(TopicArn=aws_sns_result_arn, Message=f'[{verbosity}]:{message}')
+
+    def notify(self, category, message, verbosity='WARN'):
+        """add message to the digest published at the end of invocation"""
+        self.notifications.add(category, message, verbosity)
 
-    def get_account_id(self):
-        return boto3.client('sts').get_caller_identity().get('Account')
+    def notification_history_key(self):
+        """key of the history of notifications, one history by lambda ( the lambdas publish different categories )"""
+        return f"{NOTIFICATION_HISTORY_KEY}/{os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')}"
+
+    def publish_notifications(self, state_store=None, history_key=None):
+        """publish the digest of invocation, the categories already published in the suppression window are skipped
+
+        history_key: key of the history in state store ( default: notification_history_key ), the concurrent
+        invocations ( accounts, shards ) use their own key, the history is loaded and saved without lock.
+        """
+        if not len(self.notifications):
+            return
+        try:
+            window = self.to_int(os.environ.get('AWS_NOTIFICATION_SUPPRESSION_WINDOW'), DEFAULT_NOTIFICATION_SUPPRESSION_WINDOW)
+            key = history_key or self.notification_history_key()
+            history = state_store.load(key, {}) if state_store and window > 0 else None
+            published = self.notifications.flush(self.send_message, history, window)
+            if history is not None:
+                state_store.save(key, history)
+            self.metrics.increment('NotificationsPublished', published)
+        except Exception as e:
+            # the result of invocation does not depend on the notifications
+            self.logger.error('Unable to publish the notifications, reason: %s', e)
+
+    def get_account_id(self, context=None):
+        """account id from the arn of invoked lambda, else from AWS STS ( resolved once )"""
+        if not self._account_id:
+            arn = getattr(context, 'invoked_function_arn', None)
+            if arn:
+                self._account_id = arn.split(':')[4]
+            else:
+                self._account_id = self.client('sts').get_caller_identity().get('Account')
+        return self._account_id
+
+    def prefetch_identities(self, ses_client, emails):
+        """resolve in batch the AWS SES status of emails and of their domains"""
+        identities = set()
+        for email in emails:
+            match = EMAIL_REGEX.match(email)
+            if match:
+                identities.add(email)
+                identities.add(match.group(1))
+        count = self.identity_cache.resolve(ses_client, identities)
+        self.logger.info('AWS SES status of %s identities resolved ( %s identities used )', count, len(identities))
 
     def is_known_email(self, ses_client, user_name, email):
-        self.logger.info(f'Check AWS SES email status ("{email}") for user "{user_name}"')
-        response = ses_client.get_identity_verification_attributes(Identities=[email])
-        status = None
-        if email in response['VerificationAttributes']:
-            status = response['VerificationAttributes'][email][
-                'VerificationStatus']
+        self.logger.debug('Check AWS SES email status ("%s") for user "%s"', email, user_name)
+        status = self.identity_cache.get(ses_client, email)
+        if status:
             if status == 'Success':
-                self.logger.info(f'User {user_name} s validated by AWS SES ( AWS SES email = {email}, status = {status} ).')
+                self.logger.debug('User %s is validated by AWS SES ( AWS SES email = %s, status = %s ).', user_name, email, status)
                 return True
         return False
 
     def is_known_domain(self, ses_client, user_name, domain):
-        self.logger.info(f'Check AWS SES domain status ("{domain}") for user "{user_name}"')
-        response = ses_client.get_identity_verification_attributes(Identities=[domain])
-        if domain in response['VerificationAttributes']:
-            status = response['VerificationAttributes'][domain][
-                'VerificationStatus']
+        self.logger.debug('Check AWS SES domain status ("%s") for user "%s"', domain, user_name)
+        status = self.identity_cache.get(ses_client, domain)
+        if status:
             if status == 'Success':
-                self.logger.info(f'User {user_name} is validated by AWS SES ( AWS SES domain = {domain}, status = {status} ).')
+                self.logger.debug('User %s is validated by AWS SES ( AWS SES domain = %s, status = %s ).', user_name, domain, status)
                 return True
             else:
-                self.logger.info(f'User {user_name} is not validated by AWS SES ( AWS SES domain = {domain}, status = {status} ).')
+                self.logger.info('User %s is not validated by AWS SES ( AWS SES domain = %s, status = %s ).', user_name, domain, status)
                 return False
         else:
-            self.logger.warn(f'User {user_name} is no validated by AWS SES ( AWS SES domain = {domain}, reason: domain not found ).')
+            self.logger.warning('User %s is no validated by AWS SES ( AWS SES domain = %s, reason: domain not found ).', user_name, domain)
             return False
         return False
     
     def is_valid_email(self, ses_client, user_name, email):
-        match = re.match(r"^[a-zA-Z0-9_.+-]+@([a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+)$", email)
+        match = EMAIL_REGEX.match(email)
         if not match:
-            message = f'For user {user_name}, {email} is not a valid email.'
-            self.logger.warn(message)
-            self.send_message(message,verbosity='WARN')
+            self.logger.warning('For user %s, %s is not a valid email.', user_name, email)
+            self.notify(INVALID_EMAIL_CATEGORY, f'For user {user_name}, {email} is not a valid email.')
             return False
     
         # test user mail
@@ -90,9 +685,8 @@ class Common(object):
         if is_valid:
             return True
 
-        message = f'User {user_name} with email {email} is not validated by AWS SES.'
-        self.logger.warn(message)
-        self.send_message(message, verbosity='WARN')
+        self.logger.warning('User %s with email %s is not validated by AWS SES.', user_name, email)
+        self.notify(UNVERIFIED_EMAIL_CATEGORY, f'User {user_name} with email {email} is not validated by AWS SES.')
         return False
 
     def to_int(self, value, default):
@@ -101,21 +695,44 @@ class Common(object):
         except:
             return default
 
-    def find_user_tag(self, iam_client, user_name, tag_key, marker=None):
-        response = None
-        if not marker:
-            response = iam_client.list_user_tags(UserName=user_name)
-        else:
-            response = iam_client.list_user_tags(UserName=user_name, Marker=marker)
-        if 'Tags' in response:
-            tag = next((x for x in response['Tags'] if x['Key'] == tag_key), None)
-            if tag:
-                return tag['Value']
-        if 'IsTruncated' in response and bool(response['IsTruncated']):
-            return find_user_tag(user_name, tag_key, marker=response['Marker'])
-
-    def consume_user_tag(self, iam_client, user_name, tag_key, marker=None):
+    def load_user_tags(self, iam_client):
+        """load the tags of all users, fallback to list_user_tags for each user if not allowed"""
+        self.tag_cache.clear()
+        try:
+            count = self.tag_cache.load(iam_client)
+            self.logger.info('Tags of %s users loaded', count)
+        except iam_client.exceptions.ClientError as e:
+            self.logger.warning('Unable to load the tags of all users, reason: %s', e)
+
+    def find_user_tag(self, iam_client, user_name, tag_key):
+        return self.tag_cache.get(iam_client, user_name).get(tag_key)
+
+    def is_password_reset_required(self, iam_client, user_name):
+        """the console password must be changed by the user at the next login"""
+        with_reset_password = self.find_user_tag(iam_client, user_name, 'IamRotateCredentials:LoginProfilePasswordResetRequired')
+        if not with_reset_password:
+            with_reset_password = os.environ.get('AWS_LOGIN_PROFILE_PASSWORD_RESET_REQUIRED')
+        if not with_reset_password:
+            return True
+        return with_reset_password.lower().strip() in ['true', '1']
+
+    def consume_user_tag(self, iam_client, user_name, tag_key):
         val = self.find_user_tag(iam_client,user_name,tag_key)
         if val:
             iam_client.untag_user(UserName = user_name, TagKeys=[tag_key])
+            self.tag_cache.remove(user_name, tag_key)
         return val
+
+def jump_consistent_hash(key, buckets):
+    """bucket of 64 bits key in [0, buckets[ ( jump consistent hash, only 1/n keys move when one bucket is added )"""
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+def user_shard(user_name, shards):
+    """shard of user ( same result for all invocations, unlike hash() )"""
+    key = int.from_bytes(hashlib.sha1(user_name.encode('utf-8')).digest()[:8], 'big')
+    return jump_consistent_hash(key, shards)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io
+import csv
+import array
+import datetime
+
+NOT_AVAILABLE_VALUES = ('N/A', 'not_supported', 'no_information', '')
+# day ordinal of a missing credential ( after any real date )
+NEVER = 10 ** 9
+
+class CredentialReportEntry(object):
+    """credential report row of one iam user ( only the columns used by the rotation )"""
+
+    __slots__ = (
+        'user_name',
+        'user_creation_time',
+        'password_enabled',
+        'password_last_changed',
+        'access_key_1_active',
+        'access_key_1_last_rotated',
+        'access_key_2_active',
+        'access_key_2_last_rotated'
+    )
+
+    def __init__(self, user_name, user_creation_time=None, password_enabled=False, password_last_changed=None,
+                 access_key_1_active=False, access_key_1_last_rotated=None,
+                 access_key_2_active=False, access_key_2_last_rotated=None):
+        self.user_name = user_name
+        self.user_creation_time = user_creation_time
+        self.password_enabled = password_enabled
+        self.password_last_changed = password_last_changed
+        self.access_key_1_active = access_key_1_active
+        self.access_key_1_last_rotated = access_key_1_last_rotated
+        self.access_key_2_active = access_key_2_active
+        self.access_key_2_last_rotated = access_key_2_last_rotated
+
+class CredentialReport(object):
+    """credential report indexed by iam user name"""
+
+    def __init__(self, generated_time=None):
+        self.generated_time = generated_time
+        self._entries = {}
+        self._columns = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_name):
+        return user_name in self._entries
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def get(self, user_name):
+        """find the credential report row of user ( None if user is not in report )"""
+        return self._entries.get(user_name)
+
+    def add(self, entry):
+        self._entries[entry.user_name] = entry
+        self._columns = None
+
+    def columns(self):
+        """columns of the dates of credentials ( built once, the report is reused by the warm invocations )"""
+        if self._columns is None:
+            self._columns = CredentialReportColumns(self._entries.values())
+        return self._columns
+
+    @classmethod
+    def parse(cls, content, generated_time=None):
+        """parse the csv content of credential report ( bytes or str ) in one pass"""
+        if isinstance(content, bytes):
+            stream = io.TextIOWrapper(io.BytesIO(content), encoding='utf-8', newline='')
+        else:
+            stream = io.StringIO(content, newline='')
+        report = cls(generated_time=generated_time)
+        reader = csv.reader(stream)
+        header = next(reader, None)
+        if not header:
+            return report
+        columns = {name: index for index, name in enumerate(header)}
+        user = columns['user']
+        user_creation_time = columns.get('user_creation_time')
+        password_enabled = columns.get('password_enabled')
+        password_last_changed = columns.get('password_last_changed')
+        access_key_1_active = columns.get('access_key_1_active')
+        access_key_1_last_rotated = columns.get('access_key_1_last_rotated')
+        access_key_2_active = columns.get('access_key_2_active')
+        access_key_2_last_rotated = columns.get('access_key_2_last_rotated')
+        # many users share the same dates, reuse the parsed values
+        dates = {value[:10]: None for value in NOT_AVAILABLE_VALUES}
+
+        def to_date(value):
+            # keep only the day : 2020-02-05T10:12:33+00:00 -> 2020-02-05
+            day = value[:10]
+            if day in dates:
+                return dates[day]
+            date = datetime.datetime.strptime(day, '%Y-%m-%d').date()
+            dates[day] = date
+            return date
+
+        entries = report._entries
+        for row in reader:
+            if not row:
+                continue
+            entries[row[user]] = CredentialReportEntry(
+                row[user],
+                to_date(row[user_creation_time]) if user_creation_time is not None else None,
+                password_enabled is not None and row[password_enabled] == 'true',
+                to_date(row[password_last_changed]) if password_last_changed is not None else None,
+                access_key_1_active is not None and row[access_key_1_active] == 'true',
+                to_date(row[access_key_1_last_rotated]) if access_key_1_last_rotated is not None else None,
+                access_key_2_active is not None and row[access_key_2_active] == 'true',
+                to_date(row[access_key_2_last_rotated]) if access_key_2_last_rotated is not None else None
+            )
+        return report
+
+class CredentialReportColumns(object):
+    """day ordinals of the last change of the active credentials of users, one array by credential ( NEVER if none )
+
+    The row of index len(user_names) is an user absent of the report.
+    """
+
+    def __init__(self, entries):
+        self.user_names = []
+        password = []
+        access_key_1 = []
+        access_key_2 = []
+        # many users share the same dates
+        ordinals = {None: NEVER}
+
+        def to_ordinal(date):
+            value = ordinals.get(date)
+            if value is None:
+                value = ordinals[date] = date.toordinal()
+            return value
+
+        for entry in entries:
+            self.user_names.append(entry.user_name)
+            # password never changed since the creation of user
+            password.append(to_ordinal(entry.password_last_changed or entry.user_creation_time)
+                            if entry.password_enabled else NEVER)
+            access_key_1.append(to_ordinal(entry.access_key_1_last_rotated) if entry.access_key_1_active else NEVER)
+            access_key_2.append(to_ordinal(entry.access_key_2_last_rotated) if entry.access_key_2_active else NEVER)
+        self.index = {x: i for i, x in enumerate(self.user_names)}
+        self.password = array.array('l', password + [NEVER])
+        self.access_key_1 = array.array('l', access_key_1 + [NEVER])
+        self.access_key_2 = array.array('l', access_key_2 + [NEVER])
+        self.in_report = bytearray([1] * len(self.user_names) + [0])
+
+class CredentialReportCache(object):
+    """credential reports kept until they are older than max_age seconds ( IAM generates a report every 4 hours at most )
+
+    The last parsed report is kept in memory, the content of reports in the stores given to get and put
+    ( /tmp for the warm invocations, the state store to share the report between invocations ).
+    """
+
+    def __init__(self, max_age):
+        self.max_age = max_age
+        # ( key, report ), only one report is kept in memory
+        self._last = None
+
+    def get(self, key, stores=()):
+        """fresh report of key, None if the report must be generated"""
+        if self._last is not None and self._last[0] == key and self.is_fresh(self._last[1].generated_time):
+            return self._last[1]
+        for index, store in enumerate(stores):
+            document = store.load(key)
+            if not document:
+                continue
+            generated_time = datetime.datetime.fromisoformat(document['generated_time'])
+            if not self.is_fresh(generated_time):
+                continue
+            report = CredentialReport.parse(document['content'], generated_time=generated_time)
+            # the first stores are the fastest
+            for faster_store in stores[:index]:
+                faster_store.save(key, document)
+            self._last = (key, report)
+            return report
+        return None
+
+    def put(self, key, content, generated_time, stores=()):
+        """parse the report and keep it if it can be reused"""
+        report = CredentialReport.parse(content, generated_time=generated_time)
+        if self.max_age > 0 and generated_time is not None:
+            if isinstance(content, bytes):
+                content = content.decode('utf-8')
+            document = {'generated_time': generated_time.isoformat(), 'content': content}
+            for store in stores:
+                store.save(key, document)
+            self._last = (key, report)
+        return report
+
+    def is_fresh(self, generated_time):
+        if self.max_age <= 0 or generated_time is None:
+            return False
+        if generated_time.tzinfo is None:
+            generated_time = generated_time.replace(tzinfo=datetime.timezone.utc)
+        age = datetime.datetime.now(datetime.timezone.utc) - generated_time
+        return age.total_seconds() < self.max_age
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import traceback
+
+import lambdaFindUsersToRefreshHandler as scanner
+from common import FAILED_SCAN_CATEGORY
+from common import PASSWORD_CHANGED_EXCLUSION
+from common import ROTATION_SESSION_NAME
+from common import RequestPublisher
+from common import USER_DELETED_EXCLUSION
+from request_tracker import RequestTracker
+from rotation_rules import FORCE_REFRESH_TAG
+from state_store import create_state_store
+
+# CloudTrail IAM events which can change the evaluation of an user
+USER_EVENTS = ['CreateUser', 'TagUser', 'UntagUser', 'CreateAccessKey', 'UpdateAccessKey',
+               'CreateLoginProfile', 'UpdateLoginProfile']
+# events which set a new console password ( newer than the password of credential report )
+PASSWORD_EVENTS = ['CreateLoginProfile', 'UpdateLoginProfile']
+
+# the scan and the evaluation of events share the same rules, clients and caches
+common = scanner.common
+
+def main(event, context):
+    """entry point, event: CloudTrail IAM event delivered by an EventBridge rule ( detail-type "AWS API Call via CloudTrail" )"""
+    publisher = RequestPublisher(scanner.sqs_client, os.environ.get('AWS_SQS_REQUEST_URL'))
+    account_id = None
+    state_store = None
+    try:
+        user_event = parse_event(event, context)
+        if user_event is None:
+            common.metrics.increment('IamEventsIgnored')
+            return
+        event_name, user_name, account_id = user_event
+        common.log_user(user_name, 'event', "Evaluate user %s on %s event", user_name, event_name)
+        scanner.bind_account(account_id)
+        state_store = create_state_store(os.environ.get('AWS_STATE_STORE'), common.client)
+        request_tracker = None
+        if scanner.DEDUPLICATION_TTL > 0:
+            request_tracker = RequestTracker(state_store, scanner.DEDUPLICATION_TTL)
+            publisher.on_sending = request_tracker.mark_in_flight
+            publisher.on_not_sent = request_tracker.clear_in_flight
+        credential_report = scanner.get_credential_report(scanner.credential_report_stores(state_store),
+                                                          scanner.state_key(scanner.CREDENTIAL_REPORT_KEY, None, account_id), context)
+        # the tags of user are read again, the event may have changed them
+        common.tag_cache.clear()
+        scan = scanner.ScanContext(credential_report, publisher, scanner.get_evaluation_mode(), account_id=account_id,
+                                   request_tracker=request_tracker)
+        evaluate_user(scan, user_name, event_name)
+        publisher.flush()
+        common.metrics.increment('IamEventsProcessed')
+    except Exception as e:
+        stack_trace = traceback.format_exc()
+        common.logger.error(stack_trace)
+        common.notify(FAILED_SCAN_CATEGORY,
+            f"Fail to evaluate the user of IAM event {account_id or common.get_account_id(context)}, reason : {e}", verbosity='ERROR')
+        raise
+    finally:
+        common.publish_notifications(state_store, scanner.state_key(common.notification_history_key(), None, account_id))
+        common.metrics.increment('RequestsPublished', publisher.published)
+        common.log_summary(account=account_id, requests_published=publisher.published)
+        common.metrics.emit(context)
+
+def parse_event(event, context):
+    """( event name, user name, target account ) of event, None if the event can not change the evaluation of user"""
+    detail = event.get('detail') or {}
+    event_name = detail.get('eventName')
+    if event_name not in USER_EVENTS:
+        common.logger.info("Event %s ignored, reason: not an IAM user event", event_name)
+        return None
+    if detail.get('errorCode'):
+        common.logger.info("Event %s ignored, reason: call failed ( %s )", event_name, detail['errorCode'])
+        return None
+    if is_rotation_event(detail):
+        common.logger.info("Event %s ignored, reason: call of the update lambda", event_name)
+        return None
+    request_parameters = detail.get('requestParameters') or {}
+    if event_name == 'TagUser':
+        tag_keys = [x.get('key') for x in request_parameters.get('tags') or []]
+    elif event_name == 'UntagUser':
+        # the scan consumes the force refresh tag
+        tag_keys = [x for x in request_parameters.get('tagKeys') or [] if x != FORCE_REFRESH_TAG]
+    else:
+        tag_keys = None
+    if tag_keys is not None and not any(x and x.startswith(scanner.TAG_PREFIX) for x in tag_keys):
+        common.logger.info("Event %s ignored, reason: no %s tag changed", event_name, scanner.TAG_PREFIX)
+        return None
+    user_name = event_user_name(detail)
+    if not user_name:
+        common.logger.warning("Event %s ignored, reason: user not found in event %s", event_name, detail.get('eventID'))
+        return None
+    account_id = event.get('account') or detail.get('recipientAccountId')
+    if not account_id or account_id == common.get_account_id(context):
+        return event_name, user_name, None
+    if account_id not in common.target_accounts:
+        common.logger.warning("Event %s of user %s ignored, reason: account %s is not a target account", event_name, user_name, account_id)
+        return None
+    return event_name, user_name, account_id
+
+def is_rotation_event(detail):
+    """test if the event is a call of the update lambda ( its role in the account of deployment, its session in target accounts )
+
+    The credential report is older than the rotation, the user would look obsolete and be refreshed again.
+    """
+    identity = detail.get('userIdentity') or {}
+    issuer = ((identity.get('sessionContext') or {}).get('sessionIssuer') or {}).get('arn')
+    if issuer and issuer == os.environ.get('AWS_UPDATE_LAMBDA_ROLE_ARN'):
+        return True
+    return identity.get('type') == 'AssumedRole' and (identity.get('arn') or '').endswith(f'/{ROTATION_SESSION_NAME}')
+
+def event_user_name(detail):
+    """name of the user of event ( an user creating their own access key is only in the response and the identity )"""
+    user_name = (detail.get('requestParameters') or {}).get('userName')
+    if not user_name:
+        user_name = ((detail.get('responseElements') or {}).get('accessKey') or {}).get('userName')
+    if not user_name:
+        identity = detail.get('userIdentity') or {}
+        if identity.get('type') == 'IAMUser':
+            user_name = identity.get('userName')
+    return user_name
+
+def evaluate_user(scan, user_name, event_name):
+    """evaluate user like the scan and publish its request, returns the request ( None if user is excluded )"""
+    try:
+        user = scanner.enrich_user(scanner.UserEvaluation(user_name), scan)
+        if user is not None:
+            user = scanner.evaluate_user(user, scan)
+    except scanner.iam_client.exceptions.NoSuchEntityException:
+        common.log_exclusion(user_name, USER_DELETED_EXCLUSION, "User %s excluded, reason: user deleted", user_name)
+        return None
+    if user is None:
+        return None
+    request = user.request
+    if event_name in PASSWORD_EVENTS and request.login_profile and not request.force:
+        # the password of credential report is older than the password of event
+        request.login_profile = False
+        if not request.access_key_ids:
+            common.log_exclusion(user_name, PASSWORD_CHANGED_EXCLUSION,
+                                 "User %s excluded, reason: The console password is changed by the event", user_name)
+            return None
+    scanner.attach_user_context(request, user.email)
+    scanner.publish_request(scan, request)
+    return request
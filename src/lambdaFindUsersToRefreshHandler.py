@@ -2,47 +2,305 @@
 # -*- coding: utf-8 -*-
 
 import json
-import boto3
 import traceback
 import os
 import datetime
 import time 
+import hashlib
+from common import ALREADY_REQUESTED_EXCLUSION
+from common import AdaptiveRateLimiter
 from common import Common
+from common import EMAIL_NOT_VALIDATED_EXCLUSION
+from common import FAILED_SCAN_CATEGORY
+from common import NO_EMAIL_EXCLUSION
+from common import NOT_DUE_EXCLUSION
+from common import NOT_OBSOLETE_EXCLUSION
 from common import RefreshCredentialRequest
+from common import RequestPublisher
+from common import user_shard
+from credential_report import CredentialReportCache
+from pipeline import Marker
+from pipeline import PageEnd
+from pipeline import Pipeline
+from pipeline import ScanEnd
+from pipeline import parallel_map
+from request_tracker import DEFAULT_DEDUPLICATION_TTL
+from request_tracker import RequestTracker
+from rotation_policy import RotationPolicy
+from rotation_policy import evaluate
+from rotation_policy import load_policy_rules
+from rotation_rules import is_obsolete
+from rotation_rules import password_last_changed
+from state_store import DEFAULT_STATE_STORE
+from state_store import LocalFileStateStore
+from state_store import create_state_store
+
+DEFAULT_SCAN_CONCURRENCY = 4
+DEFAULT_SCAN_SHARDS = 1
+IAM_MAX_RATE = 20
+CHECKPOINT_KEY = 'scan-checkpoint'
+CREDENTIAL_REPORT_KEY = 'credential-report'
+# IAM generates a new credential report if the last one is older than 4 hours
+DEFAULT_CREDENTIAL_REPORT_MAX_AGE = 14400
+# maximum duration of the generation of credential report ( in seconds )
+CREDENTIAL_REPORT_TIMEOUT = 120
+CREDENTIAL_REPORT_MAX_DELAY = 16
+# a checkpoint older than one day is not resumed
+CHECKPOINT_MAX_AGE = 86400
+# time kept at the end of invocation to save the checkpoint ( in milliseconds )
+SCAN_TIME_MARGIN = 10000
+SCHEDULE_KEY = 'schedule'
+TAG_PREFIX = 'IamRotateCredentials:'
 
 common = Common()
-account_id = common.get_account_id()
-iam_client = boto3.client('iam')
-ses_client = boto3.client('ses')
-sqs_client = boto3.client('sqs')
+SCAN_CONCURRENCY = max(1, common.to_int(os.environ.get('AWS_SCAN_CONCURRENCY'), DEFAULT_SCAN_CONCURRENCY))
+SCAN_SHARDS = max(1, common.to_int(os.environ.get('AWS_SCAN_SHARDS'), DEFAULT_SCAN_SHARDS))
+DEDUPLICATION_TTL = common.to_int(os.environ.get('AWS_REQUEST_DEDUPLICATION_TTL'), DEFAULT_DEDUPLICATION_TTL)
+# the enrich and evaluate stages have their own threads
+client_config = {'max_pool_connections': max(10, 2 * SCAN_CONCURRENCY), 'retries': {'max_attempts': 10}}
+# the iam clients are rate limited by iam_rate_limiter only, the adaptive retry mode would limit them twice
+iam_client_config = dict(client_config, retries={'max_attempts': 10, 'mode': 'standard'})
+iam_rate_limiter = AdaptiveRateLimiter(IAM_MAX_RATE)
+iam_client = common.client('iam', config=iam_client_config, on_create=iam_rate_limiter.attach)
+# ( iam client, rate limiter ) by account, IAM limits the rate of calls by account
+account_iam_clients = {None: (iam_client, iam_rate_limiter)}
+ses_client = common.client('ses', config=client_config)
+sqs_client = common.client('sqs')
+lambda_client = common.client('lambda')
+credential_report_cache = CredentialReportCache(
+    common.to_int(os.environ.get('AWS_CREDENTIAL_REPORT_MAX_AGE'), DEFAULT_CREDENTIAL_REPORT_MAX_AGE))
+rotation_policy = RotationPolicy(os.environ.get('AWS_CLI_TIME_LIMIT'), os.environ.get('AWS_LOGIN_PROFILE_TIME_LIMIT'),
+                                 load_policy_rules(os.environ.get('AWS_ROTATION_POLICY_RULES')))
+
+EVALUATION_MODE_REPORT = 'report'
+EVALUATION_MODE_LIVE = 'live'
+
+class ScanContext(object):
+    """state shared by the users evaluations of one scan"""
+
+    def __init__(self, credential_report, publisher, evaluation_mode, schedule=None, shard=None, account_id=None,
+                 request_tracker=None):
+        self.credential_report = credential_report
+        self.publisher = publisher
+        # None if the requests are not deduplicated
+        self.request_tracker = request_tracker
+        self.evaluation_mode = evaluation_mode
+        self.schedule = schedule
+        # ( index, count ), None if all users are scanned
+        self.shard = shard
+        # target account, None for the account of deployment
+        self.account_id = account_id
+        # evaluation of all users of credential report, None if the users are evaluated one by one
+        self.policy = None
+
+    def is_in_shard(self, user_name):
+        return self.shard is None or user_shard(user_name, self.shard[1]) == self.shard[0]
+
+class UserSchedule(object):
+    """next due date of each user, with the fingerprint of the data used to compute it"""
+
+    def __init__(self, items=None):
+        # user name -> [ordinal of next due date ( 0: never ), fingerprint]
+        self._items = items or {}
+
+    def __len__(self):
+        return len(self._items)
 
-DEFAULT_LIMIT = 90
+    def is_due(self, user_name, fingerprint, today):
+        """test if user must be evaluated ( new user, changed data or due date passed )"""
+        item = self._items.get(user_name)
+        if not item or item[1] != fingerprint:
+            return True
+        return item[0] != 0 and item[0] <= today.toordinal()
+
+    def set(self, user_name, fingerprint, next_due_date):
+        self._items[user_name] = [next_due_date.toordinal() if next_due_date else 0, fingerprint]
+
+    def remove(self, user_name):
+        self._items.pop(user_name, None)
+
+    def prune(self, user_names):
+        """remove the deleted users"""
+        user_names = set(user_names)
+        self._items = {k: v for k, v in self._items.items() if k in user_names}
+
+    def to_json(self):
+        return self._items
 
 def main(event, context):
-    """entry point"""
+    """entry point, scan all users or the users of account and shard of event ( {"account": id, "shard": index, "shards": count} )"""
+    publisher = RequestPublisher(sqs_client, os.environ.get('AWS_SQS_REQUEST_URL'))
+    completed = False
+    account_id = None
+    shard = None
+    state_store = None
     try:
-        credential_report = get_credential_report()
-        find_refresh_credential_request(credential_report)
+        if not is_dispatched(event) and (SCAN_SHARDS > 1 or common.target_accounts):
+            dispatch_shards(context, SCAN_SHARDS, sorted(common.target_accounts))
+            return
+        shard = get_shard(event)
+        account_id = event.get('account') if is_dispatched(event) else None
+        bind_account(account_id)
+        state_store = create_state_store(os.environ.get('AWS_STATE_STORE'), common.client)
+        request_tracker = None
+        if DEDUPLICATION_TTL > 0:
+            request_tracker = RequestTracker(state_store, DEDUPLICATION_TTL)
+            publisher.on_sending = request_tracker.mark_in_flight
+            publisher.on_not_sent = request_tracker.clear_in_flight
+        checkpoint = load_checkpoint(state_store, state_key(CHECKPOINT_KEY, shard, account_id))
+        with common.metrics.timer('CredentialReportDuration'):
+            credential_report = get_credential_report(credential_report_stores(state_store),
+                                                      state_key(CREDENTIAL_REPORT_KEY, None, account_id), context)
+        common.load_user_tags(iam_client)
+        schedule = None
+        if is_incremental_scan():
+            schedule = UserSchedule(state_store.load(state_key(SCHEDULE_KEY, shard, account_id)))
+        scan = ScanContext(credential_report, publisher, get_evaluation_mode(), schedule, shard, account_id, request_tracker)
+        scan.policy = evaluate_policy(scan)
+        common.prefetch_identities(ses_client, common.tag_cache.find_values('IamRotateCredentials:Email', scan.is_in_shard))
+        try:
+            completed = find_refresh_credential_request(scan, state_store, checkpoint, context)
+        finally:
+            # the requests found before an error are sent
+            publisher.flush()
+            if schedule is not None:
+                if completed and common.tag_cache.loaded:
+                    schedule.prune(x for x in common.tag_cache.user_names() if scan.is_in_shard(x))
+                state_store.save(state_key(SCHEDULE_KEY, shard, account_id), schedule.to_json())
+        common.logger.info("%s credentials renewal requests sent", publisher.published)
+        if not completed:
+            common.logger.warning("Scan interrupted after %s users, it will be resumed by the next invocation", checkpoint['users'])
+        if iam_rate_limiter.throttled:
+            common.logger.warning("IAM calls throttled %s times ( rate: %.1f calls/s )", iam_rate_limiter.throttled, iam_rate_limiter.rate)
    
     except Exception as e:
         stack_trace = traceback.format_exc()
         common.logger.error(stack_trace)
-        common.send_message(
-            f"Fail to rotate AWS iam credential {account_id}, reason : {e}", verbosity='ERROR')
+        common.notify(FAILED_SCAN_CATEGORY,
+            f"Fail to rotate AWS iam credential {account_id or common.get_account_id(context)}, reason : {e}", verbosity='ERROR')
         raise
+    finally:
+        common.publish_notifications(state_store, state_key(common.notification_history_key(), shard, account_id))
+        common.metrics.increment('RequestsPublished', publisher.published)
+        common.log_summary(account=account_id, requests_published=publisher.published)
+        common.metrics.emit(context)
+
+def is_dispatched(event):
+    """test if the event is sent by dispatch_shards"""
+    return isinstance(event, dict) and 'shard' in event
+
+def get_shard(event):
+    """shard to scan from event, None if all users are scanned"""
+    if not is_dispatched(event):
+        return None
+    try:
+        index = int(event['shard'])
+        count = int(event['shards'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid shard event {event}")
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid shard {index} of {count}")
+    return (index, count) if count > 1 else None
 
-def publish_request(request):
-    sqs_client.send_message(
-            QueueUrl = os.environ.get('AWS_SQS_REQUEST_URL'),
-            MessageBody = json.dumps(request.__dict__)
-        )
-    common.logger.info(f"Sends a credentials renewal request for the user {request.user_name}")
+def dispatch_shards(context, shards, account_ids=()):
+    """invoke this lambda asynchronously for each shard of users of each account
 
-def find_obsolete_access_key_ids(user_name, marker=None):
+    The invocations run in parallel up to the reserved concurrency of lambda, the others are retried by AWS Lambda.
+    """
+    function_name = getattr(context, 'invoked_function_arn', None) or os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
+    accounts = [None] + list(account_ids)
+    for account_id in accounts:
+        for index in range(shards):
+            lambda_client.invoke(
+                FunctionName=function_name,
+                InvocationType='Event',
+                Payload=json.dumps({'account': account_id, 'shard': index, 'shards': shards}).encode('utf-8'))
+    common.metrics.increment('ShardsDispatched', shards * len(accounts))
+    common.logger.info("Scan dispatched to %s shards of %s accounts", shards, len(accounts))
+
+def bind_account(account_id):
+    """use the iam client of account in this invocation ( a lambda container runs one invocation at a time )"""
+    global iam_client, iam_rate_limiter
+    if account_id not in account_iam_clients:
+        rate_limiter = AdaptiveRateLimiter(IAM_MAX_RATE)
+        client = common.account_client(account_id, 'iam', config=iam_client_config, on_create=rate_limiter.attach)
+        account_iam_clients[account_id] = (client, rate_limiter)
+    iam_client, iam_rate_limiter = account_iam_clients[account_id]
+
+def state_key(key, shard, account_id=None):
+    """key of state by account and shard ( kept when shard count changes, consistent hash moves few users between shards )"""
+    if account_id:
+        key = f'{account_id}/{key}'
+    return key if shard is None else f'{key}-{shard[0]}'
+
+def publish_request(scan, request):
+    """add request to batch, without the credentials already requested ( in flight or done )"""
+    if scan.request_tracker is not None:
+        if not scan.request_tracker.deduplicate(request, due_window(request, scan.credential_report)):
+            common.log_exclusion(request.user_name, ALREADY_REQUESTED_EXCLUSION,
+                                 "Credentials renewal request for the user %s not sent, reason: credentials already requested", request.user_name)
+            common.metrics.increment('RequestsDeduplicated')
+            return
+    scan.publisher.publish(request)
+    common.logger.debug("Credentials renewal request for the user %s added to batch", request.user_name)
+
+def due_window(request, credential_report):
+    """last change of the console password of user ( the access keys are identified by their ids )"""
+    credential_report_info = credential_report.get(request.user_name)
+    if not credential_report_info or not credential_report_info.password_enabled:
+        return None
+    last_changed = password_last_changed(credential_report_info)
+    return last_changed.isoformat() if last_changed else None
+
+def attach_user_context(request, email):
+    """add the user data resolved by the scan to request, they are not resolved again by the update handler
+
+    The login profile is not sent, the credential report can be older than the request context ttl : the update
+    handler resolves it for a forced refresh.
+    """
+    signing_key = os.environ.get('AWS_REQUEST_SIGNING_KEY')
+    if not signing_key:
+        return
+    password_reset_required = common.is_password_reset_required(iam_client, request.user_name)
+    request.attach_user_context(signing_key, email, password_reset_required, None)
+
+def get_evaluation_mode():
+    """evaluation mode of obsolescence ( report: from credential report, live: from IAM calls for each user )"""
+    mode = os.environ.get('AWS_EVALUATION_MODE', EVALUATION_MODE_REPORT).lower().strip()
+    if mode not in [EVALUATION_MODE_REPORT, EVALUATION_MODE_LIVE]:
+        common.logger.warning("Unknown evaluation mode %s, use %s", mode, EVALUATION_MODE_REPORT)
+        return EVALUATION_MODE_REPORT
+    return mode
+
+def evaluate_policy(scan):
+    """evaluate the rotation policy of all users of credential report at once ( report mode, tags of all users loaded )"""
+    if scan.evaluation_mode != EVALUATION_MODE_REPORT or not common.tag_cache.loaded:
+        return None
+    with common.metrics.timer('PolicyEvaluationDuration'):
+        table = rotation_policy.compile(scan.credential_report.columns().user_names, common.tag_cache.all_tags(),
+                                        common.tag_cache.all_placements())
+        policy = evaluate(table, scan.credential_report)
+    common.logger.info("%s of %s users of credential report to refresh", len(policy.due_users()), len(table))
+    return policy
+
+def get_time_limits(user_name):
+    """( cli time limit, login profile time limit ) of user"""
+    tags = common.tag_cache.get(iam_client, user_name)
+    if not rotation_policy.has_rules:
+        return rotation_policy.limits(tags)
+    path, groups = common.tag_cache.placement(iam_client, user_name)
+    return rotation_policy.limits(tags, path, groups)
+
+def get_cli_time_limit(user_name):
+    return get_time_limits(user_name)[0]
+
+def get_login_profile_time_limit(user_name):
+    return get_time_limits(user_name)[1]
+
+def find_obsolete_access_key_ids(user_name, cli_time_limit=None, marker=None):
     """find all active and obsolete access_key of user if exists """
-    cli_time_limit = common.find_user_tag(iam_client, user_name, 'IamRotateCredentials:CliTimeLimit')
-    if not cli_time_limit:
-        cli_time_limit = os.environ.get('AWS_CLI_TIME_LIMIT')
+    if cli_time_limit is None:
+        cli_time_limit = get_cli_time_limit(user_name)
     result = []
     try:
         response = None
@@ -52,94 +310,285 @@ def find_obsolete_access_key_ids(user_name, marker=None):
             response = iam_client.list_access_keys(UserName=user_name, Marker=marker)
         if 'AccessKeyMetadata' in response:
             for item in filter(lambda x: x['Status'] == 'Active', response['AccessKeyMetadata']):
-                if is_obsolete(item["CreateDate"], common.to_int(cli_time_limit, 90)):
+                if is_obsolete(item["CreateDate"], cli_time_limit):
                     result.append(item['AccessKeyId'])
         if 'IsTruncated' in response and bool(response['IsTruncated']):
-            result += find_access_keys(request,
-                                   marker=response['Marker'])
+            result += find_obsolete_access_key_ids(user_name, cli_time_limit=cli_time_limit,
+                                                   marker=response['Marker'])
         return result
     except iam_client.exceptions.NoSuchEntityException:
         return result
 
 def is_obsolete_login_profile(user_name, credential_report):
     """find login profile if exist and if login profile is obsolete"""
-    login_profile_time_limit = common.find_user_tag(iam_client, user_name, 'IamRotateCredentials:LoginProfileTimeLimit')
-    if not login_profile_time_limit:
-        login_profile_time_limit = os.environ.get('AWS_LOGIN_PROFILE_TIME_LIMIT')
+    login_profile_time_limit = get_login_profile_time_limit(user_name)
     try:
         response = iam_client.get_login_profile(UserName=user_name)
         if 'LoginProfile' in response:
-            credential_report_info = next((item for item in credential_report if item['user'] == user_name), None)
+            credential_report_info = credential_report.get(user_name)
             if credential_report_info:
-                password_last_changed = credential_report_info["password_last_changed"].split('T')[0]
-                password_last_changed = datetime.datetime.strptime(password_last_changed, "%Y-%m-%d")
-                return is_obsolete(password_last_changed, common.to_int(login_profile_time_limit, DEFAULT_LIMIT))
+                last_changed = password_last_changed(credential_report_info)
+                if not last_changed:
+                    return False
+                return is_obsolete(last_changed, login_profile_time_limit)
             return False
         return None
     except iam_client.exceptions.NoSuchEntityException:
         return False
 
-def is_obsolete(date, delta):
-    limit_date = (date + datetime.timedelta(days=delta)).date()
-    return datetime.date.today() > limit_date
+def user_policy(user_name, scan):
+    """evaluation of the rotation policy of user : the evaluation of scan, else an evaluation of user alone"""
+    if scan.policy is not None and user_name in scan.policy.table.index:
+        return scan.policy
+    tags = {user_name: common.tag_cache.get(iam_client, user_name)}
+    placements = {}
+    if rotation_policy.has_rules:
+        placements[user_name] = common.tag_cache.placement(iam_client, user_name)
+    return evaluate(rotation_policy.compile([user_name], tags, placements), scan.credential_report)
+
+def find_obsolete_credentials_from_report(user_name, policy):
+    """find obsolete login profile and access keys of user from the evaluation of credential report
 
-def find_refresh_credential_request(credential_report, marker=None):
-    """find all iam users of account"""
-    response = None
+    IAM is only called to resolve the access key ids of an user with an obsolete access key.
+    """
+    refresh_login_profile, obsolete_access_keys = policy.obsolete(user_name)
+    refresh_access_keys = []
+    if obsolete_access_keys:
+        refresh_access_keys = find_obsolete_access_key_ids(user_name, cli_time_limit=policy.table.limits(user_name)[0])
+    return refresh_login_profile, refresh_access_keys
+
+def find_obsolete_credentials(user_name, scan):
+    """find obsolete login profile and access keys of user"""
+    if scan.evaluation_mode == EVALUATION_MODE_REPORT:
+        if user_name in scan.credential_report:
+            return find_obsolete_credentials_from_report(user_name, user_policy(user_name, scan))
+        # user created after the generation of credential report
+        common.logger.info("User %s not found in credential report, use live evaluation", user_name)
+    refresh_login_profile = is_obsolete_login_profile(user_name, scan.credential_report)
+    refresh_access_keys = find_obsolete_access_key_ids(user_name)
+    return refresh_login_profile, refresh_access_keys
+
+def load_checkpoint(state_store, key=CHECKPOINT_KEY):
+    """load the checkpoint of the last interrupted scan"""
+    checkpoint = state_store.load(key)
+    if checkpoint:
+        if time.time() - checkpoint['updated'] < CHECKPOINT_MAX_AGE:
+            common.logger.info("Resume scan after %s users", checkpoint['users'])
+            return checkpoint
+        common.logger.warning("Checkpoint of the last scan expired, restart scan from the first user")
+    return {'marker': None, 'users': 0, 'started': time.time(), 'updated': time.time()}
+
+def has_remaining_time(context, page_duration):
+    """test if there is time to process one more page of users"""
+    if not context:
+        return True
+    return context.get_remaining_time_in_millis() > SCAN_TIME_MARGIN + 2 * page_duration * 1000
+
+class UserEvaluation(object):
+    """user going through the stages of scan"""
+
+    __slots__ = ('user_name', 'fingerprint', 'email', 'force', 'request')
+
+    def __init__(self, user_name):
+        self.user_name = user_name
+        self.fingerprint = None
+        self.email = None
+        self.force = False
+        self.request = None
+
+def find_refresh_credential_request(scan, state_store, checkpoint, context=None):
+    """find all iam users of account, returns False if the scan is interrupted before the last user
+
+    list users -> due users -> enrich ( email, force refresh ) -> evaluate ( obsolete credentials ) -> publish
+    """
+    pipeline = Pipeline('ListUsers', list_users_stage(scan, checkpoint, context)) \
+        .then('DueUsers', due_users_stage, scan) \
+        .then('EnrichUsers', enrich_users_stage, scan) \
+        .then('EvaluateUsers', evaluate_users_stage, scan)
+    try:
+        return pipeline.run('Publish', publish_stage, scan, state_store, checkpoint)
+    finally:
+        for name, duration in pipeline.durations().items():
+            common.metrics.add_duration(f'{name}StageDuration', duration)
+
+def list_users_stage(scan, checkpoint, context=None):
+    """user names of shard from the marker of checkpoint, page by page, until the end or the lambda timeout is near"""
+    # the checkpoint is updated by the publish stage, once the users of page are published
+    marker = checkpoint['marker']
+    page_duration = 0
+    while True:
+        if not has_remaining_time(context, page_duration):
+            return
+        start = time.time()
+        response = list_users(checkpoint, marker)
+        user_names = []
+        if 'Users' in response:
+            user_names = [item['UserName'] for item in response['Users'] if scan.is_in_shard(item['UserName'])]
+            for user_name in user_names:
+                yield user_name
+        if not ('IsTruncated' in response and bool(response['IsTruncated'])):
+            yield PageEnd(None, len(user_names))
+            yield ScanEnd()
+            return
+        marker = response['Marker']
+        yield PageEnd(marker, len(user_names))
+        page_duration = max(page_duration, time.time() - start)
+
+def due_users_stage(user_names, scan):
+    """users to evaluate ( all users if the scan is not incremental )"""
+    today = datetime.date.today()
+    for user_name in user_names:
+        if isinstance(user_name, Marker):
+            yield user_name
+            continue
+        common.metrics.increment('UsersScanned')
+        user = UserEvaluation(user_name)
+        if scan.schedule is not None:
+            user.fingerprint = user_fingerprint(user_name, scan)
+            if not scan.schedule.is_due(user_name, user.fingerprint, today):
+                common.log_exclusion(user_name, NOT_DUE_EXCLUSION, "User %s excluded, reason: The credentials are not due", user_name)
+                continue
+            scan.schedule.remove(user_name)
+        common.metrics.increment('UsersDue')
+        yield user
+
+def enrich_users_stage(users, scan):
+    """users with a valid email, with their force refresh tag ( AWS_SCAN_CONCURRENCY threads )"""
+    return parallel_map(lambda x: enrich_user(x, scan), users, SCAN_CONCURRENCY)
+
+def enrich_user(user, scan):
+    user_name = user.user_name
+    common.logger.debug("Process request for user %s ...", user_name)
+    user.email = common.find_user_tag(iam_client, user_name, 'IamRotateCredentials:Email')
+    if not user.email:
+        common.log_exclusion(user_name, NO_EMAIL_EXCLUSION, "User %s excluded, reason: 'IamRotateCredentials:Email' tag not exist for user", user_name)
+        # evaluated again when the tags of user change
+        schedule_user(scan, user_name, user.fingerprint, None)
+        return None
+    if not common.is_valid_email(ses_client, user_name, user.email):
+        common.log_exclusion(user_name, EMAIL_NOT_VALIDATED_EXCLUSION, "User %s excluded, reason: email %s not validated", user_name, user.email)
+        # the email can be registered in AWS SES later
+        schedule_user(scan, user_name, user.fingerprint, datetime.date.today() + datetime.timedelta(days=1))
+        return None
+    forceRefresh = common.consume_user_tag(iam_client,user_name,"IamRotateCredentials:ForceRefresh")
+    common.logger.debug("IamRotateCredentials:ForceRefresh : %s", forceRefresh)
+    user.force = bool(forceRefresh)
+    return user
+
+def evaluate_users_stage(users, scan):
+    """users with a refresh credential request ( AWS_SCAN_CONCURRENCY threads )"""
+    return parallel_map(lambda x: evaluate_user(x, scan), users, SCAN_CONCURRENCY)
+
+def evaluate_user(user, scan):
+    user_name = user.user_name
+    if user.force:
+        user.request = RefreshCredentialRequest(user_name = user_name, force = True, account_id = scan.account_id)
+        common.logger.info("User %s force to refresh , reason: IamRotateCredentials:ForceRefresh tag found", user_name)
+        return user
+    refresh_login_profile, refresh_access_keys = find_obsolete_credentials(user_name, scan)
+    if not refresh_login_profile and not refresh_access_keys:
+        common.log_exclusion(user_name, NOT_OBSOLETE_EXCLUSION, "User %s excluded, reason: The credentials are not obsolete", user_name)
+        schedule_user(scan, user_name, user.fingerprint, find_next_due_date(user_name, scan))
+        return None
+    user.request = RefreshCredentialRequest(
+        user_name = user_name,
+        login_profile = refresh_login_profile,
+        access_key_ids = refresh_access_keys,
+        force = False,
+        account_id = scan.account_id
+    )
+    return user
+
+def publish_stage(users, scan, state_store, checkpoint):
+    """publish the requests and save the checkpoint after each page, returns False if the scan is interrupted"""
+    for user in users:
+        if isinstance(user, PageEnd):
+            checkpoint['users'] += user.users
+            if user.marker:
+                # the requests are sent before the checkpoint is saved
+                scan.publisher.flush()
+                checkpoint['marker'] = user.marker
+                checkpoint['updated'] = time.time()
+                state_store.save(state_key(CHECKPOINT_KEY, scan.shard, scan.account_id), checkpoint)
+        elif isinstance(user, ScanEnd):
+            state_store.delete(state_key(CHECKPOINT_KEY, scan.shard, scan.account_id))
+            common.logger.info("Scan completed, %s users processed", checkpoint['users'])
+            return True
+        else:
+            attach_user_context(user.request, user.email)
+            publish_request(scan, user.request)
+    return False
+
+def list_users(checkpoint, marker=None):
+    """list one page of users from marker, the checkpoint is reset if its marker is no longer valid"""
     if not marker:
-        response = iam_client.list_users()
+        return iam_client.list_users()
+    try:
+        return iam_client.list_users(Marker=marker)
+    except iam_client.exceptions.ClientError as e:
+        common.logger.warning("Unable to resume scan, restart from the first user, reason: %s", e)
+        checkpoint['marker'] = None
+        checkpoint['users'] = 0
+        return iam_client.list_users()
+
+def is_incremental_scan():
+    """only the users past due or with changed tags or credentials are evaluated"""
+    return os.environ.get('AWS_INCREMENTAL_SCAN', 'true').lower().strip() in ['true', '1']
+
+def schedule_user(scan, user_name, fingerprint, next_due_date):
+    if scan.schedule is not None:
+        scan.schedule.set(user_name, fingerprint, next_due_date)
+
+def user_fingerprint(user_name, scan):
+    """fingerprint of the data used to evaluate user ( rotation tags, credential report row and time limits )"""
+    tags = common.tag_cache.get(iam_client, user_name)
+    data = [sorted((k, v) for k, v in tags.items() if k.startswith(TAG_PREFIX))]
+    credential_report_info = scan.credential_report.get(user_name)
+    if credential_report_info:
+        data.append([str(getattr(credential_report_info, x)) for x in credential_report_info.__slots__])
+    # the time limits of the tags, IAM path, groups and defaults of user
+    if scan.policy is not None and user_name in scan.policy.table.index:
+        data.append(list(scan.policy.table.limits(user_name)))
     else:
-        response = iam_client.list_users(Marker=marker)
-    if 'Users' in response:
-        for item in response['Users']:
-            user_name = item['UserName']
-            common.logger.info(f"Process request for user {user_name} ...")
-            email = common.find_user_tag(iam_client, user_name, 'IamRotateCredentials:Email')
-            if email:
-                if common.is_valid_email(ses_client, user_name, email):
-                    request = None
-                    forceRefresh = common.consume_user_tag(iam_client,user_name,"IamRotateCredentials:ForceRefresh")
-                    common.logger.info(f"IamRotateCredentials:ForceRefresh : {forceRefresh}")
-                    if forceRefresh:
-                        if bool(forceRefresh):
-                            request = RefreshCredentialRequest(user_name = user_name, force = True)
-                            common.logger.info(f"User {user_name} force to refresh , reason: IamRotateCredentials:ForceRefresh tag found")
-                    else:    
-                        refresh_login_profile = is_obsolete_login_profile(user_name, credential_report)
-                        refresh_access_keys = find_obsolete_access_key_ids(user_name)
-                        if refresh_login_profile or len(refresh_access_keys)>0:
-                            request = RefreshCredentialRequest(
-                                user_name = user_name,
-                                login_profile = refresh_login_profile,
-                                access_key_ids = refresh_access_keys,
-                                force = False
-                            )
-                            
-                        else:
-                            common.logger.info(f"User {user_name} excluded, reason: The credentials are not obsolete")
-                    if request:
-                        publish_request(request)
-                
-            else:
-                common.logger.info(f"User {user_name} excluded, reason: 'IamRotateCredentials:Email' tag not exist for user")
-    if 'IsTruncated' in response and bool(response['IsTruncated']):
-        find_refresh_credential_request(iam_client, marker=response['Marker'])
-
-def get_credential_report():
-    response = iam_client.generate_credential_report()
-    if response['State'] == 'COMPLETE' :
-        credential_report = []
-        response = iam_client.get_credential_report()
-        report = response["Content"]
-        lines = report.splitlines()
-        keys = lines[0].decode("utf-8").split(',')
-        for i in range(1, len(lines)):
-            item = {}
-            data = lines[i].decode("utf-8").split(',')
-            for j in range(0, len(keys)):
-                item[keys[j]]= data[j]
-                credential_report.append(item)
+        data.append(list(get_time_limits(user_name)))
+    return hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()[:16]
+
+def find_next_due_date(user_name, scan):
+    """find the first day where a credential of user will be obsolete ( None if user has no credential, or no due credential in IAM )"""
+    if user_name not in scan.credential_report:
+        # user created after the generation of credential report
+        return datetime.date.today()
+    next_due_date = user_policy(user_name, scan).next_due_date(user_name)
+    if next_due_date is not None and next_due_date <= datetime.date.today():
+        # the credentials are renewed after the generation of credential report, the user is evaluated again
+        # when its row of credential report changes ( fingerprint ), not at each scan with the same report
+        return None
+    return next_due_date
+
+def credential_report_stores(state_store):
+    """stores of credential report cache : /tmp ( kept by warm lambda ), then the state store if AWS_CREDENTIAL_REPORT_SHARED_CACHE"""
+    if isinstance(state_store, LocalFileStateStore):
+        return [state_store]
+    stores = [create_state_store(DEFAULT_STATE_STORE)]
+    if os.environ.get('AWS_CREDENTIAL_REPORT_SHARED_CACHE', 'false').lower().strip() in ['true', '1']:
+        stores.append(state_store)
+    return stores
+
+def get_credential_report(stores=(), key=CREDENTIAL_REPORT_KEY, context=None):
+    """credential report from cache, else generated ( wait with exponential backoff until complete or deadline )"""
+    credential_report = credential_report_cache.get(key, stores)
+    if credential_report is not None:
+        common.logger.info("Use credential report generated at %s", credential_report.generated_time)
+        common.metrics.increment('CredentialReportCacheHits')
         return credential_report
-    else:
-        time.sleep(2)
-        return get_credential_report()
+    deadline = time.time() + CREDENTIAL_REPORT_TIMEOUT
+    if context:
+        deadline = min(deadline, time.time() + (context.get_remaining_time_in_millis() - SCAN_TIME_MARGIN) / 1000.0)
+    delay = 1
+    while iam_client.generate_credential_report()['State'] != 'COMPLETE':
+        if time.time() + delay > deadline:
+            raise TimeoutError("Credential report not generated before the deadline, it will be used by the next invocation")
+        time.sleep(delay)
+        delay = min(delay * 2, CREDENTIAL_REPORT_MAX_DELAY)
+    response = iam_client.get_credential_report()
+    return credential_report_cache.put(key, response['Content'], response.get('GeneratedTime'), stores)
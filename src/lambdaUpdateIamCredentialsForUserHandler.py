@@ -2,67 +2,185 @@
 # -*- coding: utf-8 -*-
 
 import json
-import boto3
 import os
 import traceback
-import random
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from password_generator import PasswordGenerator
+from common import ALREADY_PROCESSED_EXCLUSION
 from common import Common
+from common import FAILED_ROTATION_CATEGORY
+from common import NOT_SENT_CATEGORY
+from common import ROTATION_SESSION_NAME
 from common import RefreshCredentialRequest
+from notification import EmailTemplates
+from notification import SesSender
+from request_tracker import DEFAULT_DEDUPLICATION_TTL
+from request_tracker import RequestTracker
+from state_store import create_state_store
+
+DEFAULT_RECORD_CONCURRENCY = 5
+DEFAULT_REQUEST_CONTEXT_TTL = 3600
 
 common = Common()
-account_id = common.get_account_id()
-iam_client = boto3.client('iam')
-ses_client = boto3.client('ses')
-iam_resource = boto3.resource('iam')
+common.session_pool.session_name = ROTATION_SESSION_NAME
+RECORD_CONCURRENCY = common.to_int(os.environ.get('AWS_RECORD_CONCURRENCY'), DEFAULT_RECORD_CONCURRENCY)
+REQUEST_CONTEXT_TTL = common.to_int(os.environ.get('AWS_REQUEST_CONTEXT_TTL'), DEFAULT_REQUEST_CONTEXT_TTL)
+DEDUPLICATION_TTL = common.to_int(os.environ.get('AWS_REQUEST_DEDUPLICATION_TTL'), DEFAULT_DEDUPLICATION_TTL)
+client_config = {'max_pool_connections': max(10, RECORD_CONCURRENCY)}
+iam_client = common.client('iam', config=client_config)
+ses_client = common.client('ses', config=client_config)
+ses_sender = SesSender(ses_client)
+state_store = create_state_store(os.environ.get('AWS_STATE_STORE'), common.client)
+request_tracker = RequestTracker(state_store, DEDUPLICATION_TTL) if DEDUPLICATION_TTL > 0 else None
+email_templates = None
 
 def create_password():
+    from password_generator import PasswordGenerator
     pwo = PasswordGenerator()
     return pwo.shuffle_password('0123456789azertyuiopqsdfghjklmwxcvbnAZERTYUIOPQSDFGHJKLMWXCVBN!@#$%^&*()_+-=[]{}|\'', 16)
  
 def main(event, context):
-    """entry point"""
+    """entry point, returns the records in failure ( only these messages are retried )"""
+    records = event.get('Records', [])
+    batch_item_failures = []
+    # records of the credentials refreshed whose email is not sent
+    not_sent_records = []
     try:
-        if 'Records' in event:
-            for record in event['Records']:
-                request = extract_request_from_record(record)
-                common.logger.info(f"Process request for user {request.user_name} ...")
-                email = common.find_user_tag(iam_client, request.user_name, 'IamRotateCredentials:Email')
-                required_reset_password = with_password_reset_required(user_name=request.user_name)
-                if email:
-                    if common.is_valid_email(ses_client, request.user_name, email):
-                        new_password_login_profile = None
-                        if request.login_profile or ( request.force and exist_login_profile(request.user_name)):
-                            new_password_login_profile = update_login_profile(request.user_name, required_reset_password)
-                        new_access_keys = []
-                        access_key_ids = request.access_key_ids
-                        if request.force:
-                            access_key_ids = find_all_access_key_ids(request.user_name)
-                        if access_key_ids:
-                            for access_key_id in access_key_ids:
-                                new_access_key = update_access_key(request.user_name, access_key_id)
-                                new_access_keys.append(new_access_key)
-                        send_email(request.user_name, email, required_reset_password, new_password_login_profile, new_access_keys)
-                    else:
-                        raise ValueError(f"Invalid mail for user {request.user_name} ")
-                else:
-                    raise ValueError(f"'IamRotateCredentials:Email' tag not exist for user {request.user_name}")
+        for user_records in group_records(records).values():
+            # tags may have changed since the last invocation, and they are cached by user name
+            # ( users of two accounts can have the same name )
+            common.tag_cache.clear()
+            with ThreadPoolExecutor(max_workers=max(1, RECORD_CONCURRENCY)) as executor:
+                futures = [executor.submit(process_user_records, x, context, not_sent_records) for x in user_records.values()]
+                for future in futures:
+                    batch_item_failures.extend({'itemIdentifier': x['messageId']} for x in future.result())
+        # the credentials are already replaced, the emails throttled by AWS SES are not retried by SQS
+        not_sent = ses_sender.flush(context)
+        # retried by SQS, the credentials are refreshed again ( see process_record )
+        batch_item_failures.extend({'itemIdentifier': x['messageId']} for x in not_sent_records)
+        if not_sent:
+            common.logger.error("Fail to send new credentials ( %s ), use IamRotateCredentials:ForceRefresh tag to generate new credentials", ', '.join(not_sent))
+            for description in not_sent:
+                common.notify(NOT_SENT_CATEGORY, f"New credentials not sent {description}", verbosity='ERROR')
+        common.metrics.increment('RequestsProcessed', len(records))
+        common.metrics.increment('RequestsFailed', len(batch_item_failures))
+        common.metrics.increment('EmailsNotSent', len(not_sent))
+        if batch_item_failures:
+            common.logger.warning("%s of %s requests failed", len(batch_item_failures), len(records))
+        return {'batchItemFailures': batch_item_failures}
+    finally:
+        common.publish_notifications(state_store)
+        common.log_summary(requests=len(records), requests_failed=len(batch_item_failures))
+        common.metrics.emit(context)
+
+def group_records(records):
+    """records by target account of request ( None for the account of deployment and the invalid records ), then by user name"""
+    result = OrderedDict()
+    for record in records:
+        try:
+            payload = json.loads(record['body'])
+            account_id, user_name = payload.get('account_id'), payload.get('user_name')
+        except (KeyError, TypeError, ValueError, AttributeError):
+            # the error is reported by process_record
+            account_id, user_name = None, None
+        result.setdefault(account_id, OrderedDict()).setdefault(user_name, []).append(record)
+    return result
+
+def process_user_records(records, context, not_sent_records=None):
+    """process the records of one user one by one ( they would rotate the same credentials ), returns the records in failure"""
+    failed = []
+    for record in records:
+        try:
+            process_record(record, context, not_sent_records)
+        except Exception:
+            # reported by process_record, the next records of user are processed
+            failed.append(record)
+    return failed
+
+def get_iam_client(account_id):
+    """iam client of target account, of the account of deployment if account_id is None"""
+    if account_id is None:
+        return iam_client
+    return common.account_client(account_id, 'iam', config=client_config)
+
+def process_record(record, context, not_sent_records=None):
+    """refresh the credentials of user of request
+
+    not_sent_records: the record is added if the email is not sent by the end of invocation ( with a request tracker )
+    """
+    account_id = None
+    try:
+        request = extract_request_from_record(record)
+        account_id = request.account_id
+        if request_tracker is not None and request_tracker.is_done(request):
+            # message received again, or same request sent again by the scan
+            common.log_exclusion(request.user_name, ALREADY_PROCESSED_EXCLUSION, "Request for user %s already processed", request.user_name)
+            common.metrics.increment('RequestsDeduplicated')
+            return
+        if request_tracker is not None and not request.force and request_tracker.is_not_sent(request):
+            # nobody knows the credentials refreshed by the previous attempt, all credentials are refreshed
+            common.logger.info("New credentials of user %s not sent by the previous attempt, refresh all credentials", request.user_name)
+            request.force = True
+        iam_client = get_iam_client(account_id)
+        common.log_user(request.user_name, 'request', "Process request for user %s ...", request.user_name)
+        user_context = request.trusted_user_context(os.environ.get('AWS_REQUEST_SIGNING_KEY'), REQUEST_CONTEXT_TTL)
+        if user_context:
+            # email, tags and login profile already resolved by the scanner
+            common.logger.debug("Use user context of request for user %s", request.user_name)
+            email = user_context['email']
+            required_reset_password = user_context['password_reset_required']
+            login_profile_exists = user_context['login_profile_exists']
+        else:
+            email = common.find_user_tag(iam_client, request.user_name, 'IamRotateCredentials:Email')
+            required_reset_password = common.is_password_reset_required(iam_client, request.user_name)
+            login_profile_exists = None
+        if email:
+            if user_context or common.is_valid_email(ses_client, request.user_name, email):
+                new_password_login_profile = None
+                if login_profile_exists is None and request.force:
+                    login_profile_exists = exist_login_profile(iam_client, request.user_name)
+                if request.login_profile or ( request.force and login_profile_exists):
+                    new_password_login_profile = update_login_profile(iam_client, request.user_name, required_reset_password)
+                new_access_keys = []
+                access_key_ids = request.access_key_ids
+                if request.force:
+                    access_key_ids = find_all_access_key_ids(iam_client, request.user_name)
+                if access_key_ids:
+                    for access_key_id in access_key_ids:
+                        new_access_key = update_access_key(iam_client, request.user_name, access_key_id)
+                        new_access_keys.append(new_access_key)
+                on_sent, on_not_sent = None, None
+                if request_tracker is not None:
+                    on_sent = lambda: request_tracker.mark_done(request)
+                    on_not_sent = lambda: mark_not_sent(record, request, not_sent_records)
+                send_email(account_id or common.get_account_id(context), request.user_name, email, required_reset_password,
+                           new_password_login_profile, new_access_keys, on_sent, on_not_sent)
+            else:
+                raise ValueError(f"Invalid mail for user {request.user_name} ")
+        else:
+            raise ValueError(f"'IamRotateCredentials:Email' tag not exist for user {request.user_name}")
     except Exception as e:
         common.logger.error(e)
         stack_trace = traceback.format_exc()
         common.logger.error(stack_trace)
-        common.send_message(
-            f"Fail to rotate AWS iam credential {account_id}, reason : {e}")
+        common.notify(FAILED_ROTATION_CATEGORY,
+            f"Fail to rotate AWS iam credential {account_id or common.get_account_id(context)}, reason : {e}", verbosity='ERROR')
         raise
 
+def mark_not_sent(record, request, not_sent_records):
+    """the request is not done, its record is retried"""
+    request_tracker.mark_not_sent(request)
+    if not_sent_records is not None:
+        not_sent_records.append(record)
+
 def extract_request_from_record(record):
     """extract refresh credential request from record"""
     payload = json.loads(record['body'])
     request = RefreshCredentialRequest(**payload)
     return request
 
-def exist_login_profile(user_name):
+def exist_login_profile(iam_client, user_name):
     try:
         response = iam_client.get_login_profile( UserName=user_name)
         return 'LoginProfile' in response
@@ -72,85 +190,59 @@ def exist_login_profile(user_name):
         raise
 
 
-def update_login_profile(user_name, required_reset_password):
+def update_login_profile(iam_client, user_name, required_reset_password):
     """update login profile password"""
     new_password = create_password()
-    login_profile = iam_resource.LoginProfile(user_name)
-    login_profile.update(Password=new_password,
-                         PasswordResetRequired=required_reset_password)
-    common.logger.info(f"New password generated for AWS console Access for user {user_name}")
+    # client is used instead of resource, resources are not thread safe
+    iam_client.update_login_profile(UserName=user_name, Password=new_password,
+                                    PasswordResetRequired=required_reset_password)
+    common.log_user(user_name, 'rotated', "New password generated for AWS console Access for user %s", user_name)
     return new_password
 
-def update_access_key(user_name, old_access_key):
+def update_access_key(iam_client, user_name, old_access_key):
     """remove and recreate access key """
     # delete obsolete access key
-    iam_client.delete_access_key(UserName=user_name, AccessKeyId=old_access_key)
+    try:
+        iam_client.delete_access_key(UserName=user_name, AccessKeyId=old_access_key)
+    except iam_client.exceptions.NoSuchEntityException:
+        # deleted by a previous attempt of request ( retried by SQS after a failure )
+        common.logger.info("Access key %s of user %s already deleted", old_access_key, user_name)
     response = iam_client.create_access_key(UserName=user_name)
     new_access_key = response['AccessKey']['AccessKeyId']
     new_secret_key = response['AccessKey']['SecretAccessKey']
-    common.logger.info(f'New Access/Secret Keys generated for AWS CLI for user {user_name} ( {old_access_key} -> {new_access_key})')
+    common.log_user(user_name, 'rotated', 'New Access/Secret Keys generated for AWS CLI for user %s ( %s -> %s)', user_name, old_access_key, new_access_key)
     result = {}
     result["Key"] = new_access_key
     result["Secret"] = new_secret_key
     return result   
 
 
-def send_email(user_name, email, required_reset_password, new_password_login_profile, new_access_keys):
-    """send email to user by AWS SES"""
-    # not no action update then return 
-    url = f'https://{account_id}.signin.aws.amazon.com/console'
+def get_email_templates():
+    """templates compiled once per lambda container"""
+    global email_templates
+    if not email_templates:
+        overrides = [x.strip() for x in os.environ.get('AWS_SES_TEMPLATES', '').split(',') if x.strip()]
+        email_templates = EmailTemplates.load(state_store if overrides else None, overrides)
+    return email_templates
+
+def send_email(account_id, user_name, email, required_reset_password, new_password_login_profile, new_access_keys,
+               on_sent=None, on_not_sent=None):
+    """send email to user by AWS SES ( on_sent and on_not_sent : see SesSender.send )"""
     account_info = ""
-    if 'AWS_ACCOUNT_NAME' in os.environ:
-        account_info += os.environ.get('AWS_ACCOUNT_NAME')
+    account_name = common.get_account_name(account_id)
+    if account_name is not None:
+        account_info += account_name
         account_info += ' - '
     account_info += account_id
+    subject, text, body = get_email_templates().render(
+        account_id, account_info, user_name, new_password_login_profile, required_reset_password,
+        new_access_keys, os.environ.get("CREDENTIALS_SENDED_BY"))
+    sent = ses_sender.send(os.environ.get('AWS_SES_EMAIL_FROM'), email, subject, text, body, f'to {email} for user {user_name}',
+                           on_sent, on_not_sent)
+    if sent:
+        common.log_user(user_name, 'sent', 'New credentials sended to %s for user %s.', email, user_name)
 
-    message = f"This email is sent automatically when your credentials become obsolete for account {account_info}.\n"
-    message += "\n"
-    if new_password_login_profile:
-        message += f'Your new Console Access:\n'
-        message += f'\tUrl : {url}\n'
-        message += f"\tLogin: {user_name}\n"
-        message += f"\tPassword: {new_password_login_profile}\n"
-        message += "\n"
-        if required_reset_password:
-            message += "For your Console Access, you will need to change your password at the next login.\n"
-            message += "\n"
-    if new_access_keys and len(new_access_keys)>0 : 
-        for key in new_access_keys:
-            message += 'Your new Command LIne Access:\n'
-            message += f'\tUser: {user_name}\n'
-            message += f'\tAccess Key: {key["Key"]}\n'
-            message += f'\tSecret Key: {key["Secret"]}\n'
-    message += "\n"
-    if 'CREDENTIALS_SENDED_BY' in os.environ:
-        credentials_sended_by = os.environ.get("CREDENTIALS_SENDED_BY")
-        message += f"by {credentials_sended_by}.\n"
-    ses_client.send_email(
-        Source = os.environ.get('AWS_SES_EMAIL_FROM'),
-        Destination = {'ToAddresses': [email]},
-        Message={
-            'Subject': {
-                'Data':
-                f'Update Amazon WebService credentials for {account_id} by IAMRotateCredentials'
-            },
-            'Body': {
-                'Text': {
-                    'Data': message
-                }
-            }
-        })
-    common.logger.info(f'New credentials sended to {email} for user {user_name}.')
-
-def with_password_reset_required(user_name):
-    with_reset_password = common.find_user_tag(iam_client, user_name, 'IamRotateCredentials:LoginProfilePasswordResetRequired')
-    if not with_reset_password:
-        with_reset_password = os.environ.get('AWS_LOGIN_PROFILE_PASSWORD_RESET_REQUIRED')
-    if not with_reset_password:
-        return True
-    return with_reset_password.lower().strip() in ['true', '1']
-
-def find_all_access_key_ids(user_name, marker=None):
+def find_all_access_key_ids(iam_client, user_name, marker=None):
     """find all active and obsolete access_key of user if exists """
     result = []
     response = None
@@ -163,5 +255,5 @@ def find_all_access_key_ids(user_name, marker=None):
             result.append(item['AccessKeyId'])
 
     if 'IsTruncated' in response and bool(response['IsTruncated']):
-        result += find_all_access_keys(request, marker=response['Marker'])
+        result += find_all_access_key_ids(iam_client, user_name, marker=response['Marker'])
     return result
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import math
+import time
+import threading
+import contextlib
+
+from common import THROTTLING_ERROR_CODES
+
+DEFAULT_NAMESPACE = 'IamRotateCredentials'
+# latencies are grouped in buckets of ~25% ( EMF accepts 100 distinct values by metric )
+LATENCY_BUCKETS_PER_DECADE = 10
+
+class OperationMetrics(object):
+    """metrics of one AWS operation"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+        self.retries = 0
+        self.latencies = {}
+
+    def add_latency(self, milliseconds):
+        value = latency_bucket(milliseconds)
+        self.latencies[value] = self.latencies.get(value, 0) + 1
+
+class Metrics(object):
+    """metrics of one invocation, emitted as CloudWatch embedded metric format log lines ( no AWS call )"""
+
+    def __init__(self, namespace=DEFAULT_NAMESPACE, stream=None):
+        # metrics are disabled without namespace
+        self.namespace = namespace
+        self.stream = stream
+        self._operations = {}
+        self._counters = {}
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        """record the calls of client ( count, latency, errors, throttles and retries by operation )"""
+        if not self.namespace:
+            return
+        events = client.meta.events
+        # first, a before-call handler may answer the call ( stubs )
+        events.register_first('before-call', self._before_call)
+        events.register('after-call', self._after_call)
+        events.register('after-call-error', self._after_call_error)
+        events.register('needs-retry', self._needs_retry)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """add the duration of block to metric name ( in milliseconds )"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_duration(name, (time.perf_counter() - start) * 1000)
+
+    def add_duration(self, name, milliseconds):
+        with self._lock:
+            self._durations[name] = self._durations.get(name, 0) + milliseconds
+
+    def emit(self, context=None):
+        """write the metrics of invocation on stdout ( one EMF document by line ) and reset them"""
+        with self._lock:
+            operations, self._operations = self._operations, {}
+            counters, self._counters = self._counters, {}
+            durations, self._durations = self._durations, {}
+        if not self.namespace:
+            return []
+        function_name = getattr(context, 'function_name', None) or 'unknown'
+        timestamp = int(time.time() * 1000)
+        documents = []
+        for (service_name, operation_name), x in sorted(operations.items()):
+            values = sorted(x.latencies)
+            document = self._document(timestamp, [['Function', 'Service', 'Operation'], ['Function', 'Service']], [
+                ('Calls', 'Count'), ('Errors', 'Count'), ('Throttles', 'Count'), ('Retries', 'Count'),
+                ('Latency', 'Milliseconds')])
+            document.update({
+                'Function': function_name,
+                'Service': service_name,
+                'Operation': operation_name,
+                'Calls': x.calls,
+                'Errors': x.errors,
+                'Throttles': x.throttles,
+                'Retries': x.retries
+            })
+            if values:
+                document['Latency'] = {'Values': values, 'Counts': [x.latencies[v] for v in values]}
+            else:
+                del document['_aws']['CloudWatchMetrics'][0]['Metrics'][-1]
+            documents.append(document)
+        if counters or durations:
+            document = self._document(timestamp, [['Function']],
+                                      [(k, 'Count') for k in sorted(counters)] + [(k, 'Milliseconds') for k in sorted(durations)])
+            document['Function'] = function_name
+            document.update(counters)
+            document.update(durations)
+            documents.append(document)
+        stream = self.stream or sys.stdout
+        for document in documents:
+            stream.write(json.dumps(document) + '\n')
+        stream.flush()
+        return documents
+
+    def _document(self, timestamp, dimensions, metrics):
+        return {
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': dimensions,
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, unit in metrics]
+                }]
+            }
+        }
+
+    def _operation(self, model):
+        key = (model.service_model.service_name, model.name)
+        operation = self._operations.get(key)
+        if operation is None:
+            operation = self._operations[key] = OperationMetrics()
+        return operation
+
+    def _before_call(self, model=None, context=None, **kwargs):
+        if context is not None:
+            context['metrics_start'] = time.perf_counter()
+            context['metrics_model'] = model
+
+    def _after_call(self, model, context=None, http_response=None, parsed=None, **kwargs):
+        retries = ((parsed or {}).get('ResponseMetadata') or {}).get('RetryAttempts', 0)
+        error = http_response is not None and http_response.status_code >= 300
+        self._record(model, context, error, retries)
+
+    def _after_call_error(self, context=None, **kwargs):
+        # the operation model is not sent with this event, it is kept by the before-call hook
+        model = (context or {}).get('metrics_model')
+        if model is not None:
+            self._record(model, context, True, 0)
+
+    def _record(self, model, context, error, retries):
+        start = (context or {}).get('metrics_start')
+        with self._lock:
+            operation = self._operation(model)
+            operation.calls += 1
+            operation.retries += retries
+            if error:
+                operation.errors += 1
+            if start is not None:
+                operation.add_latency((time.perf_counter() - start) * 1000)
+
+    def _needs_retry(self, response=None, operation=None, **kwargs):
+        if response is None or operation is None:
+            return None
+        if response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+            with self._lock:
+                self._operation(operation).throttles += 1
+        return None
+
+def latency_bucket(milliseconds):
+    """upper bound of the latency bucket"""
+    milliseconds = max(milliseconds, 0.01)
+    exponent = math.ceil(math.log10(milliseconds) * LATENCY_BUCKETS_PER_DECADE) / LATENCY_BUCKETS_PER_DECADE
+    return float(f'{10 ** exponent:.2g}')
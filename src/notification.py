@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import html
+import time
+import string
+import logging
+import threading
+
+from common import AdaptiveRateLimiter
+from common import THROTTLING_ERROR_CODES
+
+TEMPLATE_DIRECTORY = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'templates')
+
+TEMPLATE_NAMES = [
+    'subject.txt',
+    'body.txt',
+    'body.html',
+    'console_access.txt',
+    'console_access.html',
+    'password_reset.txt',
+    'password_reset.html',
+    'cli_access.txt',
+    'cli_access.html',
+    'signature.txt',
+    'signature.html'
+]
+
+class EmailTemplates(object):
+    """compiled templates of the email sent to users when their credentials are refreshed"""
+
+    def __init__(self, templates):
+        self._templates = {name: string.Template(content) for name, content in templates.items()}
+
+    @classmethod
+    def load(cls, state_store=None, overrides=()):
+        """load the default templates, the templates named in overrides are loaded from state store ( templates/<name> )"""
+        templates = {}
+        for name in TEMPLATE_NAMES:
+            with open(os.path.join(TEMPLATE_DIRECTORY, name)) as f:
+                templates[name] = f.read()
+        for name in overrides:
+            if name not in templates:
+                logging.getLogger().warning('Unknown email template %s', name)
+                continue
+            document = state_store.load(f'templates/{name}') if state_store else None
+            if document:
+                templates[name] = document['content']
+        return cls(templates)
+
+    def render(self, account_id, account_info, user_name, password, password_reset_required, access_keys, credentials_sended_by):
+        """render the subject, text body and html body of email"""
+        subject = self._templates['subject.txt'].safe_substitute(account_id=account_id, account_info=account_info)
+        text = self._render_body('txt', lambda x: x, account_id, account_info, user_name, password,
+                                 password_reset_required, access_keys, credentials_sended_by)
+        body = self._render_body('html', html.escape, account_id, account_info, user_name, password,
+                                 password_reset_required, access_keys, credentials_sended_by)
+        return subject, text, body
+
+    def _render_body(self, extension, escape, account_id, account_info, user_name, password, password_reset_required,
+                     access_keys, credentials_sended_by):
+        values = {
+            'account_id': escape(account_id),
+            'account_info': escape(account_info),
+            'user_name': escape(user_name),
+            'url': escape(f'https://{account_id}.signin.aws.amazon.com/console')
+        }
+        console_access = ''
+        if password:
+            password_reset = ''
+            if password_reset_required:
+                password_reset = self._templates[f'password_reset.{extension}'].safe_substitute(values)
+            console_access = self._templates[f'console_access.{extension}'].safe_substitute(
+                values, password=escape(password), password_reset=password_reset)
+        cli_access = ''.join(
+            self._templates[f'cli_access.{extension}'].safe_substitute(
+                values, access_key=escape(x['Key']), secret_key=escape(x['Secret']))
+            for x in access_keys or [])
+        signature = ''
+        if credentials_sended_by:
+            signature = self._templates[f'signature.{extension}'].safe_substitute(
+                values, credentials_sended_by=escape(credentials_sended_by))
+        return self._templates[f'body.{extension}'].safe_substitute(
+            values, console_access=console_access, cli_access=cli_access, signature=signature)
+
+class SesSender(object):
+    """send emails with AWS SES within the max send rate of account, throttled emails are queued for retry"""
+
+    def __init__(self, ses_client, max_send_rate=None):
+        self.ses_client = ses_client
+        self._max_send_rate = max_send_rate
+        self._rate_limiter = None
+        self._queue = []
+        self._lock = threading.Lock()
+
+    @property
+    def rate_limiter(self):
+        """rate limiter of the send rate of account, created once by the first sending thread"""
+        if not self._rate_limiter:
+            with self._lock:
+                if not self._rate_limiter:
+                    max_send_rate = self._max_send_rate
+                    if not max_send_rate:
+                        max_send_rate = self.ses_client.get_send_quota()['MaxSendRate']
+                    self._rate_limiter = AdaptiveRateLimiter(max_send_rate, min_rate=min(1.0, max_send_rate))
+        return self._rate_limiter
+
+    def send(self, source, email, subject, text, body, description, on_sent=None, on_not_sent=None):
+        """send email, returns False if email is queued because AWS SES throttled it
+
+        on_sent is called once the email is sent ( now or by flush ), on_not_sent if flush can not send it.
+        """
+        try:
+            self._send(source, email, subject, text, body)
+        except Exception as e:
+            if not is_throttling_error(e):
+                raise
+            logging.getLogger().warning('Email %s throttled by AWS SES, queued for retry', description)
+            with self._lock:
+                self._queue.append((source, email, subject, text, body, description, on_sent, on_not_sent))
+            return False
+        if on_sent:
+            on_sent()
+        return True
+
+    def flush(self, context=None, margin=10000, retry_delay=1.0):
+        """retry the queued emails while there is time left, returns the descriptions of emails not sent"""
+        with self._lock:
+            queue = self._queue
+            self._queue = []
+        failed = []
+        attempt = 0
+        while queue:
+            attempt += 1
+            time.sleep(min(retry_delay * 2 ** (attempt - 1), 30))
+            if context and context.get_remaining_time_in_millis() < margin:
+                break
+            remaining = []
+            for item in queue:
+                try:
+                    self._send(*item[:5])
+                except Exception as e:
+                    if not is_throttling_error(e):
+                        logging.getLogger().error('Fail to send email %s, reason: %s', item[5], e)
+                        failed.append(item)
+                        continue
+                    remaining.append(item)
+                    continue
+                if item[6]:
+                    item[6]()
+            queue = remaining
+        for item in failed + queue:
+            if item[7]:
+                item[7]()
+        return [x[5] for x in failed + queue]
+
+    def _send(self, source, email, subject, text, body):
+        self.rate_limiter.acquire()
+        try:
+            self.ses_client.send_email(
+                Source=source,
+                Destination={'ToAddresses': [email]},
+                Message={
+                    'Subject': {'Data': subject},
+                    'Body': {
+                        'Text': {'Data': text},
+                        'Html': {'Data': body}
+                    }
+                })
+        except Exception as e:
+            if is_throttling_error(e):
+                self.rate_limiter.on_throttle()
+            raise
+        self.rate_limiter.on_success()
+
+def is_throttling_error(e):
+    response = getattr(e, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Generator stages of the scan.
+
+A stage takes an iterable of items and yields items, the stages are pulled
+by the last one so an item is only produced when the next stage needs it.
+Markers ( end of page, end of scan ) go through the stages unchanged and in
+order, they let the last stage save the progress of the scan.
+"""
+
+import time
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+class Marker(object):
+    """item passed unchanged by the stages"""
+
+class PageEnd(Marker):
+    """all users of a page of list_users are before this marker"""
+
+    def __init__(self, marker, users):
+        # marker of the next page
+        self.marker = marker
+        self.users = users
+
+class ScanEnd(Marker):
+    """all users are listed"""
+
+def parallel_map(function, items, workers, max_pending=None):
+    """apply function to items in workers threads, the results ( None are dropped ) are yielded in the order of items
+
+    At most max_pending items are in progress, the upstream stage is not pulled until the oldest one is done.
+    """
+    if workers <= 1:
+        for item in items:
+            result = item if isinstance(item, Marker) else function(item)
+            if result is not None:
+                yield result
+        return
+    max_pending = max_pending or 2 * workers
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for item in items:
+            pending.append(item if isinstance(item, Marker) else executor.submit(function, item))
+            while len(pending) >= max_pending or (pending and _is_ready(pending[0])):
+                result = _result(pending.popleft())
+                if result is not None:
+                    yield result
+        while pending:
+            result = _result(pending.popleft())
+            if result is not None:
+                yield result
+
+def _is_ready(item):
+    return isinstance(item, Marker) or item.done()
+
+def _result(item):
+    return item if isinstance(item, Marker) else item.result()
+
+class Pipeline(object):
+    """stages chained from a source, with the number of items and the duration of each stage"""
+
+    def __init__(self, name, source):
+        # [name, items ( None for the sink ), duration including the upstream stages ( in seconds )]
+        self.stages = []
+        self._items = self._measure(self._add_stage(name), source)
+
+    def then(self, name, stage, *args):
+        """add stage, called with the items of the previous stage and args"""
+        self._items = self._measure(self._add_stage(name), stage(self._items, *args))
+        return self
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def run(self, name, sink, *args):
+        """pull all items with sink, called with the pipeline and args, returns the result of sink"""
+        start = time.perf_counter()
+        try:
+            return sink(self, *args)
+        finally:
+            self.stages.append([name, None, time.perf_counter() - start])
+
+    def durations(self):
+        """duration of each stage without its upstream stages ( in milliseconds )"""
+        result = collections.OrderedDict()
+        upstream = 0
+        for name, _, duration in self.stages:
+            result[name] = max(0, duration - upstream) * 1000
+            upstream = duration
+        return result
+
+    def _add_stage(self, name):
+        stage = [name, 0, 0]
+        self.stages.append(stage)
+        return stage
+
+    def _measure(self, stage, items):
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                stage[2] += time.perf_counter() - start
+                return
+            stage[2] += time.perf_counter() - start
+            if not isinstance(item, Marker):
+                stage[1] += 1
+            yield item
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import hashlib
+
+IN_FLIGHT = 'in-flight'
+DONE = 'done'
+# credentials refreshed, the email with the new credentials is not sent
+NOT_SENT = 'not-sent'
+DEFAULT_DEDUPLICATION_TTL = 86400
+
+def credential_key(request, credential, version=None):
+    """idempotency key of one credential of user of request ( console password by due window, access key by id )"""
+    data = [request.account_id, request.user_name, credential, version]
+    return hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+
+class RequestTracker(object):
+    """status of the credentials of refresh credential requests in the state store, shared by the scan and the update lambdas
+
+    A credential is in flight from the publication of its request ( marked before it is sent to SQS ) until the
+    request is processed by the update lambda, then done once the new credentials are sent ( not sent if AWS SES
+    did not send them, the request is retried ). The status expires after ttl seconds, the credential can be
+    requested again.
+    """
+
+    def __init__(self, state_store, ttl=DEFAULT_DEDUPLICATION_TTL, prefix='requests/'):
+        self.state_store = state_store
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def status(self, key, now=None):
+        """status of credential ( IN_FLIGHT, DONE ), None if unknown or expired"""
+        document = self.state_store.load(f'{self.prefix}{key}')
+        if not document or (now or time.time()) - document['updated'] >= self.ttl:
+            return None
+        return document['status']
+
+    def deduplicate(self, request, due_window=None):
+        """remove from request the credentials in flight or done and set its idempotency keys, returns False if no credential remains
+
+        The forced refresh requests are never deduplicated, they only record the console password they refresh.
+        """
+        if request.force:
+            request.idempotency_keys = [credential_key(request, 'login_profile', due_window)] if due_window else []
+            return True
+        keys = []
+        if request.login_profile:
+            key = credential_key(request, 'login_profile', due_window)
+            if self.status(key):
+                request.login_profile = False
+            else:
+                keys.append(key)
+        access_key_ids = []
+        for access_key_id in request.access_key_ids or []:
+            key = credential_key(request, 'access_key', access_key_id)
+            if not self.status(key):
+                access_key_ids.append(access_key_id)
+                keys.append(key)
+        request.access_key_ids = access_key_ids
+        request.idempotency_keys = keys
+        return bool(keys)
+
+    def is_done(self, request):
+        """test if all credentials of request are already refreshed ( never for a forced refresh )"""
+        keys = request.idempotency_keys or []
+        return not request.force and bool(keys) and all(self.status(x) == DONE for x in keys)
+
+    def is_not_sent(self, request):
+        """test if the credentials of request were refreshed without sending them"""
+        return any(self.status(x) == NOT_SENT for x in request.idempotency_keys or [])
+
+    def mark(self, request, status):
+        for key in request.idempotency_keys or []:
+            self.state_store.save(f'{self.prefix}{key}', {'status': status, 'user_name': request.user_name, 'updated': time.time()})
+
+    def mark_in_flight(self, request):
+        """mark the credentials of request in flight, before the request is sent ( the update lambda may mark them done first )"""
+        self.mark(request, IN_FLIGHT)
+
+    def clear_in_flight(self, request):
+        """remove the in flight status of the credentials of a request not sent, they can be requested again"""
+        for key in request.idempotency_keys or []:
+            if self.status(key) == IN_FLIGHT:
+                self.state_store.delete(f'{self.prefix}{key}')
+
+    def mark_done(self, request):
+        self.mark(request, DONE)
+
+    def mark_not_sent(self, request):
+        self.mark(request, NOT_SENT)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Offline rotation planner.
+
+Computes the credentials renewal requests that the scan would send, from a
+saved credential report and a snapshot of the tags of users, without any
+AWS call. Use it to measure a policy change before deploying it :
+
+  aws iam get-credential-report --query Content --output text | base64 -d > report.csv
+  aws iam get-account-authorization-details --filter User > tags.json
+  python src/rotation_planner.py report.csv tags.json --cli-time-limit 60
+
+The rules of IAM paths and groups ( rotation_policy_rules ) apply with
+--rules, the IAM paths and groups of users come from the output of
+get-account-authorization-details.
+
+The access keys are named by their column in credential report
+( access_key_1, access_key_2 ), the scan resolves their ids with IAM.
+"""
+
+import sys
+import json
+import operator
+import itertools
+import argparse
+import datetime
+import collections
+
+from common import EMAIL_REGEX
+from common import RefreshCredentialRequest
+from credential_report import CredentialReport
+from rotation_policy import RotationPolicy
+from rotation_policy import evaluate
+from rotation_policy import load_policy_rules
+from rotation_rules import EMAIL_TAG
+from rotation_rules import FORCE_REFRESH_TAG
+from rotation_rules import password_last_changed
+
+ROOT_ACCOUNT = '<root_account>'
+ACCESS_KEY_NAMES = {1: 'access_key_1', 2: 'access_key_2'}
+NO_EMAIL_REASONS = [f"'{EMAIL_TAG}' tag not exist for user"]
+FORCE_REFRESH_REASONS = [f'{FORCE_REFRESH_TAG} tag found']
+NOT_IN_REPORT_REASONS = ['not found in credential report, evaluated live by the scan']
+NOT_OBSOLETE_REASONS = ['the credentials are not obsolete']
+
+class PlannedUser(object):
+    """result of evaluation of one user
+
+    reasons: messages, or ( credential, date, time limit ) for the obsolete credentials.
+    """
+
+    __slots__ = ('user_name', 'decision', 'force', 'login_profile', 'access_key_ids', 'reasons')
+
+    def __init__(self, user_name, decision, reasons, force=False, login_profile=False, access_key_ids=None):
+        self.user_name = user_name
+        self.decision = decision
+        self.reasons = reasons
+        self.force = force
+        self.login_profile = login_profile
+        self.access_key_ids = access_key_ids
+
+    @property
+    def request(self):
+        """request sent by the scan, None if user is excluded ( built on demand, most plans only need counts )"""
+        if self.force:
+            return RefreshCredentialRequest(user_name=self.user_name, force=True)
+        if self.login_profile or self.access_key_ids:
+            return RefreshCredentialRequest(user_name=self.user_name, login_profile=self.login_profile,
+                                            access_key_ids=self.access_key_ids, force=False)
+        return None
+
+    def to_json(self):
+        request = self.request
+        return {
+            'user_name': self.user_name,
+            'decision': self.decision,
+            'request': request.__dict__ if request else None,
+            'reasons': [x if isinstance(x, str) else f'{x[0]} older than {x[2]} days ( {x[1]} )' for x in self.reasons]
+        }
+
+def load_tags(document):
+    """tags by user name from {"<user>": {"<key>": "<value>"}} or from output of get-account-authorization-details"""
+    if 'UserDetailList' in document:
+        return {x['UserName']: {t['Key']: t['Value'] for t in x.get('Tags', [])} for x in document['UserDetailList']}
+    return document
+
+def load_placements(document):
+    """( IAM path, group names ) by user name from output of get-account-authorization-details ( empty for a tags file )"""
+    if 'UserDetailList' in document:
+        return {x['UserName']: (x.get('Path'), tuple(x.get('GroupList', []))) for x in document['UserDetailList']}
+    return {}
+
+class Plan(object):
+    """decisions of all users of a plan, in the order of the users of evaluation
+
+    The PlannedUser of a user is built on demand ( iteration, details ), the counts come from the columns of evaluation.
+    """
+
+    def __init__(self, credential_report, evaluation, excluded):
+        self.credential_report = credential_report
+        self.evaluation = evaluation
+        # index of user -> PlannedUser of the users excluded by their email
+        self.excluded = excluded
+
+    def __len__(self):
+        return len(self.evaluation.table)
+
+    def __iter__(self):
+        return map(self.planned_user, range(len(self)))
+
+    def __getitem__(self, index):
+        return self.planned_user(index)
+
+    def planned_user(self, index):
+        """decision of the user of index"""
+        planned = self.excluded.get(index)
+        if planned is not None:
+            return planned
+        table = self.evaluation.table
+        user_name = table.user_names[index]
+        if table.force[index]:
+            return PlannedUser(user_name, 'force refresh', FORCE_REFRESH_REASONS, force=True)
+        if not self.evaluation.in_report[index]:
+            return PlannedUser(user_name, 'not in credential report', NOT_IN_REPORT_REASONS)
+        refresh_login_profile, access_keys = self.evaluation.obsolete(user_name)
+        if not refresh_login_profile and not access_keys:
+            return PlannedUser(user_name, 'excluded: not obsolete', NOT_OBSOLETE_REASONS)
+        credential_report_info = self.credential_report.get(user_name)
+        reasons = []
+        if refresh_login_profile:
+            reasons.append(('password', password_last_changed(credential_report_info), table.login_profile_time_limits[index]))
+        if 1 in access_keys:
+            reasons.append(('access_key_1', credential_report_info.access_key_1_last_rotated, table.cli_time_limits[index]))
+        if 2 in access_keys:
+            reasons.append(('access_key_2', credential_report_info.access_key_2_last_rotated, table.cli_time_limits[index]))
+        return PlannedUser(user_name, 'refresh', reasons, login_profile=refresh_login_profile,
+                           access_key_ids=[ACCESS_KEY_NAMES[x] for x in access_keys])
+
+    def _due(self, due_dates, evaluated):
+        # number of the evaluated users with a due date passed
+        today = itertools.repeat(self.evaluation.today.toordinal())
+        return sum(itertools.compress(map(operator.le, due_dates, today), evaluated))
+
+    def requests(self):
+        """number of credentials renewal requests"""
+        return self.summary_counts()[1]
+
+    def summary_counts(self):
+        """( number of users by decision, number of requests ), the refreshed users are counted by credential"""
+        evaluation = self.evaluation
+        force = evaluation.table.force
+        summary = collections.Counter(x.decision for x in self.excluded.values())
+        not_excluded = bytearray([1]) * len(self)
+        for index in self.excluded:
+            not_excluded[index] = 0
+        forced = sum(itertools.compress(force, not_excluded))
+        # not excluded and not forced
+        not_forced = bytearray(map(operator.gt, not_excluded, force))
+        not_in_report = sum(itertools.compress(map(operator.not_, evaluation.in_report), not_forced))
+        evaluated = bytearray(map(operator.and_, not_forced, evaluation.in_report))
+        refreshed = self._due(evaluation.next_due, evaluated)
+        access_keys = self._due(map(min, evaluation.access_key_1_due, evaluation.access_key_2_due), evaluated)
+        for decision, count in [('force refresh', forced), ('not in credential report', not_in_report),
+                                ('excluded: not obsolete', sum(evaluated) - refreshed),
+                                ('refresh: console password', self._due(evaluation.password_due, evaluated)),
+                                ('refresh: access keys', access_keys)]:
+            if count:
+                summary[decision] = count
+        return summary, forced + refreshed
+
+def plan(credential_report, tags, cli_time_limit=None, login_profile_time_limit=None, today=None,
+         verified_identities=None, rules=(), placements=None):
+    """evaluate all users of credential report and of tags like the scan ( report evaluation mode ), returns a Plan
+
+    verified_identities: emails and domains verified in AWS SES, None if all emails are considered verified.
+    """
+    today = today or datetime.date.today()
+    table = RotationPolicy(cli_time_limit, login_profile_time_limit, rules).compile(
+        _user_names(credential_report, tags), tags, placements)
+    evaluation = evaluate(table, credential_report, today)
+    # only the email is checked user by user
+    excluded = {}
+    emails = map(operator.methodcaller('get', EMAIL_TAG), map(tags.get, table.user_names, itertools.repeat({})))
+    match_email = EMAIL_REGEX.match
+    for index, email in enumerate(emails):
+        if not email:
+            excluded[index] = PlannedUser(table.user_names[index], 'excluded: no email tag', NO_EMAIL_REASONS)
+            continue
+        match = match_email(email)
+        if not match:
+            excluded[index] = PlannedUser(table.user_names[index], 'excluded: invalid email', [f'{email} is not a valid email'])
+        elif verified_identities is not None and email not in verified_identities \
+                and match.group(1) not in verified_identities:
+            excluded[index] = PlannedUser(table.user_names[index], 'excluded: email not verified',
+                                          [f'{email} is not verified in AWS SES'])
+    return Plan(credential_report, evaluation, excluded)
+
+def _user_names(credential_report, tags):
+    # users created after the generation of report are only in tags
+    for entry in credential_report:
+        if entry.user_name != ROOT_ACCOUNT:
+            yield entry.user_name
+    for user_name in tags:
+        if user_name not in credential_report:
+            yield user_name
+
+def summarize(planned):
+    """number of users by decision ( the refreshed users are counted by credential )"""
+    return planned.summary_counts()[0]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compute offline the credentials renewal requests sent by the scan')
+    parser.add_argument('credential_report', help='credential report ( csv file )')
+    parser.add_argument('tags', help='tags of users ( json file )')
+    parser.add_argument('--cli-time-limit', type=int, help='value of aws_cli_time_limit ( default 90 )')
+    parser.add_argument('--login-profile-time-limit', type=int, help='value of aws_login_profile_time_limit ( default 90 )')
+    parser.add_argument('--today', type=lambda x: datetime.datetime.strptime(x, '%Y-%m-%d').date(),
+                        help='date of evaluation ( YYYY-MM-DD, default today )')
+    parser.add_argument('--rules', help='rules of IAM paths and groups ( json file, value of rotation_policy_rules )')
+    parser.add_argument('--verified-identities', help='emails and domains verified in AWS SES, separated by comma')
+    parser.add_argument('--details', action='store_true', help='print the decision of each user ( json lines )')
+    args = parser.parse_args(argv)
+    with open(args.credential_report, 'rb') as f:
+        credential_report = CredentialReport.parse(f.read())
+    with open(args.tags) as f:
+        document = json.load(f)
+    tags = load_tags(document)
+    placements = load_placements(document)
+    rules = []
+    if args.rules:
+        with open(args.rules) as f:
+            rules = load_policy_rules(f.read())
+    verified_identities = None
+    if args.verified_identities:
+        verified_identities = set(x.strip() for x in args.verified_identities.split(',') if x.strip())
+    planned = plan(credential_report, tags, args.cli_time_limit, args.login_profile_time_limit, args.today,
+                   verified_identities, rules, placements)
+    if args.details:
+        for x in planned:
+            print(json.dumps(x.to_json()))
+    # the summary is written on stderr when the details are written on stdout
+    output = sys.stderr if args.details else sys.stdout
+    requests = planned.requests()
+    print(f'{requests} credentials renewal requests for {len(planned)} users', file=output)
+    for decision, count in sorted(summarize(planned).items()):
+        print(f'  {decision}: {count}', file=output)
+
+if __name__ == '__main__':
+    main()
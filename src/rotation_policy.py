@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Rotation policy of the users of an account.
+
+The time limits of each user come from, by priority :
+  1. the tags of user ( IamRotateCredentials:CliTimeLimit, IamRotateCredentials:LoginProfileTimeLimit ),
+  2. the rules of the groups of user ( the strictest rule when the user is in several groups ),
+  3. the rule of the longest IAM path prefix of user,
+  4. the global defaults ( AWS_CLI_TIME_LIMIT, AWS_LOGIN_PROFILE_TIME_LIMIT, else 90 days ).
+
+RotationPolicy.compile builds the table of time limits of all users, evaluate
+computes in one pass over the columns of the credential report the obsolete
+credentials and the next due date of every user. The dates are day ordinals
+in arrays, the columns are combined with map and the C operators, without
+python code by user.
+"""
+
+import json
+import array
+import operator
+import datetime
+import itertools
+
+from credential_report import NEVER
+from rotation_rules import CLI_TIME_LIMIT_TAG
+from rotation_rules import FORCE_REFRESH_TAG
+from rotation_rules import LOGIN_PROFILE_TIME_LIMIT_TAG
+from rotation_rules import time_limit
+
+class PolicyRule(object):
+    """time limits of the users of an IAM path prefix or of a group ( None if the limit is not set by rule )"""
+
+    __slots__ = ('path', 'group', 'cli_time_limit', 'login_profile_time_limit')
+
+    def __init__(self, path=None, group=None, cli_time_limit=None, login_profile_time_limit=None):
+        if bool(path) == bool(group):
+            raise ValueError("A rotation policy rule has either a path or a group")
+        self.path = path
+        self.group = group
+        self.cli_time_limit = _to_limit(cli_time_limit)
+        self.login_profile_time_limit = _to_limit(login_profile_time_limit)
+
+def _to_limit(value):
+    # terraform sends the values of rules as strings, empty if not set
+    if value is None or value == '':
+        return None
+    return int(value)
+
+def load_policy_rules(value):
+    """rules from json ( AWS_ROTATION_POLICY_RULES ) : [{"path": "/admin/", "cli_time_limit": 30}, {"group": "contractors", ...}]"""
+    if not value:
+        return []
+    return [PolicyRule(x.get('path'), x.get('group'), x.get('cli_time_limit'), x.get('login_profile_time_limit'))
+            for x in json.loads(value)]
+
+class ThresholdTable(object):
+    """time limits and force refresh flag of users, one array by column ( in the order of user_names )"""
+
+    def __init__(self, user_names, cli_time_limits, login_profile_time_limits, force):
+        self.user_names = user_names
+        self.index = {x: i for i, x in enumerate(user_names)}
+        self.cli_time_limits = cli_time_limits
+        self.login_profile_time_limits = login_profile_time_limits
+        self.force = force
+
+    def __len__(self):
+        return len(self.user_names)
+
+    def limits(self, user_name):
+        """( cli time limit, login profile time limit ) of user"""
+        i = self.index[user_name]
+        return self.cli_time_limits[i], self.login_profile_time_limits[i]
+
+class RotationPolicy(object):
+    """global defaults and path and group rules, compiled with the tags of users into a threshold table"""
+
+    def __init__(self, cli_time_limit=None, login_profile_time_limit=None, rules=()):
+        self.cli_time_limit = time_limit(None, cli_time_limit)
+        self.login_profile_time_limit = time_limit(None, login_profile_time_limit)
+        # longest path first, the first matching path rule applies
+        self.path_rules = sorted((x for x in rules if x.path), key=lambda x: -len(x.path))
+        self.group_rules = {}
+        for rule in rules:
+            if rule.group:
+                self.group_rules.setdefault(rule.group, []).append(rule)
+        self._cache = {}
+
+    def limits(self, tags, path=None, groups=()):
+        """( cli time limit, login profile time limit ) of an user from its tags, IAM path and group names"""
+        key = (tags.get(CLI_TIME_LIMIT_TAG), tags.get(LOGIN_PROFILE_TIME_LIMIT_TAG), path, groups and tuple(groups))
+        # many users share the same tags, path and groups
+        result = self._cache.get(key)
+        if result is None:
+            result = self._cache[key] = self._key_limits(key)
+        return result
+
+    def _key_limits(self, key):
+        cli_time_limit, login_profile_time_limit = self._rule_limits(key[2], key[3] or ())
+        return time_limit(key[0], cli_time_limit), time_limit(key[1], login_profile_time_limit)
+
+    def _rule_limits(self, path, groups):
+        cli_time_limit, login_profile_time_limit = self.cli_time_limit, self.login_profile_time_limit
+        if path:
+            for rule in self.path_rules:
+                if path.startswith(rule.path):
+                    cli_time_limit = _first(rule.cli_time_limit, cli_time_limit)
+                    login_profile_time_limit = _first(rule.login_profile_time_limit, login_profile_time_limit)
+                    break
+        cli_time_limits = [x.cli_time_limit for g in groups for x in self.group_rules.get(g, ()) if x.cli_time_limit is not None]
+        if cli_time_limits:
+            cli_time_limit = min(cli_time_limits)
+        login_profile_time_limits = [x.login_profile_time_limit for g in groups for x in self.group_rules.get(g, ())
+                                     if x.login_profile_time_limit is not None]
+        if login_profile_time_limits:
+            login_profile_time_limit = min(login_profile_time_limits)
+        return cli_time_limit, login_profile_time_limit
+
+    @property
+    def has_rules(self):
+        return bool(self.path_rules or self.group_rules)
+
+    def compile(self, user_names, tags, placements=None):
+        """threshold table of users ( tags and ( IAM path, group names ) by user name, the missing users have none )"""
+        user_names = list(user_names)
+        # the IAM path and groups of users are only used by the rules
+        placements = (placements or {}) if self.has_rules else {}
+        no_tags = {}
+        no_placement = (None, None)
+        cli_time_limits = array.array('l', [0]) * len(user_names)
+        login_profile_time_limits = array.array('l', [0]) * len(user_names)
+        force = bytearray(len(user_names))
+        # one python step by user, faster than several passes of map ( the keys are hashed once )
+        for i, user_name in enumerate(user_names):
+            user_tags = tags.get(user_name) or no_tags
+            path, groups = placements.get(user_name, no_placement) if placements else no_placement
+            cli_time_limits[i], login_profile_time_limits[i] = self.limits(user_tags, path, groups)
+            if user_tags.get(FORCE_REFRESH_TAG):
+                force[i] = 1
+        return ThresholdTable(user_names, cli_time_limits, login_profile_time_limits, force)
+
+def _first(value, default):
+    return default if value is None else value
+
+class PolicyEvaluation(object):
+    """obsolete credentials and next due date of the users of a threshold table
+
+    The due dates are day ordinals ( first day where the credential is obsolete, NEVER or more if no credential ).
+    """
+
+    def __init__(self, table, today, in_report, password_due, access_key_1_due, access_key_2_due, next_due):
+        self.table = table
+        self.today = today
+        self.in_report = in_report
+        self.password_due = password_due
+        self.access_key_1_due = access_key_1_due
+        self.access_key_2_due = access_key_2_due
+        self.next_due = next_due
+
+    def due_users(self):
+        """names of the users to refresh : forced or with an obsolete credential"""
+        today = self.today.toordinal()
+        due = map(operator.or_, self.table.force, map(operator.le, self.next_due, itertools.repeat(today)))
+        return list(itertools.compress(self.table.user_names, due))
+
+    def obsolete(self, user_name):
+        """( password obsolete, numbers of the obsolete access keys ) of user"""
+        i = self.table.index[user_name]
+        today = self.today.toordinal()
+        access_keys = []
+        if self.access_key_1_due[i] <= today:
+            access_keys.append(1)
+        if self.access_key_2_due[i] <= today:
+            access_keys.append(2)
+        return self.password_due[i] <= today, access_keys
+
+    def next_due_date(self, user_name):
+        """first day where a credential of user is obsolete, None if user has no credential ( today if user is not in report )"""
+        i = self.table.index[user_name]
+        if not self.in_report[i]:
+            return self.today
+        value = self.next_due[i]
+        return datetime.date.fromordinal(value) if value < NEVER else None
+
+def _gather(column, rows):
+    # values of column at rows
+    if rows is None:
+        return column
+    if isinstance(column, bytearray):
+        return bytearray(map(column.__getitem__, rows))
+    return array.array(column.typecode, map(column.__getitem__, rows))
+
+def evaluate(table, credential_report, today=None):
+    """evaluate all users of table against the credential report in one pass over the columns"""
+    today = today or datetime.date.today()
+    columns = credential_report.columns()
+    rows = None
+    if table.user_names != columns.user_names:
+        # rows of the users of table in the columns of report ( the last row for the users absent of report )
+        rows = array.array('l', map(columns.index.get, table.user_names, itertools.repeat(len(columns.user_names))))
+    # a credential is obsolete the day after last change + time limit
+    one = itertools.repeat(1)
+    cli_delays = array.array('l', map(operator.add, table.cli_time_limits, one))
+    login_profile_delays = array.array('l', map(operator.add, table.login_profile_time_limits, one))
+    password_due = array.array('l', map(operator.add, _gather(columns.password, rows), login_profile_delays))
+    access_key_1_due = array.array('l', map(operator.add, _gather(columns.access_key_1, rows), cli_delays))
+    access_key_2_due = array.array('l', map(operator.add, _gather(columns.access_key_2, rows), cli_delays))
+    next_due = array.array('l', map(min, password_due, access_key_1_due, access_key_2_due))
+    return PolicyEvaluation(table, today, _gather(columns.in_report, rows), password_due,
+                            access_key_1_due, access_key_2_due, next_due)
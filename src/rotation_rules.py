@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import datetime
+import functools
+
+# default maximum age of credentials ( in days )
+DEFAULT_LIMIT = 90
+
+EMAIL_TAG = 'IamRotateCredentials:Email'
+CLI_TIME_LIMIT_TAG = 'IamRotateCredentials:CliTimeLimit'
+LOGIN_PROFILE_TIME_LIMIT_TAG = 'IamRotateCredentials:LoginProfileTimeLimit'
+FORCE_REFRESH_TAG = 'IamRotateCredentials:ForceRefresh'
+
+@functools.lru_cache(maxsize=1024)
+def time_limit(tag_value, default_value):
+    """time limit of user : value of tag, else default value ( AWS_CLI_TIME_LIMIT or AWS_LOGIN_PROFILE_TIME_LIMIT )"""
+    try:
+        return int(tag_value or default_value)
+    except (TypeError, ValueError):
+        return DEFAULT_LIMIT
+
+@functools.lru_cache(maxsize=None)
+def obsolete_before(delta, today):
+    """credentials older than this date are obsolete"""
+    return today - datetime.timedelta(days=delta)
+
+def is_obsolete(date, delta, today=None):
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    return date < obsolete_before(delta, today or datetime.date.today())
+
+def password_last_changed(credential_report_info):
+    # password never changed since the creation of user
+    return credential_report_info.password_last_changed or credential_report_info.user_creation_time
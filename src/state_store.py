@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+
+DEFAULT_STATE_STORE = 'file:///tmp/iam-rotate-credentials'
+
+class StateStore(object):
+    """store of json documents shared between invocations"""
+
+    def load(self, key, default=None):
+        raise NotImplementedError()
+
+    def save(self, key, value):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+class MemoryStateStore(StateStore):
+    """state store in memory of the process ( for tests )"""
+
+    def __init__(self):
+        self._documents = {}
+
+    def load(self, key, default=None):
+        value = self._documents.get(key)
+        return json.loads(value) if value is not None else default
+
+    def save(self, key, value):
+        # stored serialized like the other stores, the loaded documents are copies
+        self._documents[key] = json.dumps(value)
+
+    def delete(self, key):
+        self._documents.pop(key, None)
+
+class LocalFileStateStore(StateStore):
+    """state store in local directory ( for tests, /tmp is kept only by warm lambda )"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def load(self, key, default=None):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    def save(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename to never read a partial document
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(value, f)
+        os.replace(f'{path}.tmp', path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+class S3StateStore(StateStore):
+    """state store in AWS S3 bucket ( s3_client : shared client of the lambda )"""
+
+    def __init__(self, bucket, prefix, s3_client):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.s3_client = s3_client
+
+    def _key(self, key):
+        return f'{self.prefix}{key}.json'
+
+    def load(self, key, default=None):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self._key(key))
+            return json.loads(response['Body'].read())
+        except self.s3_client.exceptions.NoSuchKey:
+            return default
+
+    def save(self, key, value):
+        self.s3_client.put_object(Bucket=self.bucket, Key=self._key(key), Body=json.dumps(value).encode('utf-8'))
+
+    def delete(self, key):
+        self.s3_client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+class DynamoDBStateStore(StateStore):
+    """state store in AWS DynamoDB table ( partition key 'key' of type string, dynamodb_client : shared client of the lambda )"""
+
+    def __init__(self, table, dynamodb_client):
+        self.table = table
+        self.dynamodb_client = dynamodb_client
+
+    def load(self, key, default=None):
+        response = self.dynamodb_client.get_item(TableName=self.table, Key={'key': {'S': key}}, ConsistentRead=True)
+        if 'Item' not in response:
+            return default
+        return json.loads(response['Item']['value']['S'])
+
+    def save(self, key, value):
+        self.dynamodb_client.put_item(TableName=self.table, Item={'key': {'S': key}, 'value': {'S': json.dumps(value)}})
+
+    def delete(self, key):
+        self.dynamodb_client.delete_item(TableName=self.table, Key={'key': {'S': key}})
+
+def create_state_store(url=None, client_factory=None):
+    """create state store from url ( file:///path, s3://bucket/prefix, dynamodb://table or memory:// )
+
+    client_factory creates the AWS clients ( Common.client ), it is required by the s3 and dynamodb stores.
+    """
+    if not url:
+        url = DEFAULT_STATE_STORE
+    if url == 'memory://':
+        return MemoryStateStore()
+    if url.startswith('file://'):
+        return LocalFileStateStore(url[len('file://'):])
+    if url.startswith('s3://') or url.startswith('dynamodb://'):
+        if client_factory is None:
+            raise ValueError(f'State store {url} requires a client factory')
+        if url.startswith('s3://'):
+            bucket, _, prefix = url[len('s3://'):].partition('/')
+            return S3StateStore(bucket, prefix, client_factory('s3'))
+        return DynamoDBStateStore(url[len('dynamodb://'):], client_factory('dynamodb'))
+    raise ValueError(f'Unknown state store {url}')
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import logging
+import threading
+
+LOG_FORMAT_JSON = 'json'
+LOG_FORMAT_TEXT = 'text'
+DEFAULT_LOG_FORMAT = LOG_FORMAT_JSON
+DEFAULT_LOG_LEVEL = 'INFO'
+# routine lines of each user, one line of 100 is kept ( all the exclusions are counted in the summary of run )
+DEFAULT_LOG_SAMPLING = 'not_due=0.01,not_obsolete=0.01,already_requested=0.01'
+
+class JsonFormatter(logging.Formatter):
+    """one json document by line, the fields are discovered by CloudWatch Logs Insights
+
+    The message is formatted here ( arguments of logger call ), only for the records kept.
+    """
+
+    def format(self, record):
+        document = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        # added by the handler of AWS Lambda runtime
+        request_id = getattr(record, 'aws_request_id', None)
+        if request_id:
+            document['request_id'] = request_id
+        category = getattr(record, 'category', None)
+        if category:
+            document['category'] = category
+        fields = getattr(record, 'fields', None)
+        if fields:
+            document.update(fields)
+        if record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        return json.dumps(document, default=str)
+
+class LogSampler(logging.Filter):
+    """keep a part of the records of each sampled category ( extra={'category': ...} )
+
+    The first record of category is kept, then one record every 1 / rate ( deterministic, no random ),
+    rate 0 drops all records of category.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self._seen = {}
+        self._dropped = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        category = getattr(record, 'category', None)
+        rate = self.rates.get(category) if category else None
+        if rate is None or rate >= 1:
+            return True
+        with self._lock:
+            seen = self._seen.get(category, 0)
+            self._seen[category] = seen + 1
+            keep = rate > 0 and seen % max(1, int(round(1 / rate))) == 0
+            if not keep:
+                self._dropped[category] = self._dropped.get(category, 0) + 1
+        return keep
+
+    def reset(self):
+        """number of records dropped by category since the last reset"""
+        with self._lock:
+            dropped, self._dropped = self._dropped, {}
+            self._seen = {}
+        return dropped
+
+def parse_sampling(value):
+    """sampling rates by category from "<category>=<rate>,..." ( invalid entries are ignored )"""
+    rates = {}
+    for item in (value or '').split(','):
+        category, _, rate = item.partition('=')
+        try:
+            rates[category.strip()] = min(1.0, max(0.0, float(rate)))
+        except ValueError:
+            continue
+    return rates
+
+def configure_logging(logger, log_format=DEFAULT_LOG_FORMAT, level=DEFAULT_LOG_LEVEL, sampling=DEFAULT_LOG_SAMPLING):
+    """set level, format and sampler of logger, returns the sampler"""
+    # getLevelName returns the level of a known name, else a string
+    level = logging.getLevelName((level or DEFAULT_LOG_LEVEL).upper().strip())
+    logger.setLevel(level if isinstance(level, int) else logging.INFO)
+    if (log_format or DEFAULT_LOG_FORMAT).lower().strip() == LOG_FORMAT_JSON:
+        for handler in logger.handlers:
+            handler.setFormatter(JsonFormatter())
+    # the lambdas of a process ( tests, benchmarks ) share the sampler of root logger
+    sampler = next((x for x in logger.filters if isinstance(x, LogSampler)), None)
+    if sampler is None:
+        sampler = LogSampler(parse_sampling(sampling))
+        logger.addFilter(sampler)
+    else:
+        sampler.rates = parse_sampling(sampling)
+    return sampler
@@ -50,6 +50,11 @@ output "sqs_update_iam_credentials_for_user_dead_letter_id" {
   value       = module.iam_rotate_credentials.sqs_update_iam_credentials_for_user_dead_letter_id
 }
 
+output "state_bucket_id" {
+  description = "The name of S3 bucket used to store the state of scans"
+  value       = module.iam_rotate_credentials.state_bucket_id
+}
+
 output "kms_ciphertext" {
   description = "The Secret used to encrypt the data"
   value       =  module.iam_rotate_credentials.kms_ciphertext
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+Unit tests of the lambdas, AWS is replaced by the synthetic account of bench/fake_aws.py.
+
+usage: python -m pytest test/unit
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+sys.path.insert(0, os.path.join(ROOT, 'bench'))
+EVENTS = os.path.join(ROOT, 'test', 'events')
+
+# read by the lambdas when they are imported
+os.environ.setdefault('AWS_DEFAULT_REGION', 'eu-west-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'test')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'test')
+os.environ['AWS_SQS_REQUEST_URL'] = 'https://sqs.eu-west-1.amazonaws.com/123456789012/test'
+os.environ['AWS_SNS_RESULT_ARN'] = 'arn:aws:sns:eu-west-1:123456789012:test'
+os.environ['AWS_SES_EMAIL_FROM'] = 'test@example.com'
+os.environ['AWS_REQUEST_SIGNING_KEY'] = 'test'
+os.environ['AWS_METRICS_NAMESPACE'] = ''
+os.environ['AWS_UPDATE_LAMBDA_ROLE_ARN'] = 'arn:aws:iam::123456789012:role/iam-rotate-credentials-update-iam-credentials-for-user-role'
+# the credential report of each test is generated again
+os.environ['AWS_CREDENTIAL_REPORT_MAX_AGE'] = '0'
+os.environ['AWS_STATE_STORE'] = 'file://' + tempfile.mkdtemp(prefix='iam-rotate-credentials-test-')
+
+class FakeAwsSwitch(object):
+    """the clients of the lambdas are created once, their calls go to the fake account of the running test"""
+
+    def __init__(self):
+        self.current = None
+        self._installed = False
+
+    def install(self):
+        if self._installed:
+            return
+        import boto3
+        boto3.setup_default_session()
+        events = boto3.DEFAULT_SESSION.events
+        events.register('before-parameter-build', lambda **kwargs: self.current._before_parameter_build(**kwargs))
+        events.register('before-call', lambda **kwargs: self.current._before_call(**kwargs))
+        self._installed = True
+
+fake_aws_switch = FakeAwsSwitch()
+
+@pytest.fixture
+def fake_aws():
+    """create the synthetic account answering the AWS calls of test : fake_aws(users)"""
+    from fake_aws import FakeAws
+    fake_aws_switch.install()
+
+    def create(users=100, **kwargs):
+        fake_aws_switch.current = FakeAws(users, **kwargs)
+        return fake_aws_switch.current
+    return create
+
+@pytest.fixture
+def state_directory(tmp_path, monkeypatch):
+    """state store of the lambdas in a directory of test"""
+    monkeypatch.setenv('AWS_STATE_STORE', f'file://{tmp_path}')
+    return tmp_path
+
+@pytest.fixture
+def scanner(fake_aws, state_directory):
+    """scan lambda without client side rate limit"""
+    import lambdaFindUsersToRefreshHandler as scanner
+    scanner.bind_account(None)
+    scanner.iam_rate_limiter.max_rate = scanner.iam_rate_limiter.rate = float('inf')
+    scanner.common.tag_cache.clear()
+    return scanner
+
+class Context(object):
+    """context of lambda"""
+
+    invoked_function_arn = 'arn:aws:lambda:eu-west-1:123456789012:function:test'
+
+    def __init__(self, remaining_time=300000):
+        self.remaining_time = remaining_time
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_time
+
+def load_event(name):
+    with open(os.path.join(EVENTS, name)) as f:
+        return json.load(f)
+
+def sent_requests(fake):
+    """requests sent to SQS"""
+    return [json.loads(x) for x in fake.messages]
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+
+import boto3
+import pytest
+
+from conftest import EVENTS
+from conftest import Context
+from conftest import load_event
+from conftest import sent_requests
+from replay_iam_events import apply_event
+
+# parse_event result and ( user, force, login profile, access keys ) of the requests of each event of test/events
+EXPECTED = {
+    'create-access-key-denied.json': (None, []),
+    'create-access-key-rotation.json': (None, []),
+    'create-access-key.json': (('CreateAccessKey', 'user-000024', None), [('user-000024', False, True, 0)]),
+    'create-login-profile.json': (('CreateLoginProfile', 'user-000003', None), [('user-000003', False, False, 1)]),
+    'create-user.json': (('CreateUser', 'user-new', None), []),
+    'tag-user-email.json': (('TagUser', 'user-000002', None), [('user-000002', False, False, 1)]),
+    'tag-user-force-refresh.json': (('TagUser', 'user-000001', None), [('user-000001', True, False, 0)]),
+    'tag-user-other-tag.json': (None, []),
+    'untag-user-force-refresh.json': (None, []),
+    'update-login-profile.json': (('UpdateLoginProfile', 'user-000011', None), [('user-000011', False, False, 1)])
+}
+
+@pytest.fixture
+def handler(scanner):
+    import lambdaEvaluateUserOnIamEventHandler as handler
+    return handler
+
+def summary_of(requests):
+    return [(x['user_name'], x['force'], x['login_profile'], len(x['access_key_ids'])) for x in requests]
+
+def test_all_events_are_expected():
+    assert sorted(os.path.basename(x) for x in glob.glob(os.path.join(EVENTS, '*.json'))) == sorted(EXPECTED)
+
+@pytest.mark.parametrize('name', sorted(EXPECTED))
+def test_event(name, handler, fake_aws):
+    fake = fake_aws(100)
+    event = load_event(name)
+    apply_event(boto3.client('iam'), event['detail'])
+    parsed, requests = EXPECTED[name]
+    assert handler.parse_event(event, Context()) == parsed
+    calls = dict(fake.calls)
+    handler.main(event, Context())
+    assert summary_of(sent_requests(fake)) == requests
+    if parsed is None:
+        # the ignored events do not call AWS
+        assert fake.calls == calls
+
+def test_force_refresh_tag_is_consumed(handler, fake_aws):
+    fake = fake_aws(100)
+    event = load_event('tag-user-force-refresh.json')
+    apply_event(boto3.client('iam'), event['detail'])
+    handler.main(event, Context())
+    assert 'IamRotateCredentials:ForceRefresh' not in fake._users['user-000001'].tags
+    # the untag event of the scan is ignored
+    untag = load_event('untag-user-force-refresh.json')
+    untag['detail']['requestParameters']['userName'] = 'user-000001'
+    assert handler.parse_event(untag, Context()) is None
+
+def test_untag_of_other_tag_with_force_refresh_tag_is_evaluated(handler, fake_aws):
+    fake_aws(100)
+    event = load_event('untag-user-force-refresh.json')
+    event['detail']['requestParameters']['tagKeys'].append('IamRotateCredentials:Email')
+    assert handler.parse_event(event, Context()) == ('UntagUser', 'user-000021', None)
+
+@pytest.mark.parametrize('event_name, login_profile', [('UpdateLoginProfile', False), ('CreateLoginProfile', False),
+                                                         ('CreateAccessKey', True)])
+def test_password_event_drops_password_request(event_name, login_profile, handler, fake_aws):
+    # the event is not applied, the password of credential report is older than the password of event
+    fake = fake_aws(100)
+    event = load_event('update-login-profile.json')
+    event['detail']['eventName'] = event_name
+    handler.main(event, Context())
+    assert summary_of(sent_requests(fake)) == [('user-000011', False, login_profile, 1)]
+
+def test_event_of_update_lambda_is_ignored(handler, fake_aws, monkeypatch):
+    # the credential report generated before the rotation still shows the replaced credentials
+    monkeypatch.setattr(handler.scanner, 'DEDUPLICATION_TTL', 0)
+    event = load_event('create-access-key-rotation.json')
+    fake = fake_aws(100)
+    handler.main(event, Context())
+    assert sent_requests(fake) == []
+
+    # the same call by another role is evaluated
+    event['detail']['userIdentity'] = load_event('create-access-key.json')['detail']['userIdentity']
+    fake = fake_aws(100)
+    handler.main(event, Context())
+    assert summary_of(sent_requests(fake)) == [('user-000005', False, True, 1)]
+
+def test_event_of_update_lambda_in_target_account_is_ignored(handler):
+    detail = load_event('create-access-key-rotation.json')['detail']
+    detail['userIdentity']['arn'] = 'arn:aws:sts::111111111111:assumed-role/iam-rotate-credentials/iam-rotate-credentials-update'
+    detail['userIdentity']['sessionContext']['sessionIssuer']['arn'] = 'arn:aws:iam::111111111111:role/iam-rotate-credentials'
+    assert handler.is_rotation_event(detail)
+    detail['userIdentity']['arn'] = 'arn:aws:sts::111111111111:assumed-role/iam-rotate-credentials/iam-rotate-credentials'
+    assert not handler.is_rotation_event(detail)
+
+def test_event_of_deleted_user_is_excluded(handler, fake_aws):
+    fake = fake_aws(100)
+    event = load_event('create-access-key.json')
+    event['detail']['requestParameters']['userName'] = 'user-deleted'
+    handler.main(event, Context())
+    assert sent_requests(fake) == []
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+import collections
+
+from conftest import Context
+from conftest import sent_requests
+
+def test_renewed_access_keys_not_listed_again_with_same_report(fake_aws, scanner, monkeypatch):
+    # the credential report is reused by the scans, it is older than the rotations
+    monkeypatch.setattr(scanner.credential_report_cache, 'max_age', 3600)
+    monkeypatch.setattr(scanner.credential_report_cache, '_last', None)
+    fake = fake_aws(300)
+    listed = collections.Counter()
+    list_access_keys = fake._iam_list_access_keys
+
+    def counted_list_access_keys(UserName, **kwargs):
+        listed[UserName] += 1
+        return list_access_keys(UserName, **kwargs)
+    monkeypatch.setattr(fake, '_iam_list_access_keys', counted_list_access_keys)
+
+    scanner.main({}, Context())
+    # rotation of the access keys by the update lambda
+    rotated = [x for x in sent_requests(fake) if x['access_key_ids'] and not x['login_profile'] and not x['force']]
+    assert rotated
+    for request in rotated:
+        for access_key_id in request['access_key_ids']:
+            fake._iam_delete_access_key(request['user_name'], access_key_id)
+            fake._iam_create_access_key(request['user_name'])
+    rotated_users = set(x['user_name'] for x in rotated)
+
+    fake.messages = []
+    listed.clear()
+    scanner.main({}, Context())
+    # the keys of report are obsolete, IAM shows the new keys
+    assert all(listed[x] == 1 for x in rotated_users)
+    assert not rotated_users & set(x['user_name'] for x in sent_requests(fake))
+
+    listed.clear()
+    calls = fake.calls[('iam', 'GenerateCredentialReport')]
+    scanner.main({}, Context())
+    assert fake.calls[('iam', 'GenerateCredentialReport')] == calls
+    assert not rotated_users & set(listed)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+
+from conftest import Context
+from notification import SesSender
+from state_store import MemoryStateStore
+
+class SesClient(object):
+    """ses client answering get_send_quota slowly"""
+
+    def __init__(self):
+        self.quota_calls = 0
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def get_send_quota(self):
+        with self._lock:
+            self.quota_calls += 1
+        time.sleep(0.05)
+        return {'MaxSendRate': 1000.0}
+
+    def send_email(self, **kwargs):
+        with self._lock:
+            self.sent += 1
+
+def test_rate_limiter_created_once_by_concurrent_senders():
+    ses_client = SesClient()
+    sender = SesSender(ses_client)
+    threads = [threading.Thread(target=sender.send, args=('from@example.com', f'user-{i}@example.com', 'subject', 'text', 'body', f'user-{i}'))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ses_client.quota_calls == 1
+    assert ses_client.sent == 8
+    assert sender.rate_limiter.max_rate == 1000.0
+
+def test_notification_history_by_shard(scanner, monkeypatch):
+    common = scanner.common
+    published = []
+    store = MemoryStateStore()
+    monkeypatch.setattr(common, 'send_message', lambda message, verbosity='INFO': published.append(message))
+    for shard in [(0, 2), (1, 2)]:
+        common.notify('Category', f'message of shard {shard[0]}')
+        common.publish_notifications(store, scanner.state_key(common.notification_history_key(), shard, '123456789012'))
+    # the history of a shard does not replace the history of the other shard
+    common.notify('Category', 'message of shard 0')
+    common.publish_notifications(store, scanner.state_key(common.notification_history_key(), (0, 2), '123456789012'))
+    assert len(published) == 2
+    assert sorted(store._documents) == ['123456789012/notifications/local-0', '123456789012/notifications/local-1']
+
+def test_scan_publishes_notifications_with_shard_history(scanner, fake_aws, state_directory):
+    fake_aws(10)
+    scanner.common.notify('Category', 'message')
+    scanner.main({'shard': 1, 'shards': 2}, Context())
+    assert (state_directory / 'notifications' / 'local-1.json').exists()
+    assert not (state_directory / 'notifications' / 'local.json').exists()
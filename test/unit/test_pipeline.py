@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import time
+import random
+import threading
+
+import pytest
+
+from pipeline import Marker
+from pipeline import PageEnd
+from pipeline import Pipeline
+from pipeline import ScanEnd
+from pipeline import parallel_map
+
+def items_with_markers(count, page_size=7):
+    items = []
+    for i in range(count):
+        items.append(i)
+        if i % page_size == page_size - 1:
+            items.append(PageEnd(str(i), i + 1))
+    items.append(ScanEnd())
+    return items
+
+def slow_square(x):
+    """square of x after a random delay, None for the multiples of 5"""
+    time.sleep(random.random() * 0.002)
+    return None if x % 5 == 0 else x * x
+
+def expected_of(items):
+    return [x if isinstance(x, Marker) else x * x for x in items if isinstance(x, Marker) or x % 5]
+
+def executor_threads():
+    return [x for x in threading.enumerate() if x.name.startswith('ThreadPoolExecutor')]
+
+@pytest.mark.parametrize('workers', [1, 4, 16])
+def test_parallel_map_keeps_order_of_items_and_markers(workers):
+    items = items_with_markers(200)
+    assert list(parallel_map(slow_square, items, workers)) == expected_of(items)
+
+@pytest.mark.parametrize('max_pending', [2, 5, 12])
+def test_parallel_map_bounds_pending_items(max_pending):
+    pulled = [0]
+    consumed = [0]
+    in_progress = []
+
+    def source():
+        for i in range(100):
+            pulled[0] += 1
+            in_progress.append(pulled[0] - consumed[0])
+            yield i + 1
+
+    for _ in parallel_map(lambda x: x, source(), 4, max_pending):
+        consumed[0] += 1
+        # slow consumer, the workers are ahead
+        time.sleep(0.0005)
+    assert consumed[0] == 100
+    assert max(in_progress) == max_pending
+
+def test_parallel_map_raises_exception_of_worker():
+    baseline = executor_threads()
+    started = []
+
+    def function(x):
+        started.append(x)
+        if x == 30:
+            raise ValueError(f'invalid item {x}')
+        time.sleep(0.001)
+        return x
+
+    results = []
+    with pytest.raises(ValueError, match='invalid item 30'):
+        for result in parallel_map(function, range(100), 4):
+            results.append(result)
+    assert results == list(range(30))
+    # the items after the failure are not all submitted, the executor waited for the submitted ones
+    assert len(started) < 100
+    assert executor_threads() == baseline
+
+def test_parallel_map_shuts_down_executor_when_closed():
+    baseline = executor_threads()
+    results = parallel_map(lambda x: x, range(100), 4)
+    assert next(results) == 0
+    assert len(executor_threads()) > len(baseline)
+    results.close()
+    assert executor_threads() == baseline
+
+def test_pipeline_counts_items_of_stages():
+    items = items_with_markers(50)
+    pipeline = Pipeline('source', items) \
+        .then('square', lambda x: parallel_map(slow_square, x, 4)) \
+        .then('even', lambda x, n: (y for y in x if isinstance(y, Marker) or y % n == 0), 2)
+    result = pipeline.run('sink', list)
+    assert result == [x for x in expected_of(items) if isinstance(x, Marker) or x % 2 == 0]
+    assert [x[:2] for x in pipeline.stages] == [['source', 50], ['square', 40], ['even', 20], ['sink', None]]
+    assert list(pipeline.durations()) == ['source', 'square', 'even', 'sink']
+    assert all(x >= 0 for x in pipeline.durations().values())
+
+def test_pipeline_raises_exception_of_stage():
+    def fail(x):
+        raise RuntimeError('stage failed')
+
+    pipeline = Pipeline('source', range(10)).then('fail', lambda x: parallel_map(fail, x, 2))
+    with pytest.raises(RuntimeError, match='stage failed'):
+        pipeline.run('sink', list)
+    assert pipeline.stages[-1][0] == 'sink'
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from common import RefreshCredentialRequest
+from common import RequestPublisher
+
+class SqsClient(object):
+    """sqs client failing the entries of users given for each call ( user name -> sender fault )"""
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.batches = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        users = [json.loads(x['MessageBody'])['user_name'] for x in Entries]
+        self.batches.append(users)
+        failures = self.failures.pop(0) if self.failures else {}
+        if isinstance(failures, Exception):
+            raise failures
+        successful = [{'Id': x['Id']} for x, user in zip(Entries, users) if user not in failures]
+        failed = [{'Id': x['Id'], 'SenderFault': failures[user], 'Code': 'Error', 'Message': f'failure of {user}'}
+                  for x, user in zip(Entries, users) if user in failures]
+        return {'Successful': successful, 'Failed': failed}
+
+def publisher_of(sqs_client, not_sent):
+    return RequestPublisher(sqs_client, 'queue', retry_delay=0, on_not_sent=lambda x: not_sent.append(x.user_name))
+
+def publish(publisher, count):
+    for i in range(count):
+        publisher.publish(RefreshCredentialRequest(user_name=f'user-{i}'))
+    publisher.flush()
+
+def test_requests_sent_by_batch_of_10():
+    sqs_client = SqsClient()
+    publisher = publisher_of(sqs_client, [])
+    publish(publisher, 23)
+    assert [len(x) for x in sqs_client.batches] == [10, 10, 3]
+    assert publisher.published == 23
+
+def test_only_failed_entries_are_retried():
+    sqs_client = SqsClient({'user-2': False, 'user-5': False}, {'user-5': False})
+    not_sent = []
+    publisher = publisher_of(sqs_client, not_sent)
+    publish(publisher, 10)
+    assert sqs_client.batches[1:] == [['user-2', 'user-5'], ['user-5']]
+    assert publisher.published == 10
+    assert not_sent == []
+
+def test_sender_fault_is_not_retried():
+    sqs_client = SqsClient({'user-3': True, 'user-4': False})
+    not_sent = []
+    publisher = publisher_of(sqs_client, not_sent)
+    with pytest.raises(RuntimeError, match='failure of user-3'):
+        publish(publisher, 10)
+    assert len(sqs_client.batches) == 1
+    assert publisher.published == 8
+    assert sorted(not_sent) == ['user-3', 'user-4']
+
+def test_retries_limited_to_max_attempts():
+    sqs_client = SqsClient(*[{'user-1': False}] * 5)
+    not_sent = []
+    publisher = publisher_of(sqs_client, not_sent)
+    with pytest.raises(RuntimeError, match='failure of user-1'):
+        publish(publisher, 2)
+    assert sqs_client.batches == [['user-0', 'user-1'], ['user-1'], ['user-1']]
+    assert publisher.published == 1
+    assert not_sent == ['user-1']
+
+def test_error_of_client_reports_all_entries_not_sent():
+    sqs_client = SqsClient(ConnectionError('connection reset'))
+    not_sent = []
+    publisher = publisher_of(sqs_client, not_sent)
+    with pytest.raises(ConnectionError):
+        publish(publisher, 3)
+    assert publisher.published == 0
+    assert not_sent == ['user-0', 'user-1', 'user-2']
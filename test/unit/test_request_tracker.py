@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+
+import pytest
+
+from common import RefreshCredentialRequest
+from common import RequestPublisher
+from request_tracker import DONE
+from request_tracker import IN_FLIGHT
+from request_tracker import RequestTracker
+from request_tracker import credential_key
+from state_store import LocalFileStateStore
+from state_store import MemoryStateStore
+
+def request_of(user_name='user-1', **kwargs):
+    values = {'user_name': user_name, 'login_profile': True, 'access_key_ids': ['AKIA1', 'AKIA2']}
+    values.update(kwargs)
+    return RefreshCredentialRequest(**values)
+
+class SqsClient(object):
+    """sqs client delivering each message to the update lambda before the response of send_message_batch"""
+
+    def __init__(self, tracker, failed=False):
+        self.tracker = tracker
+        self.failed = failed
+        self.statuses = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if self.failed:
+            return {'Failed': [{'Id': x['Id'], 'SenderFault': True, 'Code': 'InvalidMessage'} for x in Entries]}
+        for entry in Entries:
+            request = RefreshCredentialRequest(**json.loads(entry['MessageBody']))
+            self.statuses.append([self.tracker.status(x) for x in request.idempotency_keys])
+            self.tracker.mark_done(request)
+        return {'Successful': [{'Id': x['Id']} for x in Entries]}
+
+@pytest.fixture(params=['memory', 'file'])
+def tracker(request, tmp_path):
+    store = MemoryStateStore() if request.param == 'memory' else LocalFileStateStore(str(tmp_path))
+    return RequestTracker(store, ttl=60)
+
+def test_deduplicate_removes_credentials_in_flight_or_done(tracker):
+    first = request_of()
+    assert tracker.deduplicate(first, due_window='2024-01-01')
+    assert len(first.idempotency_keys) == 3
+    tracker.mark_in_flight(first)
+
+    second = request_of(access_key_ids=['AKIA1', 'AKIA2', 'AKIA3'])
+    assert tracker.deduplicate(second, due_window='2024-01-01')
+    assert not second.login_profile
+    assert second.access_key_ids == ['AKIA3']
+    assert second.idempotency_keys == [credential_key(second, 'access_key', 'AKIA3')]
+
+    tracker.mark_done(first)
+    assert not tracker.deduplicate(request_of(), due_window='2024-01-01')
+    # the password of the next due window is requested again
+    assert tracker.deduplicate(request_of(access_key_ids=[]), due_window='2024-04-01')
+
+def test_deduplicate_keeps_forced_refresh(tracker):
+    first = request_of()
+    tracker.deduplicate(first, due_window='2024-01-01')
+    tracker.mark_done(first)
+    forced = request_of(force=True)
+    assert tracker.deduplicate(forced, due_window='2024-01-01')
+    assert forced.login_profile and forced.access_key_ids == ['AKIA1', 'AKIA2']
+    assert forced.idempotency_keys == [credential_key(forced, 'login_profile', '2024-01-01')]
+
+def test_is_done(tracker):
+    request = request_of()
+    tracker.deduplicate(request, due_window='2024-01-01')
+    assert not tracker.is_done(request)
+    tracker.mark_in_flight(request)
+    assert not tracker.is_done(request)
+    tracker.mark_done(request)
+    assert tracker.is_done(request)
+    assert not tracker.is_done(request_of(force=True, idempotency_keys=request.idempotency_keys))
+    assert not tracker.is_done(request_of(idempotency_keys=[]))
+
+def test_status_expires(tracker):
+    request = request_of()
+    tracker.deduplicate(request, due_window='2024-01-01')
+    tracker.mark_done(request)
+    key = request.idempotency_keys[0]
+    assert tracker.status(key) == DONE
+    assert tracker.status(key, now=time.time() + 61) is None
+
+def test_request_done_before_response_of_sqs_stays_done(tracker):
+    sqs_client = SqsClient(tracker)
+    publisher = RequestPublisher(sqs_client, 'queue', on_sending=tracker.mark_in_flight, on_not_sent=tracker.clear_in_flight)
+    requests = [request_of(f'user-{i}') for i in range(12)]
+    for request in requests:
+        assert tracker.deduplicate(request, due_window='2024-01-01')
+        publisher.publish(request)
+    publisher.flush()
+    # in flight when the update lambda receives the requests, not downgraded after their processing
+    assert sqs_client.statuses == [[IN_FLIGHT] * 3] * 12
+    assert all(tracker.is_done(x) for x in requests)
+
+def test_request_not_sent_is_not_in_flight(tracker):
+    publisher = RequestPublisher(SqsClient(tracker, failed=True), 'queue',
+                                 on_sending=tracker.mark_in_flight, on_not_sent=tracker.clear_in_flight)
+    request = request_of()
+    tracker.deduplicate(request, due_window='2024-01-01')
+    publisher.publish(request)
+    with pytest.raises(RuntimeError):
+        publisher.flush()
+    assert [tracker.status(x) for x in request.idempotency_keys] == [None] * 3
+    assert tracker.deduplicate(request_of(), due_window='2024-01-01')
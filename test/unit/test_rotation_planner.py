@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import collections
+
+import pytest
+
+from credential_report import CredentialReport
+from fake_aws import FakeAws
+from fake_aws import VERIFIED_DOMAIN
+import rotation_planner
+
+@pytest.fixture(scope='module')
+def account():
+    fake = FakeAws(2000)
+    credential_report = CredentialReport.parse(fake._iam_get_credential_report()['Content'])
+    tags = {x.name: dict(x.tags) for x in fake._users.values()}
+    # users created after the generation of report
+    for i in range(20):
+        tags[f'new-user-{i}'] = {'IamRotateCredentials:Email': f'new-user-{i}@{VERIFIED_DOMAIN}'}
+    tags['new-user-0']['IamRotateCredentials:ForceRefresh'] = 'true'
+    tags['new-user-1']['IamRotateCredentials:Email'] = 'not an email'
+    return credential_report, tags
+
+@pytest.mark.parametrize('options', [{}, {'cli_time_limit': 30, 'verified_identities': {VERIFIED_DOMAIN}},
+                                     {'login_profile_time_limit': 400, 'today': datetime.date(2030, 1, 1)}])
+def test_summary_matches_decisions_of_users(account, options):
+    credential_report, tags = account
+    planned = rotation_planner.plan(credential_report, tags, **options)
+    users = list(planned)
+    assert len(users) == len(credential_report) + 20
+    expected = collections.Counter()
+    for x in users:
+        if x.decision != 'refresh':
+            expected[x.decision] += 1
+            continue
+        if x.login_profile:
+            expected['refresh: console password'] += 1
+        if x.access_key_ids:
+            expected['refresh: access keys'] += 1
+    assert rotation_planner.summarize(planned) == expected
+    assert planned.requests() == sum(1 for x in users if x.request is not None)
+
+def test_decisions(account):
+    credential_report, tags = account
+    planned = rotation_planner.plan(credential_report, tags)
+    decisions = {x.user_name: x for x in planned}
+    assert decisions['new-user-0'].decision == 'force refresh'
+    assert decisions['new-user-1'].decision == 'excluded: invalid email'
+    assert decisions['new-user-2'].decision == 'not in credential report'
+    refreshed = next(x for x in planned if x.decision == 'refresh' and x.access_key_ids)
+    assert refreshed.request.access_key_ids == refreshed.access_key_ids
+    assert all(isinstance(x[2], int) for x in refreshed.reasons)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+from common import jump_consistent_hash
+from common import user_shard
+
+USER_NAMES = [f'user-{i:06d}' for i in range(10000)]
+
+def test_user_shard_same_in_other_process():
+    # hash() of strings changes with PYTHONHASHSEED, the shards must not
+    code = 'import sys; from common import user_shard; print([user_shard(f"user-{i:06d}", 8) for i in range(200)])'
+    src = os.path.dirname(sys.modules['common'].__file__)
+    shards = [subprocess.check_output([sys.executable, '-c', code], cwd=src, env=dict(os.environ, PYTHONHASHSEED=seed))
+              for seed in ['1', '2']]
+    assert shards[0] == shards[1]
+    assert shards[0].decode('utf-8').strip() == str([user_shard(f'user-{i:06d}', 8) for i in range(200)])
+
+@pytest.mark.parametrize('shards', [1, 2, 7, 16])
+def test_each_user_in_one_shard(shards):
+    from lambdaFindUsersToRefreshHandler import ScanContext
+    scans = [ScanContext(None, None, None, shard=(index, shards)) for index in range(shards)]
+    counts = [sum(1 for x in USER_NAMES if scan.is_in_shard(x)) for scan in scans]
+    assert all(sum(1 for scan in scans if scan.is_in_shard(x)) == 1 for x in USER_NAMES)
+    assert sum(counts) == len(USER_NAMES)
+    # balanced shards
+    assert min(counts) > 0.8 * len(USER_NAMES) / shards
+
+@pytest.mark.parametrize('shards', [1, 4, 9])
+def test_few_users_move_when_shard_added(shards):
+    moved = [x for x in USER_NAMES if user_shard(x, shards) != user_shard(x, shards + 1)]
+    expected = len(USER_NAMES) / (shards + 1)
+    assert 0.8 * expected < len(moved) < 1.2 * expected
+    # the users only move to the new shard
+    assert all(user_shard(x, shards + 1) == shards for x in moved)
+
+def test_jump_consistent_hash_in_range():
+    assert all(0 <= jump_consistent_hash(key, 5) < 5 for key in range(0, 2 ** 64, 2 ** 58))
+    assert jump_consistent_hash(12345, 1) == 0
+
+def test_get_shard():
+    from lambdaFindUsersToRefreshHandler import get_shard
+    from lambdaFindUsersToRefreshHandler import state_key
+    assert get_shard({}) is None
+    assert get_shard({'account': None, 'shard': 0, 'shards': 1}) is None
+    assert get_shard({'account': None, 'shard': '2', 'shards': '4'}) == (2, 4)
+    for event in [{'shard': 4, 'shards': 4}, {'shard': -1, 'shards': 4}, {'shard': 0, 'shards': 0}]:
+        with pytest.raises(ValueError):
+            get_shard(event)
+    for event in [{'shard': 0}, {'shard': 'first', 'shards': 2}, {'shard': None, 'shards': 2}]:
+        with pytest.raises(ValueError):
+            get_shard(event)
+    assert state_key('scan-checkpoint', None) == 'scan-checkpoint'
+    assert state_key('scan-checkpoint', (2, 4), '111111111111') == '111111111111/scan-checkpoint-2'
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from conftest import Context
+from conftest import sent_requests
+from state_store import DynamoDBStateStore
+from state_store import LocalFileStateStore
+from state_store import MemoryStateStore
+from state_store import S3StateStore
+from state_store import create_state_store
+
+def test_create_state_store(tmp_path):
+    created = []
+
+    def client_factory(service_name):
+        created.append(service_name)
+        return service_name
+
+    assert isinstance(create_state_store('memory://'), MemoryStateStore)
+    assert isinstance(create_state_store(f'file://{tmp_path}'), LocalFileStateStore)
+    store = create_state_store('s3://bucket/prefix/', client_factory)
+    assert isinstance(store, S3StateStore) and (store.bucket, store.prefix, store.s3_client) == ('bucket', 'prefix/', 's3')
+    store = create_state_store('dynamodb://table', client_factory)
+    assert isinstance(store, DynamoDBStateStore) and store.dynamodb_client == 'dynamodb'
+    assert created == ['s3', 'dynamodb']
+
+def test_aws_state_store_requires_client_factory():
+    for url in ['s3://bucket/', 'dynamodb://table']:
+        with pytest.raises(ValueError):
+            create_state_store(url)
+    with pytest.raises(ValueError):
+        create_state_store('ftp://host/')
+
+@pytest.mark.parametrize('url', ['memory://', 'file'])
+def test_documents_are_copies(url, tmp_path):
+    store = create_state_store(f'file://{tmp_path}' if url == 'file' else url)
+    document = {'marker': '100', 'users': 100}
+    store.save('account/scan-checkpoint-0', document)
+    document['users'] = 200
+    assert store.load('account/scan-checkpoint-0') == {'marker': '100', 'users': 100}
+    store.delete('account/scan-checkpoint-0')
+    store.delete('account/scan-checkpoint-0')
+    assert store.load('account/scan-checkpoint-0', {}) == {}
+
+def test_scan_resumes_from_checkpoint(fake_aws, scanner, state_directory, tmp_path_factory, monkeypatch):
+    fake = fake_aws(250)
+    store = create_state_store(f'file://{state_directory}')
+
+    class FirstPageContext(Context):
+        # the lambda timeout is near after the first page of users
+        def get_remaining_time_in_millis(self):
+            return 0 if fake.calls[('iam', 'ListUsers')] else 300000
+
+    scanner.main({}, FirstPageContext())
+    checkpoint = store.load(scanner.CHECKPOINT_KEY)
+    assert (checkpoint['marker'], checkpoint['users']) == ('100', 100)
+    interrupted = sent_requests(fake)
+    assert interrupted and all(int(x['user_name'].split('-')[1]) < 100 for x in interrupted)
+
+    list_users = fake.calls[('iam', 'ListUsers')]
+    scanner.main({}, Context())
+    assert store.load(scanner.CHECKPOINT_KEY) is None
+    # the resumed scan lists the 2 last pages only
+    assert fake.calls[('iam', 'ListUsers')] - list_users == 2
+    resumed = sent_requests(fake)
+
+    # same requests as a scan without interruption
+    expected = fake_aws(250)
+    monkeypatch.setenv('AWS_STATE_STORE', f'file://{tmp_path_factory.mktemp("state")}')
+    scanner.main({}, Context())
+    assert sorted(x['user_name'] for x in resumed) == sorted(x['user_name'] for x in sent_requests(expected))
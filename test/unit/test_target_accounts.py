@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import pytest
+
+from common import AssumedRoleSessionPool
+from common import load_target_accounts
+
+ROLE_ARN = 'arn:aws:iam::111111111111:role/iam-rotate-credentials'
+
+class StsClient(object):
+    """sts client returning credentials valid for validity seconds"""
+
+    def __init__(self, validity=3600):
+        self.validity = validity
+        self.calls = []
+
+    def assume_role(self, RoleArn, RoleSessionName, DurationSeconds):
+        self.calls.append((RoleArn, RoleSessionName))
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.validity)
+        return {'Credentials': {'AccessKeyId': f'ASIA{len(self.calls):016d}', 'SecretAccessKey': 'secret',
+                                'SessionToken': 'token', 'Expiration': expiration}}
+
+def test_role_assumed_on_first_use():
+    sts_client = StsClient()
+    pool = AssumedRoleSessionPool(sts_client, session_name='iam-rotate-credentials-update')
+    session = pool.get(ROLE_ARN)
+    session.client('iam', region_name='eu-west-1')
+    assert sts_client.calls == []
+    credentials = session.get_credentials().get_frozen_credentials()
+    assert credentials.access_key == 'ASIA0000000000000001'
+    assert credentials.token == 'token'
+    assert sts_client.calls == [(ROLE_ARN, 'iam-rotate-credentials-update')]
+    # kept by the pool and not assumed again while the credentials are valid
+    assert pool.get(ROLE_ARN) is session
+    session.get_credentials().get_frozen_credentials()
+    assert len(sts_client.calls) == 1
+
+def test_role_assumed_again_before_expiry():
+    sts_client = StsClient(validity=60)
+    session = AssumedRoleSessionPool(sts_client).get(ROLE_ARN)
+    credentials = session.get_credentials()
+    assert credentials.get_frozen_credentials().access_key == 'ASIA0000000000000001'
+    assert credentials.get_frozen_credentials().access_key == 'ASIA0000000000000002'
+
+def test_client_of_account_not_in_target_accounts_is_rejected(scanner, monkeypatch):
+    common = scanner.common
+    monkeypatch.setattr(common, 'target_accounts', load_target_accounts(f'[{{"role_arn": "{ROLE_ARN}"}}]'))
+    monkeypatch.setattr(common, '_clients', {})
+    assert common.account_client('111111111111', 'iam') is not None
+    with pytest.raises(ValueError, match='Account 222222222222 is not a target account'):
+        common.account_client('222222222222', 'iam')
+    # the client of deployment account
+    assert common.account_client(None, 'iam') is not common.account_client('111111111111', 'iam')
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import json
+
+import pytest
+
+from conftest import Context
+from fake_aws import FakeAwsError
+import notification
+from request_tracker import RequestTracker
+from state_store import MemoryStateStore
+
+@pytest.fixture
+def updater(scanner, monkeypatch):
+    """update lambda with its own request tracker"""
+    import lambdaUpdateIamCredentialsForUserHandler as updater
+    monkeypatch.setattr(updater, 'request_tracker', RequestTracker(MemoryStateStore()))
+    return updater
+
+def records_of(messages):
+    return [{'messageId': str(i), 'body': x} for i, x in enumerate(messages)]
+
+def scanned_requests(scanner, fake, count):
+    """messages of the first requests of scan with access keys only"""
+    scanner.main({}, Context())
+    messages = [x for x in fake.messages if json.loads(x)['access_key_ids'] and not json.loads(x)['login_profile']]
+    assert len(messages) >= count
+    return messages[:count]
+
+def test_failed_records_do_not_stop_the_batch(scanner, updater, fake_aws):
+    fake = fake_aws(100)
+    messages = scanned_requests(scanner, fake, 3)
+    deleted_user = json.dumps({'user_name': 'user-deleted', 'access_key_ids': ['AKIA0000000000000000']})
+    records = records_of([messages[0], '{not json', messages[1], deleted_user, messages[2]])
+    result = updater.main({'Records': records}, Context())
+    assert sorted(x['itemIdentifier'] for x in result['batchItemFailures']) == ['1', '3']
+    assert fake.emails == 3
+    assert fake.calls[('iam', 'CreateAccessKey')] == sum(len(json.loads(x)['access_key_ids']) for x in messages)
+
+def test_records_of_same_user_rotate_once(scanner, updater, fake_aws):
+    fake = fake_aws(100)
+    message = scanned_requests(scanner, fake, 1)[0]
+    # the records in parallel would check the request tracker before the first rotation is done
+    fake.latency = 0.01
+    result = updater.main({'Records': records_of([message] * 4)}, Context())
+    assert result['batchItemFailures'] == []
+    assert fake.calls[('iam', 'CreateAccessKey')] == len(json.loads(message)['access_key_ids'])
+    assert fake.emails == 1
+
+def test_access_key_deleted_by_previous_attempt(scanner, updater, fake_aws):
+    fake = fake_aws(100)
+    message = scanned_requests(scanner, fake, 1)[0]
+    request = json.loads(message)
+    # the previous attempt failed after the deletion of the access keys
+    for access_key_id in request['access_key_ids']:
+        fake._iam_delete_access_key(request['user_name'], access_key_id)
+    result = updater.main({'Records': records_of([message])}, Context())
+    assert result['batchItemFailures'] == []
+    assert fake.calls[('iam', 'CreateAccessKey')] == len(request['access_key_ids'])
+    assert fake.emails == 1
+
+def test_credentials_not_sent_are_refreshed_again(scanner, updater, fake_aws, monkeypatch):
+    fake = fake_aws(100)
+    message = scanned_requests(scanner, fake, 1)[0]
+    user = fake._users[json.loads(message)['user_name']]
+    send_email = fake._ses_send_email
+
+    def throttled_send_email(**kwargs):
+        raise FakeAwsError('Throttling', 'Maximum sending rate exceeded.')
+    monkeypatch.setattr(fake, '_ses_send_email', throttled_send_email)
+    monkeypatch.setattr(notification.time, 'sleep', lambda x: None)
+    # no time left to retry the throttled emails
+    result = updater.main({'Records': records_of([message])}, Context(remaining_time=5000))
+    assert result['batchItemFailures'] == [{'itemIdentifier': '0'}]
+    assert fake.emails == 0
+    not_sent_keys = [x['AccessKeyId'] for x in user.access_keys]
+
+    # retry of the record by SQS, the credentials not sent are refreshed again
+    monkeypatch.setattr(fake, '_ses_send_email', send_email)
+    result = updater.main({'Records': records_of([message])}, Context())
+    assert result['batchItemFailures'] == []
+    assert fake.emails == 1
+    assert user.access_keys and not set(not_sent_keys) & set(x['AccessKeyId'] for x in user.access_keys)
+
+    # done once sent
+    result = updater.main({'Records': records_of([message])}, Context())
+    assert fake.emails == 1
+
+def test_lines_of_users_are_sampled(scanner, updater, fake_aws, monkeypatch, caplog):
+    fake = fake_aws(100)
+    messages = scanned_requests(scanner, fake, 3)
+    monkeypatch.setattr(updater.common._log_sampler, 'rates', {'request': 0, 'rotated': 0, 'sent': 0})
+    caplog.clear()
+    with caplog.at_level('INFO'):
+        updater.main({'Records': records_of(messages)}, Context())
+    assert fake.emails == 3
+    assert not [x for x in caplog.records if getattr(x, 'category', None) in ('request', 'rotated', 'sent')]
+    summary = [x for x in caplog.records if getattr(x, 'category', None) == 'summary'][-1]
+    assert summary.fields['sampled_out']['sent'] == 3
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+
+import pytest
+
+from conftest import Context
+from conftest import sent_requests
+from common import RefreshCredentialRequest
+
+KEY = 'signing-key'
+
+def signed_request(**kwargs):
+    request = RefreshCredentialRequest(user_name='user-1', **kwargs)
+    request.attach_user_context(KEY, 'user-1@example.com', True, None)
+    # sent to SQS in json
+    return RefreshCredentialRequest(**json.loads(json.dumps(request.__dict__)))
+
+def test_valid_signature():
+    user_context = signed_request(account_id='111111111111').trusted_user_context(KEY, 60)
+    assert user_context['email'] == 'user-1@example.com'
+    assert user_context['password_reset_required'] is True
+    assert user_context['login_profile_exists'] is None
+
+@pytest.mark.parametrize('name, value', [('email', 'attacker@example.com'), ('password_reset_required', False),
+                                         ('login_profile_exists', True), ('validated_at', 2 ** 40)])
+def test_tampered_context(name, value):
+    request = signed_request()
+    request.user_context[name] = value
+    assert request.trusted_user_context(KEY, 60) is None
+
+@pytest.mark.parametrize('name, value', [('user_name', 'user-2'), ('account_id', '222222222222')])
+def test_context_of_other_user(name, value):
+    request = signed_request(account_id='111111111111')
+    setattr(request, name, value)
+    assert request.trusted_user_context(KEY, 60) is None
+
+def test_wrong_key():
+    request = signed_request()
+    assert request.trusted_user_context('other-key', 60) is None
+    assert request.trusted_user_context(None, 60) is None
+
+def test_expired_context(monkeypatch):
+    request = signed_request()
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 61)
+    assert request.trusted_user_context(KEY, 60) is None
+    assert request.trusted_user_context(KEY, 120) is not None
+
+def test_unknown_version_or_missing_context():
+    request = signed_request()
+    request.user_context['version'] = 2
+    assert request.trusted_user_context(KEY, 60) is None
+    request.user_context = None
+    assert request.trusted_user_context(KEY, 60) is None
+
+def test_scan_does_not_send_login_profile_of_report(scanner, fake_aws):
+    fake = fake_aws(100)
+    scanner.main({}, Context())
+    requests = sent_requests(fake)
+    assert requests
+    # the login profile can be created after the generation of credential report
+    assert all(x['user_context']['login_profile_exists'] is None for x in requests)
@@ -44,6 +44,174 @@ variable "aws_cli_time_limit" {
   default     = 90
 }
 
+variable "scan_concurrency" {
+  description = "Number of users evaluated in parallel by the lambda that research the users to refresh."
+  type        = number
+  default     = 4
+}
+
+variable "scan_shards" {
+  description = "Number of shards of users, each shard is scanned by its own invocation of the lambda that research the users to refresh ( 1 : no shard )."
+  type        = number
+  default     = 1
+}
+
+variable "credential_report_max_age" {
+  description = "Duration of reuse of the IAM credential report by the scans (expressed in seconds, IAM generates a new report every 4 hours at most / 0 : generated by each scan )."
+  type        = number
+  default     = 14400
+}
+
+variable "credential_report_shared_cache" {
+  description = "Keep the IAM credential report in the state bucket to share it between the invocations of the lambda that research the users to refresh ( else it is kept in /tmp of warm lambdas )."
+  type        = bool
+  default     = false
+}
+
+variable "scan_max_concurrency" {
+  description = "Maximum number of invocations of the lambda that research the users to refresh running in parallel ( accounts and shards scans ), -1 : no limit."
+  type        = number
+  default     = -1
+}
+
+variable "target_accounts" {
+  description = "Accounts where the users are managed in addition to the account of deployment, by the role assumed in each account ( name is used in emails sent to users )."
+  type        = list(object({ role_arn = string, name = string }))
+  default     = []
+}
+
+variable "rotation_policy_rules" {
+  description = "Time limits of the users of an IAM path prefix ( path ) or of an IAM group ( group ), in days : [{ path = \"/admin/\", cli_time_limit = 30 }, { group = \"contractors\", login_profile_time_limit = 60 }]. The tags of user take precedence, then the strictest group rule, then the longest path prefix, then aws_cli_time_limit and aws_login_profile_time_limit."
+  type        = list(map(string))
+  default     = []
+}
+
+variable "iam_events" {
+  description = "Evaluate the user of each CloudTrail IAM event ( CreateUser, TagUser, UntagUser, CreateAccessKey, UpdateAccessKey, CreateLoginProfile, UpdateLoginProfile ) without waiting for the next scan. The IAM events are only delivered in us-east-1."
+  type        = bool
+  default     = false
+}
+
+variable "incremental_scan" {
+  description = "Evaluate only the users past due or with changed tags or credentials ( the next due date of each user is kept in the state bucket )."
+  type        = bool
+  default     = true
+}
+
+variable "evaluation_mode" {
+  description = "Evaluation mode of obsolete credentials : report ( from the IAM credential report ) or live ( IAM calls for each user )."
+  type        = string
+  default     = "report"
+}
+
+variable "ses_verification_ttl" {
+  description = "Duration of cache of AWS SES verification status of emails and domains (expressed in seconds)."
+  type        = number
+  default     = 3600
+}
+
+variable "notification_suppression_window" {
+  description = "Duration where a category of warnings or errors identical to the last published one is not published again on the SNS result topic (expressed in seconds / 0 : always published)."
+  type        = number
+  default     = 86400
+}
+
+variable "record_concurrency" {
+  description = "Number of requests processed in parallel by the lambda that update the credentials."
+  type        = number
+  default     = 5
+}
+
+variable "request_deduplication_ttl" {
+  description = "Duration where a credential already requested ( in flight or refreshed ) is not requested again (expressed in seconds / 0 : no deduplication)."
+  type        = number
+  default     = 86400
+}
+
+variable "request_context_ttl" {
+  description = "Duration of validity of the user data resolved by the scan and sent in the request (expressed in seconds)."
+  type        = number
+  default     = 3600
+}
+
+variable "client_retry_mode" {
+  description = "Retry mode of the AWS clients of lambdas : adaptive ( client side rate limiting after throttling ), standard or legacy."
+  type        = string
+  default     = "adaptive"
+}
+
+variable "client_max_attempts" {
+  description = "Maximum number of retries of an AWS call ( the IAM calls of the scan are retried at least 10 times )."
+  type        = number
+  default     = 5
+}
+
+variable "client_connect_timeout" {
+  description = "Timeout of the connection to AWS endpoints ( in seconds )."
+  type        = number
+  default     = 5
+}
+
+variable "client_read_timeout" {
+  description = "Timeout of the read of AWS responses ( in seconds )."
+  type        = number
+  default     = 60
+}
+
+variable "client_max_pool_connections" {
+  description = "Minimum size of the pool of connections of each AWS client ( the clients used in parallel get a larger pool )."
+  type        = number
+  default     = 10
+}
+
+variable "log_format" {
+  description = "Format of the logs of lambdas : json ( one document by line, fields discovered by CloudWatch Logs Insights ) or text."
+  type        = string
+  default     = "json"
+}
+
+variable "log_level" {
+  description = "Level of the logs of lambdas ( DEBUG logs each step of each user )."
+  type        = string
+  default     = "INFO"
+}
+
+variable "log_sampling" {
+  description = "Part of the routine log lines of users kept by category : <category>=<rate> separated by comma, 0 : none. Each run ends with a summary of the users excluded by reason."
+  type        = string
+  default     = "not_due=0.01,not_obsolete=0.01,already_requested=0.01"
+}
+
+variable "metrics_namespace" {
+  description = "CloudWatch namespace of the metrics of lambdas ( emitted in logs with embedded metric format ), empty to disable the metrics."
+  type        = string
+  default     = "IamRotateCredentials"
+}
+
+variable "email_templates" {
+  description = "Templates of email sent to users which replace the default templates, by template name ( ex: body.html )."
+  type        = map(string)
+  default     = {}
+}
+
+variable "sqs_batch_size" {
+  description = "Maximum number of requests sent in one invocation of the lambda that update the credentials ( more than 10 requires sqs_batching_window )."
+  type        = number
+  default     = 10
+}
+
+variable "sqs_batching_window" {
+  description = "Maximum time to gather requests before invoking the lambda that update the credentials (expressed in seconds)."
+  type        = number
+  default     = 0
+}
+
+variable "sqs_max_receive_count" {
+  description = "Number of attempts of a request before it is moved to the dead letter queue."
+  type        = number
+  default     = 3
+}
+
 variable "aws_account_name" {
   description ="Name of Aws Account ( use in email sender to user where credentials are obsoletes )"
   type = string